@@ -0,0 +1,211 @@
+"""Benchmark a master and local workers end to end and write the results as JSON.
+
+Starts a master and up to ``--workers`` workers, each in its own process, on
+loopback and measures:
+
+* tiny jobs: jobs per second, one after the other and many at once over a
+  :class:`overkill.overkill.ClusterExecutor`, and the p50/p99 latency of a job
+* large arrays: items per second of a job over a large array
+* serialization: encode and decode time of a chunk against its size
+* scaling: items per second of a cpu bound job from 1 to ``--workers`` workers
+
+The results are written as JSON with the commit, python version and machine they
+were measured on, so that runs can be compared over time.
+
+Run from the root of the repository::
+
+    python -m benchmarks.bench_cluster --workers 4 --output results.json
+"""
+
+import argparse
+import functools
+import json
+import math
+import os
+import platform
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+
+import overkill
+from benchmarks.bench_serializers import bench as bench_serializer
+from overkill.overkill import ClusterCompute, ClusterExecutor
+from overkill.servers._serializers import DEFAULT_SERIALIZER
+from overkill.servers.master import Master
+from overkill.servers.worker import Worker
+
+
+def square(x):
+    return x * x
+
+
+def busy(x, loops=1000):
+    """A cpu bound function, ``loops`` iterations per element"""
+    total = 0
+    for i in range(loops):
+        total += i * x
+    return total
+
+
+def percentile(values: list, q: float) -> float:
+    """The q-th percentile (0-100) of the values, by nearest rank"""
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(q / 100 * len(ordered)) - 1)]
+
+
+def start_worker(address: tuple, name: str) -> subprocess.Popen:
+    """Start a worker in its own process, it runs until its stdin is closed
+
+    :return: the worker's process
+    :rtype: subprocess.Popen
+    """
+    return subprocess.Popen([sys.executable, "-m", "benchmarks.bench_cluster", "--worker",
+                             f"{address[0]}:{address[1]}", "--name", name],
+                            stdin=subprocess.PIPE, stdout=subprocess.DEVNULL)
+
+
+def run_worker(master: str, name: str) -> None:
+    """Serve a worker until stdin is closed"""
+    ip, port = master.rsplit(":", 1)
+    w = Worker(name)
+    w.start()
+    w.connect_to_master(ip, int(port))
+    sys.stdin.read()
+    w.stop()
+
+
+def wait_for_workers(m: Master, count: int, timeout: float = 30.0) -> None:
+    """Wait until the master has count workers"""
+    deadline = time.monotonic() + timeout
+    while len(m.get_workers()) < count:
+        if time.monotonic() > deadline:
+            raise RuntimeError(f"Only {len(m.get_workers())} of {count} workers connected")
+        time.sleep(0.05)
+
+
+def bench_tiny_jobs(address: tuple, jobs: int, size: int) -> dict:
+    """Jobs per second and latency of jobs of size elements"""
+    cc = ClusterCompute(1, address)
+    latencies = []
+    start = time.perf_counter()
+    for _ in range(jobs):
+        job_start = time.perf_counter()
+        cc.map(square, list(range(size)))
+        latencies.append(time.perf_counter() - job_start)
+    sequential = jobs / (time.perf_counter() - start)
+
+    with ClusterExecutor(address) as executor:
+        start = time.perf_counter()
+        futures = [executor.submit_map(square, range(size)) for _ in range(jobs)]
+        for future in futures:
+            future.result()
+        concurrent = jobs / (time.perf_counter() - start)
+    return {"jobs": jobs, "size": size, "sequential_jobs_per_sec": sequential,
+            "concurrent_jobs_per_sec": concurrent,
+            "latency_p50_ms": percentile(latencies, 50) * 1000,
+            "latency_p99_ms": percentile(latencies, 99) * 1000}
+
+
+def bench_large_array(address: tuple, size: int, repeat: int) -> dict:
+    """Items per second of a job over a large array, best of repeat runs"""
+    cc = ClusterCompute(1, address)
+    array = list(range(size))
+    best = min(timed(cc.map, square, array) for _ in range(repeat))
+    return {"size": size, "seconds": best, "items_per_sec": size / best}
+
+
+def bench_serialization(sizes: list, repeat: int) -> list:
+    """Encode and decode time of a chunk of ints against its size"""
+    results = []
+    for size in sizes:
+        encode, decode, encoded = bench_serializer(DEFAULT_SERIALIZER, list(range(size)), repeat)
+        results.append({"size": size, "bytes": encoded, "encode_ms": encode * 1000,
+                        "decode_ms": decode * 1000})
+    return results
+
+
+def bench_scaling(m: Master, workers: list, max_workers: int, size: int, loops: int) -> list:
+    """Items per second of a cpu bound job with 1 to max_workers workers"""
+    address = m.get_address()
+    cc = ClusterCompute(1, address)
+    function = functools.partial(busy, loops=loops)
+    array = list(range(size))
+    results = []
+    for count in range(1, max_workers + 1):
+        while len(workers) < count:
+            workers.append(start_worker(address, f"bench-{len(workers)}"))
+        wait_for_workers(m, count)
+        cc.map(function, array[:count * 100])  # warm up the throughput estimates
+        seconds = timed(cc.map, function, array)
+        results.append({"workers": count, "seconds": seconds, "items_per_sec": size / seconds})
+    return results
+
+
+def timed(function, *args) -> float:
+    """Seconds a call takes"""
+    start = time.perf_counter()
+    function(*args)
+    return time.perf_counter() - start
+
+
+def environment() -> dict:
+    """What the benchmark ran on"""
+    try:
+        commit = subprocess.check_output(["git", "rev-parse", "HEAD"],
+                                         stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {"time": datetime.now(timezone.utc).isoformat(), "commit": commit,
+            "version": overkill.__version__, "python": platform.python_version(),
+            "platform": platform.platform(), "cpus": os.cpu_count()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--workers", type=int, default=2, help="maximum number of workers")
+    parser.add_argument("--jobs", type=int, default=200, help="number of tiny jobs")
+    parser.add_argument("--tiny-size", type=int, default=10, help="elements per tiny job")
+    parser.add_argument("--size", type=int, default=10 ** 6, help="elements of the large array")
+    parser.add_argument("--scaling-size", type=int, default=20000,
+                        help="elements of the cpu bound job")
+    parser.add_argument("--loops", type=int, default=1000,
+                        help="iterations per element of the cpu bound job")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per measurement")
+    parser.add_argument("--output", help="file to write the JSON results to, defaults to stdout")
+    parser.add_argument("--worker", help=argparse.SUPPRESS)  # master address of a worker
+    parser.add_argument("--name", default="bench", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        run_worker(args.worker, args.name)
+        return
+
+    m = Master()
+    m.start()
+    workers = []
+    try:
+        results = {"environment": environment(), "parameters": vars(args)}
+        results["serialization"] = bench_serialization(
+            [10 ** e for e in range(2, 7)], args.repeat)
+        results["scaling"] = bench_scaling(m, workers, args.workers, args.scaling_size,
+                                           args.loops)
+        results["tiny_jobs"] = bench_tiny_jobs(m.get_address(), args.jobs, args.tiny_size)
+        results["large_array"] = bench_large_array(m.get_address(), args.size, args.repeat)
+    finally:
+        for worker in workers:
+            worker.stdin.close()
+        for worker in workers:
+            worker.wait()
+        m.stop()
+
+    del results["parameters"]["worker"], results["parameters"]["name"]
+    if args.output is None:
+        print(json.dumps(results, indent=2))
+        return
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
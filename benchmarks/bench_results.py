@@ -0,0 +1,81 @@
+"""Benchmark assembling the results of a job and encoding the FINISHED_TASK reply.
+
+Compares inserting chunks into a list, flattening and encoding the flat list
+(the previous implementation) against storing chunks in the work order's
+preallocated slots and encoding the chunks as they are.
+
+Run from the root of the repository::
+
+    python -m benchmarks.bench_results --size 10000000
+"""
+
+import argparse
+import random
+import time
+from threading import Event
+
+from overkill.servers._server_data_classes import WorkOrder
+from overkill.servers._utils import encode_dict, flatten, split_weighted
+
+
+def arrivals(size: int, num_chunks: int) -> list:
+    """Computed chunks of a job in a random completion order
+
+    :return: list of (order, chunk)
+    :rtype: list
+    """
+    chunks = split_weighted(list(range(size)), [1] * num_chunks)
+    arrived = list(enumerate(chunks))
+    random.shuffle(arrived)
+    return arrived
+
+
+def bench_insert(arrived: list, num_chunks: int) -> tuple:
+    """list.insert every chunk, flatten and encode the flat list
+
+    :return: assemble seconds, encode seconds, encoded size in bytes
+    :rtype: tuple
+    """
+    start = time.perf_counter()
+    data = []
+    for order, chunk in arrived:
+        data.insert(order, chunk)
+    flat = flatten(data)
+    assembled = time.perf_counter()
+    encoded = encode_dict({"type": "finished_task", "data": flat})
+    return assembled - start, time.perf_counter() - assembled, len(encoded)
+
+
+def bench_slots(arrived: list, num_chunks: int) -> tuple:
+    """Store every chunk in its slot of a work order and encode the chunks
+
+    :return: assemble seconds, encode seconds, encoded size in bytes
+    :rtype: tuple
+    """
+    start = time.perf_counter()
+    work_order = WorkOrder(num_chunks, Event(), chunks=[None] * num_chunks)
+    for order, chunk in arrived:
+        work_order.update(chunk, order)
+    assembled = time.perf_counter()
+    encoded = encode_dict({"type": "finished_task", "chunks": work_order.results()})
+    return assembled - start, time.perf_counter() - assembled, len(encoded)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--size", type=int, default=10 ** 7, help="elements per job")
+    parser.add_argument("--chunks", type=int, default=64, help="chunks per job")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per measurement")
+    args = parser.parse_args()
+
+    arrived = arrivals(args.size, args.chunks)
+    print(f"{'assembly':<10}{'assemble ms':>14}{'encode ms':>12}{'bytes':>14}")
+    for name, bench in (("insert", bench_insert), ("slots", bench_slots)):
+        runs = [bench(arrived, args.chunks) for _ in range(args.repeat)]
+        assemble = min(r[0] for r in runs)
+        encode = min(r[1] for r in runs)
+        print(f"{name:<10}{assemble * 1000:>14.2f}{encode * 1000:>12.2f}{runs[0][2]:>14}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,54 @@
+"""Benchmark encoding and decoding messages with each serializer.
+
+Run from the root of the repository::
+
+    python -m benchmarks.bench_serializers --size 1000000
+"""
+
+import argparse
+import timeit
+
+from overkill.servers._serializers import DILL, MSGPACK, PICKLE, msgpack
+from overkill.servers._utils import decode_message, encode_dict
+
+
+def payloads(size: int) -> dict:
+    """Typical message payloads of the given number of elements"""
+    return {
+        "ints": list(range(size)),
+        "floats": [i / 3 for i in range(size)],
+        "strings": [str(i) for i in range(size)],
+        "dicts": [{"id": i, "name": str(i)} for i in range(size // 10)],
+    }
+
+
+def bench(serializer: str, payload: list, repeat: int) -> tuple:
+    """Time the best of repeat runs of encoding and decoding a DELEGATE_WORK like message
+
+    :return: encode seconds, decode seconds, encoded size in bytes
+    :rtype: tuple
+    """
+    message = {"type": "delegate_work", "work_id": 1, "order": 0, "array": payload}
+    encoded = encode_dict(message, serializer=serializer)
+    encode = min(timeit.repeat(lambda: encode_dict(message, serializer=serializer),
+                               number=1, repeat=repeat))
+    decode = min(timeit.repeat(lambda: decode_message(encoded), number=1, repeat=repeat))
+    return encode, decode, len(encoded)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--size", type=int, default=100000, help="elements per payload")
+    parser.add_argument("--repeat", type=int, default=5, help="runs per measurement")
+    args = parser.parse_args()
+
+    serializers = [DILL, PICKLE] + ([MSGPACK] if msgpack is not None else [])
+    print(f"{'payload':<10}{'serializer':<12}{'encode ms':>12}{'decode ms':>12}{'bytes':>14}")
+    for name, payload in payloads(args.size).items():
+        for serializer in serializers:
+            encode, decode, size = bench(serializer, payload, args.repeat)
+            print(f"{name:<10}{serializer:<12}{encode * 1000:>12.2f}{decode * 1000:>12.2f}{size:>14}")
+
+
+if __name__ == "__main__":
+    main()
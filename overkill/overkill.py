@@ -2,17 +2,85 @@
 See the :class:`ClusterCompute` for more details on distributing tasks.
 """
 
+import asyncio
+import functools
+import itertools
+import os
 import socket
-from typing import Callable, Dict, List, Tuple, Union
+import threading
+import time
+from collections.abc import Mapping
+from concurrent.futures import Executor, Future
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Tuple, Union
 
+from overkill.servers import _tracing
+from overkill.servers._channels import Channel, recv_or_none
+
+from overkill.servers._compression import available_codecs
+from overkill.servers._serializers import DEFAULT_SERIALIZER, get_serializer
 from overkill.servers._server_exceptions import NoWorkersError, WorkError
-from overkill.servers._server_messaging_standards import (DISTRIBUTE,
+from overkill.servers._server_messaging_standards import (BROADCAST,
+                                                          BROADCAST_STORED,
+                                                          DISTRIBUTE,
+                                                          END_OF_INPUT,
                                                           FINISHED_TASK,
+                                                          INPUT_CHUNK,
                                                           NO_WORKERS_ERROR,
+                                                          PARTIAL_RESULT,
+                                                          RELEASE,
+                                                          STARTED_TASK,
+                                                          STATUS,
                                                           WORK_ERROR)
-from overkill.servers._utils import (decode_message, encode_dict, recv_msg,
+from overkill.servers._utils import (Reassembler, decode_message,
+                                     encode_broadcast, encode_dict,
+                                     encode_function, flatten, recv_msg,
                                      socket_send_message)
 
+__all__ = ["ClusterCompute", "ClusterExecutor", "Broadcast"]
+
+_LOCAL = object()  # marks a handle whose variable is not held locally
+_MISSING = object()  # marks a map-reduce without an initial value
+
+
+class Broadcast:
+    """Handle of a variable that has been broadcast to every worker,
+    returned by :meth:`ClusterCompute.broadcast`.
+    Only the digest of the variable is pickled with a function that uses the handle,
+    the variable itself is looked up in the worker's cache by ``value``
+
+    :param key: digest of the variable
+    :type key: str
+    :param value: the variable, kept by the handle that was returned to the user
+    :type value: Any, optional
+    """
+
+    def __init__(self, key: str, value: Any = _LOCAL) -> None:
+        self.key = key
+        self._value = value
+
+    @property
+    def value(self) -> Any:
+        """The broadcast variable
+
+        :raises BroadcastNotCachedError: the worker does not have the variable cached
+        :return: the variable
+        :rtype: Any
+        """
+        if self._value is not _LOCAL:
+            return self._value
+        from overkill.servers._worker import get_broadcast
+        return get_broadcast(self.key)
+
+    def __getstate__(self) -> Dict:
+        return {"key": self.key}
+
+    def __setstate__(self, state: Dict) -> None:
+        self.key = state["key"]
+        self._value = _LOCAL
+
+    def __repr__(self) -> str:
+        return f"Broadcast({self.key})"
+
 
 class ClusterCompute:
     """The ClusterCompute class acts as the main interface between the Master server and the user.
@@ -25,6 +93,26 @@ class ClusterCompute:
     :param master_address: A tuple of (ip, port) e.g. ("localhost", 5555).
         Use the .get_address() class member of the Master class to get the address
     :type master_address: Tuple[str, int]
+    :param serializer: serializer used to encode the array, one of "pickle", "dill"
+        or "msgpack" (if installed), defaults to "pickle".
+        The function is always encoded with dill
+    :type serializer: str, optional
+    :param chunk_size: number of elements pulled at a time from an iterable
+        that cannot be sliced (e.g. a generator), defaults to 1024
+    :type chunk_size: int, optional
+    :param window: maximum number of chunks of an iterable sent to the cluster
+        whose results have not come back yet, defaults to 8
+    :type window: int, optional
+    :param tenant: name the jobs are charged to, the cluster is shared fairly between
+        tenants, defaults to None (the host and process id of the user)
+    :type tenant: Union[None, str], optional
+    :param priority: jobs of a higher priority are served first (after small jobs of any
+        priority), defaults to 0
+    :type priority: int, optional
+    :param trace: whether to trace every ``map`` and ``map_reduce`` of an array that can be
+        sliced, or the path of a file to write the timeline of the last traced task to in the
+        Chrome trace format, defaults to False
+    :type trace: Union[bool, str], optional
 
     :Example:
 
@@ -34,50 +122,686 @@ class ClusterCompute:
     ...     return x**2
     >>> cc.map(f, [1, 2, 3])
     [1, 4, 9]
+    >>> for y in cc.imap(f, [1, 2, 3]):
+    ...     print(y)
+    1
+    4
+    9
+    >>> cc.map(f, (x for x in range(3)))
+    [0, 1, 4]
+    >>> table = cc.broadcast({1: "a", 2: "b"})
+    >>> cc.map(lambda x: table.value[x], [1, 2])
+    ['a', 'b']
+    >>> cc.release(table)
+    >>> cc.map_reduce(f, lambda a, b: a + b, [1, 2, 3])
+    14
 
     """
 
-    def __init__(self, n_workers: int, master_address: Tuple[str, int]) -> None:
+    def __init__(self, n_workers: int, master_address: Tuple[str, int],
+                 serializer: str = DEFAULT_SERIALIZER, chunk_size: int = 1024,
+                 window: int = 8, tenant: Union[None, str] = None, priority: int = 0,
+                 trace: Union[bool, str] = False) -> None:
         self.n_workers = n_workers
         self.master_address = master_address
+        self.serializer = get_serializer(serializer).name
+        self.chunk_size = max(1, chunk_size)
+        self.window = max(1, window)
+        self.tenant = tenant if tenant is not None else _default_tenant()
+        self.priority = priority
+        self.trace = trace
+        self._trace = []  # spans of the last traced task
+        self._executor = None  # runs the asyncio variants over one connection
 
-    def map(self, function: Callable, array: List) -> Union[None, List]:
-        """Distribute array over function using all compute resources
+    def map(self, function: Callable, array: Iterable) -> Union[None, List]:
+        """Distribute array over function using all compute resources.
+        Arrays that can be sliced (lists, tuples, NumPy arrays...) are sent to the master in
+        a single message and split across the cluster. Any other iterable is consumed lazily,
+        ``chunk_size`` elements at a time, and only ``window`` chunks are held by the
+        cluster at once
 
         :param function: Any array with a single argument
         :type function: Callable
-        :param array: array to distribute 
+        :param array: array or any other iterable to distribute
             e.g. if Array type is List[int] then function should accept an int
-        :type array: List
+        :type array: Iterable
         :return: Transformed list if no exception has been raised
         :rtype: Union[None, List]
         """
+        if not _sliceable(array):
+            completed = dict(self.__stream_lazy(function, array))
+            return flatten([completed[order] for order in range(len(completed))])
+        return self.__run(self.__task(function, array=array), _handle_result)
+
+    def map_reduce(self, mapper: Callable, reducer: Callable, array: Iterable,
+                   initial: Any = _MISSING) -> Any:
+        """Distribute array over mapper and reduce the results with reducer,
+        like ``functools.reduce(reducer, map(mapper, array), initial)``.
+        Workers reduce their own chunks and the master combines their partial results
+        in order, so only one value per chunk leaves the workers and only one value comes
+        back. The reducer must be associative
+
+        :param mapper: function with a single argument
+        :type mapper: Callable
+        :param reducer: associative function of two arguments
+        :type reducer: Callable
+        :param array: array or any other iterable to distribute
+        :type array: Iterable
+        :param initial: value placed before the results, defaults to no initial value
+        :type initial: Any, optional
+        :raises TypeError: the array is empty and there is no initial value
+        :return: the reduced value
+        :rtype: Any
+        """
+        if not _sliceable(array):
+            # partial results are streamed back chunk by chunk and combined here
+            completed = dict(self.__stream_lazy(mapper, array, reducer))
+            partials = flatten([completed[order] for order in range(len(completed))])
+            if initial is not _MISSING:
+                partials.insert(0, initial)
+            if not partials:
+                raise TypeError("map_reduce() of empty iterable with no initial value")
+            return functools.reduce(reducer, partials)
+        connection_message = self.__task(mapper, reducer=encode_function(reducer)[0],
+                                         array=array)
+        if initial is not _MISSING:
+            connection_message["initial"] = initial
+        return self.__run(connection_message, _handle_reduced)
+
+    async def map_async(self, function: Callable, array: Iterable) -> List:
+        """Awaitable variant of :meth:`map`, many jobs can be awaited at once.
+        Every awaitable job shares one connection to the master, see :class:`ClusterExecutor`.
+        Call :meth:`close` to close it once it is no longer needed
+
+        :param function: Any array with a single argument
+        :type function: Callable
+        :param array: finite iterable to distribute
+        :type array: Iterable
+        :return: Transformed list if no exception has been raised
+        :rtype: List
+        """
+        return await asyncio.wrap_future(self.__get_executor().submit_map(function, array))
+
+    async def map_reduce_async(self, mapper: Callable, reducer: Callable, array: Iterable,
+                               initial: Any = _MISSING) -> Any:
+        """Awaitable variant of :meth:`map_reduce`, many jobs can be awaited at once
+
+        :param mapper: function with a single argument
+        :type mapper: Callable
+        :param reducer: associative function of two arguments
+        :type reducer: Callable
+        :param array: finite iterable to distribute
+        :type array: Iterable
+        :param initial: value placed before the results, defaults to no initial value
+        :type initial: Any, optional
+        :raises TypeError: the array is empty and there is no initial value
+        :return: the reduced value
+        :rtype: Any
+        """
+        future = self.__get_executor().submit_map_reduce(mapper, reducer, array, initial)
+        return await asyncio.wrap_future(future)
+
+    def close(self) -> None:
+        """Close the connection used by the asyncio variants once their jobs are done"""
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+
+    def __get_executor(self) -> "ClusterExecutor":
+        """Executor the asyncio variants run their jobs on, created on first use
+
+        :return: executor of this user
+        :rtype: ClusterExecutor
+        """
+        if self._executor is None:
+            self._executor = ClusterExecutor(self.master_address, self.serializer,
+                                             self.tenant, self.priority)
+        return self._executor
+
+    def broadcast(self, obj: Any) -> Broadcast:
+        """Send an object to every worker once, to be used by any number of jobs.
+        Large objects shared by every call of a function (e.g. lookup tables or model weights)
+        should be broadcast instead of captured by the function, which sends them with every
+        job. Functions dereference the returned handle with ``handle.value``.
+        Workers cache the object by its digest until it is released with :meth:`release`
+        or evicted from their cache, in which case the master sends it again
+
+        :param obj: object to broadcast, it is encoded with dill
+        :type obj: Any
+        :return: handle of the object
+        :rtype: Broadcast
+        """
+        value, key = encode_broadcast(obj)
         with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
-            connection_message = {
-                "type": DISTRIBUTE,
-                "function": function,
-                "array": array
-            }
             sock.connect(self.master_address)
-            socket_send_message(encode_dict(connection_message), sock)
+            message = {"type": BROADCAST, "key": key, "value": value}
+            socket_send_message(encode_dict(message, serializer=self.serializer), sock)
             result = decode_message(recv_msg(sock))
-        return self.__handle_result(result)
+        if result.get("type") != BROADCAST_STORED:
+            _handle_result(result)
+        return Broadcast(key, obj)
 
-    def __handle_result(self, result: Dict) -> List:
-        """Handle returned data from master.
-        Asssume that communications are with the master exclusively (no malicious users)
-        and that only dictionaries are returned. Current implementation assumes a dictionary
-        of the form {"type": str, "data": List}
+    def release(self, handle: Broadcast) -> None:
+        """Drop a broadcast object from the master and every worker.
+        Jobs that use it afterwards fail
 
-        :param result: dictionary of the form {"type": str, "data": List}
-        :type result: Dict
-        :return: transformed list from cluster
-        :rtype: List
+        :param handle: handle returned by :meth:`broadcast`
+        :type handle: Broadcast
+        """
+        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+            sock.connect(self.master_address)
+            message = {"type": RELEASE, "key": handle.key}
+            socket_send_message(encode_dict(message, serializer=self.serializer), sock)
+
+    def status(self) -> Dict[str, List[Dict]]:
+        """Get the state of the master's job queue. Jobs of every user of the master share
+        the cluster: small jobs are served first, then jobs of a higher priority, and
+        tenants share the rest fairly
+
+        :return: dict of queued, running and completed (the most recently completed jobs),
+            each a list of dicts of work_id, tenant, priority, num_chunks, completed,
+            progress, elapsed (seconds since the job was submitted) and error
+        :rtype: Dict[str, List[Dict]]
+        """
+        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+            sock.connect(self.master_address)
+            socket_send_message(encode_dict({"type": STATUS}, serializer=self.serializer), sock)
+            result = decode_message(recv_msg(sock))
+        return {key: result[key] for key in ("queued", "running", "completed")}
+
+    def imap(self, function: Callable, array: Iterable) -> Iterator:
+        """Distribute array over function using all compute resources and
+        yield the results in order as soon as they are available
+
+        :param function: Any array with a single argument
+        :type function: Callable
+        :param array: array or any other iterable to distribute
+        :type array: Iterable
+        :return: iterator over the transformed array
+        :rtype: Iterator
+        """
+        completed = {}
+        next_order = 0
+        for order, data in self.__stream(function, array):
+            completed[order] = data
+            while next_order in completed:
+                yield from completed.pop(next_order)
+                next_order += 1
+
+    def imap_unordered(self, function: Callable, array: Iterable) -> Iterator:
+        """Distribute array over function using all compute resources and
+        yield the results as soon as they are available.
+        Results are yielded in the order the cluster computes them
+
+        :param function: Any array with a single argument
+        :type function: Callable
+        :param array: array or any other iterable to distribute
+        :type array: Iterable
+        :return: iterator over the transformed array in no particular order
+        :rtype: Iterator
+        """
+        for _, data in self.__stream(function, array):
+            yield from data
+
+    def __stream(self, function: Callable, array: Iterable) -> Iterator[Tuple[int, List]]:
+        """Ask the master to stream back each chunk of the array as it is computed
+
+        :param function: Any array with a single argument
+        :type function: Callable
+        :param array: array or any other iterable to distribute
+        :type array: Iterable
+        :return: iterator of (index of the chunk, transformed chunk)
+        :rtype: Iterator[Tuple[int, List]]
         """
-        return_type = result.get("type")
-        if return_type == FINISHED_TASK:
-            return result.get("data")
-        if return_type == WORK_ERROR:
-            raise WorkError(result.get("error"))
-        if return_type == NO_WORKERS_ERROR:
-            raise NoWorkersError("There are no workers connected to master")
+        if not _sliceable(array):
+            yield from self.__stream_lazy(function, array)
+            return
+        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+            connection_message = self.__task(function, array=array, stream=True)
+            sock.connect(self.master_address)
+            socket_send_message(encode_dict(connection_message, serializer=self.serializer), sock)
+            while True:
+                result = decode_message(recv_msg(sock))
+                if result.get("type") != PARTIAL_RESULT:
+                    _handle_result(result)
+                    return
+                yield result["order"], result["data"]
+
+    def __stream_lazy(self, function: Callable, iterable: Iterable,
+                      reducer: Union[None, Callable] = None) -> Iterator[Tuple[int, List]]:
+        """Pull the iterable one chunk at a time and send each chunk to the master,
+        never keeping more than ``window`` chunks in the cluster.
+        Each chunk is streamed back as soon as it is computed
+
+        :param function: Any array with a single argument
+        :type function: Callable
+        :param iterable: iterable to distribute
+        :type iterable: Iterable
+        :param reducer: reducer of a map-reduce, each chunk is then streamed back
+            as a list of its partial result, defaults to None
+        :type reducer: Union[None, Callable], optional
+        :return: iterator of (index of the chunk, transformed chunk)
+        :rtype: Iterator[Tuple[int, List]]
+        """
+        iterator = iter(iterable)
+        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+            connection_message = self.__task(function, lazy=True)
+            if reducer is not None:
+                connection_message["reducer"] = encode_function(reducer)[0]
+            sock.connect(self.master_address)
+            socket_send_message(encode_dict(connection_message, serializer=self.serializer), sock)
+            result = decode_message(recv_msg(sock))
+            if result.get("type") != STARTED_TASK:
+                _handle_result(result)
+                return
+            work_id = result["work_id"]
+
+            in_flight = 0
+            exhausted = False
+            while True:
+                while not exhausted and in_flight < self.window:
+                    chunk = list(itertools.islice(iterator, self.chunk_size))
+                    if not chunk:
+                        exhausted = True
+                        message = {"type": END_OF_INPUT, "work_id": work_id}
+                    else:
+                        in_flight += 1
+                        message = {"type": INPUT_CHUNK, "work_id": work_id, "array": chunk}
+                    socket_send_message(encode_dict(message, serializer=self.serializer), sock)
+                result = decode_message(recv_msg(sock))
+                if result.get("type") != PARTIAL_RESULT:
+                    _handle_result(result)
+                    return
+                in_flight -= 1
+                yield result["order"], result["data"]
+
+    def get_trace(self) -> List[Dict]:
+        """Get the timeline of the last traced task.
+        With ``trace`` on, the stages of a task on the user, the master and every worker
+        (encoding, decoding, slicing, queueing, computing, flattening...) are timed and sent
+        back with the result. Open the file written with ``trace="trace.json"`` in
+        chrome://tracing or https://ui.perfetto.dev to see it
+
+        :return: list of spans ordered by their start, dicts of name, process (user, master or
+            worker <name>), start (seconds since the epoch), duration (seconds), thread and args
+        :rtype: List[Dict]
+        """
+        return list(self._trace)
+
+    def __run(self, message: Dict, handler: Callable[[Dict], Any]) -> Any:
+        """Send a task to the master in a single message and handle its reply,
+        tracing it if tracing is on
+
+        :param message: task to send
+        :type message: Dict
+        :param handler: function turning the reply into the result
+        :type handler: Callable[[Dict], Any]
+        :return: the result
+        :rtype: Any
+        """
+        trace_id = None
+        if self.trace:
+            trace_id = message["trace_id"] = _tracing.new_trace_id()
+        timer = _Timer(trace_id)
+        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+            encoded = timer.time("encode", encode_dict, message, serializer=self.serializer)
+            sock.connect(self.master_address)
+            timer.time("send", socket_send_message, encoded, sock)
+            data = timer.time("wait", recv_msg, sock)
+        result = timer.time("decode", decode_message, data)
+        spans = result.pop("trace", []) if trace_id is not None else []
+        result = timer.time("handle result", handler, result)
+        if trace_id is not None:
+            self._trace = sorted(spans + _tracing.collect(trace_id),
+                                 key=lambda span: span["start"])
+            if isinstance(self.trace, str):
+                _tracing.write_chrome_trace(self._trace, self.trace)
+        return result
+
+    def __task(self, function: Callable, **fields) -> Dict:
+        """Message asking the master to distribute a task
+
+        :param function: function to distribute, it is encoded with dill
+        :type function: Callable
+        :return: dictionary of type, function, codecs, tenant, priority and the given fields
+        :rtype: Dict
+        """
+        return {"type": DISTRIBUTE, "function": encode_function(function)[0],
+                "codecs": available_codecs(), "tenant": self.tenant,
+                "priority": self.priority, **fields}
+
+
+class ClusterExecutor(Executor):
+    """A :class:`concurrent.futures.Executor` that runs calls on the cluster,
+    so that code written for a thread or process pool can use the cluster unchanged.
+    Every task is sent over one persistent connection to the master, many tasks
+    run at once and the future of a task is resolved as soon as its result comes back.
+    Functions and their arguments are encoded with dill
+
+    :param master_address: A tuple of (ip, port) e.g. ("localhost", 5555)
+    :type master_address: Tuple[str, int]
+    :param serializer: serializer used to encode the arguments, one of "pickle", "dill"
+        or "msgpack" (if installed), defaults to "pickle"
+    :type serializer: str, optional
+    :param tenant: name the tasks are charged to when the cluster is shared between
+        tenants, defaults to None (the host and process id of the user)
+    :type tenant: Union[None, str], optional
+    :param priority: tasks of a higher priority are served first, defaults to 0
+    :type priority: int, optional
+
+    :Example:
+
+    >>> from overkill.overkill import ClusterExecutor
+    >>> with ClusterExecutor(('127.0.0.1', 63811)) as executor:
+    ...     future = executor.submit(pow, 2, 10)
+    ...     print(list(executor.map(pow, [1, 2, 3], [2, 2, 2])))
+    ...     print(future.result())
+    [1, 4, 9]
+    1024
+
+    ``map`` sends all of its calls as a single task which the master splits across the
+    cluster, ``chunksize`` is ignored. ``submit_map`` and ``submit_map_reduce`` run a
+    whole :meth:`ClusterCompute.map` or :meth:`ClusterCompute.map_reduce` as one task.
+
+    """
+
+    def __init__(self, master_address: Tuple[str, int], serializer: str = DEFAULT_SERIALIZER,
+                 tenant: Union[None, str] = None, priority: int = 0) -> None:
+        self.master_address = master_address
+        self.serializer = get_serializer(serializer).name
+        self.tenant = tenant if tenant is not None else _default_tenant()
+        self.priority = priority
+        self._tasks: Dict[int, Tuple[Future, Callable]] = {}  # tag: future, result handler
+        self._tags = itertools.count()
+        self._lock = threading.Lock()  # guards the connection, _tasks and _shutdown
+        self._shutdown = False
+        self._sock = None
+        self._channel = None
+
+    def submit(self, fn: Callable, *args, **kwargs) -> Future:
+        """Run ``fn(*args, **kwargs)`` on the cluster
+
+        :param fn: function to call
+        :type fn: Callable
+        :return: future of the result of the call
+        :rtype: Future
+        """
+        call = functools.partial(_call, fn)
+        return self._submit(call, [(args, kwargs)], lambda result: _handle_result(result)[0])
+
+    def map(self, fn: Callable, *iterables: Iterable, timeout: Union[None, float] = None,
+            chunksize: int = 1) -> Iterator:
+        """Run ``fn`` over the elements of the iterables on the cluster, like :func:`map`.
+        The iterables are consumed straight away
+
+        :param fn: function with as many arguments as there are iterables
+        :type fn: Callable
+        :param timeout: seconds to wait for the results, defaults to None (no limit)
+        :type timeout: Union[None, float], optional
+        :param chunksize: ignored, the master cuts the task into chunks, defaults to 1
+        :type chunksize: int, optional
+        :raises TimeoutError: the results did not come back in time
+        :return: iterator over the results, in order
+        :rtype: Iterator
+        """
+        end_time = None if timeout is None else time.monotonic() + timeout
+        if len(iterables) == 1:
+            future = self.submit_map(fn, iterables[0])
+        else:
+            future = self.submit_map(functools.partial(_star_call, fn), zip(*iterables))
+
+        def results():
+            remaining = None if end_time is None else end_time - time.monotonic()
+            yield from future.result(remaining)
+        return results()
+
+    def submit_map(self, function: Callable, array: Iterable) -> Future:
+        """Distribute array over function as a single task
+
+        :param function: function with a single argument
+        :type function: Callable
+        :param array: finite iterable to distribute
+        :type array: Iterable
+        :return: future of the transformed list
+        :rtype: Future
+        """
+        return self._submit(function, _as_sliceable(array), _handle_result)
+
+    def submit_map_reduce(self, mapper: Callable, reducer: Callable, array: Iterable,
+                          initial: Any = _MISSING) -> Future:
+        """Distribute array over mapper and reduce the results with reducer as a single task,
+        see :meth:`ClusterCompute.map_reduce`
+
+        :param mapper: function with a single argument
+        :type mapper: Callable
+        :param reducer: associative function of two arguments
+        :type reducer: Callable
+        :param array: finite iterable to distribute
+        :type array: Iterable
+        :param initial: value placed before the results, defaults to no initial value
+        :type initial: Any, optional
+        :return: future of the reduced value
+        :rtype: Future
+        """
+        fields = {"reducer": encode_function(reducer)[0]}
+        if initial is not _MISSING:
+            fields["initial"] = initial
+        return self._submit(mapper, _as_sliceable(array), _handle_reduced, **fields)
+
+    def shutdown(self, wait: bool = True, *, cancel_futures: bool = False) -> None:
+        """Stop accepting tasks and close the connection to the master.
+        Tasks that are still running are abandoned if the executor does not wait for them
+
+        :param wait: whether to wait for every running task, defaults to True
+        :type wait: bool, optional
+        :param cancel_futures: ignored, every task starts as soon as it is submitted,
+            defaults to False
+        :type cancel_futures: bool, optional
+        """
+        with self._lock:
+            self._shutdown = True
+            futures = [future for future, _ in self._tasks.values()]
+        if wait:
+            for future in futures:
+                future.exception()
+        with self._lock:
+            self._close()
+
+    def _submit(self, function: Callable, array: List, handler: Callable, **fields) -> Future:
+        """Send a task to the master tagged with the key of its future
+
+        :param function: function to distribute
+        :type function: Callable
+        :param array: array to distribute
+        :type array: List
+        :param handler: turns the master's reply into the result of the future
+        :type handler: Callable
+        :raises RuntimeError: the executor has been shut down
+        :return: future of the task
+        :rtype: Future
+        """
+        future = Future()
+        future.set_running_or_notify_cancel()
+        with self._lock:
+            if self._shutdown:
+                raise RuntimeError("cannot schedule new futures after shutdown")
+            channel = self._connect()
+            tag = next(self._tags)
+            self._tasks[tag] = (future, handler)
+        message = {"type": DISTRIBUTE, "function": encode_function(function)[0],
+                   "array": array, "codecs": available_codecs(), "tenant": self.tenant,
+                   "priority": self.priority, "tag": tag, **fields}
+        try:
+            channel.send(encode_dict(message, serializer=self.serializer))
+        except Exception as e:
+            self._resolve(tag, error=e)
+        return future
+
+    def _connect(self) -> Channel:
+        """Open the connection to the master if it is not open,
+        must be called while holding the executor's lock
+
+        :return: channel to the master
+        :rtype: Channel
+        """
+        if self._channel is None:
+            self._sock = socket.create_connection(self.master_address)
+            self._channel = Channel(sock=self._sock)
+            t = threading.Thread(target=self._read, args=(self._sock,), daemon=True)
+            t.start()
+        return self._channel
+
+    def _close(self) -> None:
+        """Close the connection to the master, must be called while holding the executor's lock"""
+        if self._sock is not None:
+            try:
+                self._sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            self._sock.close()
+        self._sock = self._channel = None
+
+    def _read(self, sock: socket.socket) -> None:
+        """Resolve the future of every reply from the master until the connection closes,
+        then fail the futures of the tasks that are still running
+
+        :param sock: connected socket
+        :type sock: socket.socket
+        """
+        reassembler = Reassembler()
+        while True:
+            data = recv_or_none(sock, reassembler)
+            if data is None:
+                break
+            try:
+                result = decode_message(data)
+            except Exception:
+                break  # treated as a failed connection
+            self._resolve(result.get("tag"), result=result)
+        with self._lock:
+            if self._sock is sock:
+                self._close()
+            tags = list(self._tasks)
+        for tag in tags:
+            self._resolve(tag, error=ConnectionError("Connection to the master was closed"))
+
+    def _resolve(self, tag: int, result: Union[None, Dict] = None,
+                 error: Union[None, Exception] = None) -> None:
+        """Set the result or the error of a task's future
+
+        :param tag: tag of the task
+        :type tag: int
+        :param result: reply from the master, defaults to None
+        :type result: Union[None, Dict], optional
+        :param error: error to set instead, defaults to None
+        :type error: Union[None, Exception], optional
+        """
+        with self._lock:
+            future, handler = self._tasks.pop(tag, (None, None))
+        if future is None:
+            return
+        try:
+            if error is not None:
+                raise error
+            future.set_result(handler(result))
+        except Exception as e:
+            future.set_exception(e)
+
+
+class _Timer:
+    """Records the calls it makes as spans of a trace, or only makes them if the trace id
+    is None
+
+    :param trace_id: id of the trace
+    :type trace_id: Union[None, str]
+    """
+
+    def __init__(self, trace_id: Union[None, str]) -> None:
+        self.trace_id = trace_id
+
+    def time(self, name: str, function: Callable, *args, **kwargs) -> Any:
+        """Call a function, recording the call as a span named name"""
+        if self.trace_id is None:
+            return function(*args, **kwargs)
+        start = time.time()
+        result = function(*args, **kwargs)
+        _tracing.record(self.trace_id, "user", name, start, time.time() - start)
+        return result
+
+
+def _sliceable(array: Any) -> bool:
+    """Whether an array can be sent whole and sliced by the master, e.g. a list, a tuple
+    or a NumPy array (anything with a length that can be indexed), rather than consumed lazily
+
+    :param array: array or any other iterable
+    :type array: Any
+    :return: whether the array is sliceable
+    :rtype: bool
+    """
+    return (hasattr(array, "__len__") and hasattr(array, "__getitem__") and
+            not isinstance(array, Mapping))
+
+
+def _as_sliceable(array: Iterable) -> Any:
+    """The array itself if it is sliceable, otherwise a list of its elements"""
+    return array if _sliceable(array) else list(array)
+
+
+def _default_tenant() -> str:
+    """Tenant of a user that has not named one: the host and process id of the user
+
+    :return: tenant name
+    :rtype: str
+    """
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def _call(fn: Callable, call: Tuple[Tuple, Dict]) -> Any:
+    """Call a function with the arguments of a submitted call"""
+    args, kwargs = call
+    return fn(*args, **kwargs)
+
+
+def _star_call(fn: Callable, args: Tuple) -> Any:
+    """Call a function with the elements of a tuple as its arguments"""
+    return fn(*args)
+
+
+def _handle_reduced(result: Dict) -> Any:
+    """Handle the reply from master to a map-reduce
+
+    :param result: reply from master
+    :type result: Dict
+    :raises TypeError: there was nothing to reduce and no initial value
+    :return: the reduced value
+    :rtype: Any
+    """
+    if result.get("type") == FINISHED_TASK and result.get("empty"):
+        raise TypeError("map_reduce() of empty iterable with no initial value")
+    return _handle_result(result)
+
+
+def _handle_result(result: Dict) -> List:
+    """Handle returned data from master.
+    Asssume that communications are with the master exclusively (no malicious users)
+    and that only dictionaries are returned. Current implementation assumes a dictionary
+    of the form {"type": str, "data": List}, {"type": str, "chunks": List[List]}
+    where the chunks are flattened into the transformed list or {"type": str, "value": Any}
+    with the value of a map-reduce
+
+    :param result: dictionary of the form {"type": str, "data": List}
+    :type result: Dict
+    :return: transformed list from cluster
+    :rtype: List
+    """
+    return_type = result.get("type")
+    if return_type == FINISHED_TASK:
+        if "value" in result:
+            return result["value"]
+        if "chunks" in result:
+            return flatten(result["chunks"])
+        return result.get("data")
+    if return_type == WORK_ERROR:
+        raise WorkError(result.get("error"))
+    if return_type == NO_WORKERS_ERROR:
+        raise NoWorkersError("There are no workers connected to master")
@@ -0,0 +1,209 @@
+"""Master server running on a single asyncio event loop"""
+
+import asyncio
+import logging
+import threading
+import time
+import traceback
+from typing import Coroutine, Set, Tuple
+
+from overkill.servers import _logging, _master, _metrics
+from overkill.servers._channels import AsyncChannel
+from overkill.servers._server_messaging_standards import (DISTRIBUTE,
+                                                          PARTIAL_RESULT)
+from overkill.servers._utils import (FramingError, Reassembler,
+                                     decode_message, read_msg)
+
+__all__ = [
+    "AsyncMasterServer"
+]
+
+_streams: Set[asyncio.Task] = set()  # lazy and tagged tasks answered in the background
+
+
+class AsyncMasterServer:
+    """Serve the master on an event loop running in a background thread, every connection
+    is a task on the loop instead of a thread. The state in :mod:`overkill.servers._master`
+    is switched to the loop with :func:`overkill.servers._master.use_event_loop` and
+    only runs on the loop's thread. The server starts listening as soon as it is created
+
+    :param server_address: tuple of ip, port to bind to
+    :type server_address: Tuple[str, int]
+    """
+
+    def __init__(self, server_address: Tuple[str, int]) -> None:
+        self.loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        self._thread.start()
+        self._connections: Set[asyncio.StreamWriter] = set()
+        self._server = self._run(self._start(server_address))
+        self.server_address = self._server.sockets[0].getsockname()[:2]
+
+    def server_close(self) -> None:
+        """Stop accepting new connections"""
+        if self.loop.is_running():
+            self.loop.call_soon_threadsafe(self._server.close)
+
+    def shutdown(self) -> None:
+        """Close every connection and channel and stop the event loop"""
+        if not self.loop.is_running():
+            return
+        self._run(self._stop())
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join()
+        self.loop.close()
+
+    def close_connections(self) -> None:
+        """Close every connection that is still open"""
+        if self.loop.is_running():
+            self.loop.call_soon_threadsafe(self._close_connections)
+
+    def _run(self, coro: Coroutine):
+        """Run a coroutine on the loop and wait for its result
+
+        :param coro: coroutine to run
+        :type coro: Coroutine
+        :return: result of the coroutine
+        """
+        return asyncio.run_coroutine_threadsafe(coro, self.loop).result()
+
+    async def _start(self, server_address: Tuple[str, int]) -> asyncio.AbstractServer:
+        _master.use_event_loop(self.loop)
+        return await asyncio.start_server(self._handle, *server_address, reuse_address=True)
+
+    async def _stop(self) -> None:
+        self._server.close()
+        self._close_connections()
+        _master.close_channels()
+
+    def _close_connections(self) -> None:
+        for writer in list(self._connections):
+            writer.close()
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        """Handle an incoming connection.
+        Connections are persistent, every message recieved is handled
+        until the peer closes the connection
+
+        :param reader: stream to read messages from
+        :type reader: asyncio.StreamReader
+        :param writer: stream to reply on
+        :type writer: asyncio.StreamWriter
+        """
+        self._connections.add(writer)
+        _metrics.inc("connections_total")
+        channel = AsyncChannel(self.loop, writer=writer)
+        reassembler = Reassembler()
+        try:
+            while True:
+                try:
+                    data = await read_msg(reader, reassembler)
+                except FramingError as e:
+                    logging.info(f"Closing connection: {e}")
+                    return
+                if data is None:
+                    return
+                await _handle_message(data, channel, self.server_address)
+        finally:
+            _master._close_inputs(channel)
+            self._connections.discard(writer)
+            writer.close()
+
+
+async def _handle_message(data: bytes, channel: AsyncChannel,
+                          master_address: Tuple[str, int]) -> None:
+    """Handle a single message, awaiting the work order of a DISTRIBUTE.
+    Every other message is handled straight away by the master's state machine
+
+    :param data: encoded message
+    :type data: bytes
+    :param channel: channel the message arrived on, replies are sent over it
+    :type channel: AsyncChannel
+    :param master_address: address of the master server
+    :type master_address: Tuple[str, int]
+    """
+    start = time.time()
+    try:
+        ask = decode_message(data)
+    except Exception as e:
+        logging.info(f"Could not decode request: {e}")
+        return
+    _master._trace_decode(ask, start, len(data))
+    if ask.get("type") != DISTRIBUTE:
+        _master._handle_ask(ask, channel, master_address)
+        return
+    _logging.log_message(ask)
+    _metrics.inc("messages_handled_total", type=DISTRIBUTE)
+    try:
+        work_id = _master._start_task(ask, channel)
+        if work_id is None:
+            return
+        if ask.get("lazy"):
+            # keep reading the connection for the input while the results are streamed
+            task = asyncio.ensure_future(_stream_results(work_id, channel))
+            _streams.add(task)
+            task.add_done_callback(_streams.discard)
+            return
+        if work_id in _master._tagged:
+            # other tasks share the connection, keep reading it while this one runs
+            task = asyncio.ensure_future(_finish_tagged_task(work_id, channel))
+            _streams.add(task)
+            task.add_done_callback(_streams.discard)
+            return
+        if ask.get("stream"):
+            await _stream_results(work_id, channel)
+            return
+        await _master._work_orders[work_id].event.wait()
+        _master._finish_task(work_id, channel)
+        await channel.drain()
+    except Exception as e:
+        logging.info(f"Could not handle request: {e}")
+        logging.info(traceback.format_exc())
+
+
+async def _finish_tagged_task(work_id: int, channel: AsyncChannel) -> None:
+    """Await a tagged work order and send its results (or its error) to the user
+
+    :param work_id: id of the work order
+    :type work_id: int
+    :param channel: channel to the user
+    :type channel: AsyncChannel
+    """
+    await _master._work_orders[work_id].event.wait()
+    try:
+        _master._finish_task(work_id, channel)
+        await channel.drain()
+    except OSError as e:
+        logging.info(f"Could not send results to the user: {e}")
+
+
+async def _stream_results(work_id: int, channel: AsyncChannel) -> None:
+    """Send every chunk of a streaming work order to the user as soon as it completes,
+    waiting for the user to keep up before sending the next one.
+    The work order is abandoned if the user has gone away
+
+    :param work_id: id of the work order
+    :type work_id: int
+    :param channel: channel to the user
+    :type channel: AsyncChannel
+    """
+    work_order = _master._work_orders[work_id]
+    try:
+        while True:
+            chunk = await work_order.stream.get()
+            if chunk is None:
+                break
+            order, data = chunk
+            channel.send(_master._encode({"type": PARTIAL_RESULT, "order": order, "data": data}))
+            await channel.drain()
+    except Exception as e:
+        _master._abandon_task(work_id)
+        logging.info(f"Could not stream results to the user: {e}")
+        return
+    finally:
+        _master._work_orders.pop(work_id, None)
+        _master._record_completed(work_id, work_order)
+    try:
+        _master._finish_stream(work_order, channel)
+    except OSError as e:
+        logging.info(f"Could not finish streaming results to the user: {e}")
@@ -0,0 +1,448 @@
+"""Persistent, framed connections between servers"""
+
+import asyncio
+import logging
+import socket
+import socketserver
+import threading
+from typing import Callable, Dict, List, Tuple, Union
+
+from overkill.servers._utils import (FramingError, Reassembler,
+                                     frame_message, read_msg, recv_msg,
+                                     send_buffers)
+
+__all__ = [
+    "AsyncChannel",
+    "AsyncConnectionPool",
+    "Channel",
+    "ConnectionPool",
+    "ThreadedChannelServer",
+    "recv_or_none"
+]
+
+_RETRY_DELAY = 0.1  # seconds before an asyncio channel first tries to connect again
+
+
+def recv_or_none(sock: socket.socket, reassembler: Union[None, Reassembler] = None
+                 ) -> Union[None, bytearray]:
+    """Recieve a message, treating a failed connection or a peer
+    that does not follow the framing protocol the same as a closed connection
+
+    :param sock: connected socket
+    :type sock: socket.socket
+    :param reassembler: reassembler of the connection, defaults to None
+    :type reassembler: Union[None, Reassembler], optional
+    :return: recieved data, or none if the connection is closed
+    :rtype: Union[None, bytearray]
+    """
+    try:
+        return recv_msg(sock, reassembler)
+    except OSError:
+        return None
+    except FramingError as e:
+        logging.info(f"Closing connection: {e}")
+        return None
+
+
+class Channel:
+    """A persistent connection that can send and (optionally) recieve framed messages.
+
+    :param address: tuple of ip, port to connect to. Channels without an address
+        wrap an already connected socket and cannot reconnect, defaults to None
+    :type address: Union[None, Tuple[str, int]], optional
+    :param sock: an already connected socket, defaults to None
+    :type sock: Union[None, socket.socket], optional
+    :param on_message: callback invoked with (data, channel) for every message recieved
+        on a channel opened to an address, defaults to None
+    :type on_message: Union[None, Callable], optional
+    :param retries: number of times to reconnect and resend after a failed send, defaults to 1
+    :type retries: int, optional
+    :param connect_timeout: seconds to wait for a connection to open, defaults to 5.0
+    :type connect_timeout: float, optional
+    """
+
+    def __init__(self,
+                 address: Union[None, Tuple[str, int]] = None,
+                 sock: Union[None, socket.socket] = None,
+                 on_message: Union[None, Callable] = None,
+                 retries: int = 1,
+                 connect_timeout: float = 5.0) -> None:
+        self.address = address
+        self._sock = sock
+        self._on_message = on_message
+        self._retries = retries
+        self._connect_timeout = connect_timeout
+        self._send_lock = threading.Lock()
+        self._connect_lock = threading.Lock()
+        self._state_lock = threading.Lock()
+        self._closed = False
+        self.codecs: List[str] = []  # compression codecs negotiated with the peer
+
+    def send(self, message: bytes) -> None:
+        """Send a message over the channel, reconnecting if the connection has failed.
+        The message is compressed if the peer supports a codec and it is worth it.
+        The channel is only locked while a frame is sent, so frames of messages
+        sent by other threads interleave with the frames of this message.
+        A message is sent again from its first frame if the channel reconnects
+
+        :param message: bytes to be sent
+        :type message: bytes
+        :raises OSError: the message could not be sent after all retries
+        """
+        frames = frame_message(message, self.codecs)
+        if len(frames) > 1:  # the header is sent along with the first frame of data
+            frames = [frames[0] + frames[1], *frames[2:]]
+        for attempt in range(self._retries + 1):
+            sock = None
+            try:
+                for frame in frames:
+                    if sock is None:
+                        sock = self._sock or self._connect()
+                    with self._send_lock:
+                        if self._sock is not sock:
+                            raise ConnectionResetError("Channel reconnected during a message")
+                        send_buffers(frame, sock)
+                return
+            except OSError:
+                self._reset(sock)
+                if self.address is None or self._closed or attempt == self._retries:
+                    raise
+                logging.info(f"Reconnecting channel to {self.address}")
+
+    def close(self) -> None:
+        """Close the channel, it will not reconnect afterwards"""
+        self._closed = True
+        self._reset(self._sock)
+
+    def _connect(self) -> socket.socket:
+        """Open a new socket to the channel's address and start reading from it.
+        Only one thread connects at a time, senders on an open socket are not held up
+
+        :raises ConnectionError: the channel has been closed or has no address
+        :raises OSError: the connection could not be opened within the timeout
+        :return: connected socket
+        :rtype: socket.socket
+        """
+        with self._connect_lock:
+            if self._closed or self.address is None:
+                raise ConnectionError("Channel is closed")
+            if self._sock is not None:  # another thread has connected meanwhile
+                return self._sock
+            sock = socket.create_connection(self.address, timeout=self._connect_timeout)
+            sock.settimeout(None)
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            with self._state_lock:
+                self._sock = sock
+        if self._on_message is not None:
+            t = threading.Thread(target=self._read_forever, args=(sock,), daemon=True)
+            t.start()
+        return sock
+
+    def _reset(self, sock: Union[None, socket.socket]) -> None:
+        """Drop the given socket so that the next send reconnects
+
+        :param sock: socket to drop
+        :type sock: Union[None, socket.socket]
+        """
+        with self._state_lock:
+            if self._sock is sock:
+                self._sock = None
+        if sock is not None:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            sock.close()
+
+    def _read_forever(self, sock: socket.socket) -> None:
+        """Dispatch every message recieved on the socket until it is closed
+
+        :param sock: connected socket
+        :type sock: socket.socket
+        """
+        reassembler = Reassembler()
+        while True:
+            data = recv_or_none(sock, reassembler)
+            if data is None:
+                break
+            try:
+                self._on_message(data, self)
+            except Exception as e:
+                logging.info(f"Could not handle message from {self.address}: {e}")
+        self._reset(sock)
+
+
+class ConnectionPool:
+    """Keep a single persistent :class:`Channel` per remote address
+
+    :param on_message: callback given to every channel in the pool, defaults to None
+    :type on_message: Union[None, Callable], optional
+    """
+
+    def __init__(self, on_message: Union[None, Callable] = None) -> None:
+        self._on_message = on_message
+        self._channels: Dict[Tuple[str, int], Channel] = {}
+        self._lock = threading.Lock()
+
+    def get(self, address: Tuple[str, int]) -> Channel:
+        """Get the channel for an address, creating it if necessary
+
+        :param address: tuple of ip, port
+        :type address: Tuple[str, int]
+        :return: channel to the address
+        :rtype: Channel
+        """
+        address = tuple(address)
+        with self._lock:
+            channel = self._channels.get(address)
+            if channel is None:
+                channel = Channel(address, on_message=self._on_message)
+                self._channels[address] = channel
+        return channel
+
+    def send(self, message: bytes, address: Tuple[str, int]) -> None:
+        """Send a message to an address over its pooled channel.
+        Warning: does not handle any exceptions
+
+        :param message: bytes to be sent
+        :type message: bytes
+        :param address: tuple of ip, port
+        :type address: Tuple[str, int]
+        """
+        self.get(address).send(message)
+
+    def discard(self, address: Tuple[str, int]) -> None:
+        """Close and forget the channel to an address
+
+        :param address: tuple of ip, port
+        :type address: Tuple[str, int]
+        """
+        with self._lock:
+            channel = self._channels.pop(tuple(address), None)
+        if channel is not None:
+            channel.close()
+
+    def close(self) -> None:
+        """Close every channel in the pool"""
+        with self._lock:
+            channels = list(self._channels.values())
+            self._channels = {}
+        for channel in channels:
+            channel.close()
+
+
+class AsyncChannel:
+    """A persistent connection on an asyncio event loop.
+    Sending never blocks: frames are written to the transport's buffer straight away,
+    or once the connection is open. Every method must be called from the loop's thread
+
+    :param loop: event loop the channel runs on
+    :type loop: asyncio.AbstractEventLoop
+    :param address: tuple of ip, port to connect to. Channels without an address
+        wrap an already connected stream and cannot reconnect, defaults to None
+    :type address: Union[None, Tuple[str, int]], optional
+    :param writer: stream of an already connected socket, defaults to None
+    :type writer: Union[None, asyncio.StreamWriter], optional
+    :param on_message: callback invoked with (data, channel) for every message recieved
+        on a channel opened to an address, defaults to None
+    :type on_message: Union[None, Callable], optional
+    :param retries: number of times to try connecting again, waiting twice as long each time,
+        before the pending messages are dropped, defaults to 5
+    :type retries: int, optional
+    """
+
+    def __init__(self,
+                 loop: asyncio.AbstractEventLoop,
+                 address: Union[None, Tuple[str, int]] = None,
+                 writer: Union[None, asyncio.StreamWriter] = None,
+                 on_message: Union[None, Callable] = None,
+                 retries: int = 5) -> None:
+        self.address = address
+        self._loop = loop
+        self._writer = writer
+        self._on_message = on_message
+        self._retries = retries
+        self._connecting = None  # task opening the connection
+        self._pending: List[List] = []  # frames waiting for the connection to open
+        self._closed = False
+        self.codecs: List[str] = []  # compression codecs negotiated with the peer
+
+    def send(self, message: bytes) -> None:
+        """Send a message over the channel, reconnecting if the connection has failed.
+        The message is compressed if the peer supports a codec and it is worth it
+
+        :param message: bytes to be sent
+        :type message: bytes
+        :raises ConnectionError: the channel has been closed or has no address to reconnect to
+        """
+        frames = frame_message(message, self.codecs)
+        if self._writer is not None and not self._writer.is_closing():
+            for frame in frames:
+                self._writer.writelines(frame)
+            return
+        if self._closed or self.address is None:
+            raise ConnectionError("Channel is closed")
+        self._pending.append(frames)
+        if self._connecting is None:
+            self._connecting = self._loop.create_task(self._connect())
+
+    async def drain(self) -> None:
+        """Wait until the transport's buffer is flushed enough to write more"""
+        if self._writer is not None:
+            await self._writer.drain()
+
+    def close(self) -> None:
+        """Close the channel, it will not reconnect afterwards"""
+        self._closed = True
+        self._pending = []
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+
+    async def _connect(self) -> None:
+        """Open a new connection to the channel's address, send the pending frames
+        and start reading from it. The pending frames are kept while the connection
+        is retried and only dropped once every retry has failed"""
+        try:
+            for attempt in range(self._retries + 1):
+                try:
+                    reader, writer = await asyncio.open_connection(*self.address)
+                    break
+                except OSError as e:
+                    if self._closed or attempt == self._retries:
+                        logging.info(f"Could not connect to {self.address}, dropping "
+                                     f"{len(self._pending)} messages: {e}")
+                        self._pending = []
+                        return
+                    logging.info(f"Reconnecting channel to {self.address}")
+                    await asyncio.sleep(_RETRY_DELAY * 2 ** attempt)
+        finally:
+            self._connecting = None
+        if self._closed:
+            writer.close()
+            return
+        self._writer = writer
+        for frames in self._pending:
+            for frame in frames:
+                writer.writelines(frame)
+        self._pending = []
+        if self._on_message is not None:
+            self._loop.create_task(self._read_forever(reader, writer))
+
+    async def _read_forever(self, reader: asyncio.StreamReader,
+                            writer: asyncio.StreamWriter) -> None:
+        """Dispatch every message recieved on the stream until it is closed
+
+        :param reader: stream to read from
+        :type reader: asyncio.StreamReader
+        :param writer: the stream's writer, dropped once the stream is closed
+        :type writer: asyncio.StreamWriter
+        """
+        reassembler = Reassembler()
+        while True:
+            try:
+                data = await read_msg(reader, reassembler)
+            except FramingError as e:
+                logging.info(f"Closing connection to {self.address}: {e}")
+                break
+            if data is None:
+                break
+            try:
+                self._on_message(data, self)
+            except Exception as e:
+                logging.info(f"Could not handle message from {self.address}: {e}")
+        if self._writer is writer:
+            self._writer = None
+        writer.close()
+
+
+class AsyncConnectionPool:
+    """Keep a single persistent :class:`AsyncChannel` per remote address.
+    Every method must be called from the loop's thread
+
+    :param loop: event loop the channels run on
+    :type loop: asyncio.AbstractEventLoop
+    :param on_message: callback given to every channel in the pool, defaults to None
+    :type on_message: Union[None, Callable], optional
+    """
+
+    def __init__(self, loop: asyncio.AbstractEventLoop,
+                 on_message: Union[None, Callable] = None) -> None:
+        self._loop = loop
+        self._on_message = on_message
+        self._channels: Dict[Tuple[str, int], AsyncChannel] = {}
+
+    def get(self, address: Tuple[str, int]) -> AsyncChannel:
+        """Get the channel for an address, creating it if necessary
+
+        :param address: tuple of ip, port
+        :type address: Tuple[str, int]
+        :return: channel to the address
+        :rtype: AsyncChannel
+        """
+        address = tuple(address)
+        channel = self._channels.get(address)
+        if channel is None:
+            channel = AsyncChannel(self._loop, address, on_message=self._on_message)
+            self._channels[address] = channel
+        return channel
+
+    def send(self, message: bytes, address: Tuple[str, int]) -> None:
+        """Send a message to an address over its pooled channel.
+        Warning: does not handle any exceptions
+
+        :param message: bytes to be sent
+        :type message: bytes
+        :param address: tuple of ip, port
+        :type address: Tuple[str, int]
+        """
+        self.get(address).send(message)
+
+    def discard(self, address: Tuple[str, int]) -> None:
+        """Close and forget the channel to an address
+
+        :param address: tuple of ip, port
+        :type address: Tuple[str, int]
+        """
+        channel = self._channels.pop(tuple(address), None)
+        if channel is not None:
+            channel.close()
+
+    def close(self) -> None:
+        """Close every channel in the pool"""
+        channels, self._channels = list(self._channels.values()), {}
+        for channel in channels:
+            channel.close()
+
+
+class ThreadedChannelServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    """Threaded TCP server whose handlers keep their connection open for many messages.
+    Open connections are tracked so they can be closed when the server stops."""
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, *args, **kwargs) -> None:
+        self._connections = set()
+        self._connections_lock = threading.Lock()
+        super().__init__(*args, **kwargs)
+
+    def process_request(self, request, client_address) -> None:
+        request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        with self._connections_lock:
+            self._connections.add(request)
+        super().process_request(request, client_address)
+
+    def shutdown_request(self, request) -> None:
+        with self._connections_lock:
+            self._connections.discard(request)
+        super().shutdown_request(request)
+
+    def close_connections(self) -> None:
+        """Close every connection that is still open"""
+        with self._connections_lock:
+            connections = list(self._connections)
+        for request in connections:
+            try:
+                request.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
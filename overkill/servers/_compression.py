@@ -0,0 +1,152 @@
+"""Payload compression for large messages"""
+
+import lzma
+import threading
+import zlib
+from typing import Callable, Dict, List, Tuple
+
+try:
+    import lz4.frame
+except ImportError:  # lz4 is optional
+    lz4 = None
+
+try:
+    import zstandard
+except ImportError:  # zstandard is optional
+    zstandard = None
+
+__all__ = [
+    "NONE",
+    "COMPRESSION_THRESHOLD",
+    "MAX_RATIO",
+    "available_codecs",
+    "negotiate",
+    "compress",
+    "decompress"
+]
+
+NONE = 0  # codec id of uncompressed payloads
+COMPRESSION_THRESHOLD = 64 * 1024  # smaller payloads are not compressed
+MAX_RATIO = 0.9  # payloads that do not shrink below this ratio are not compressed
+SAMPLE_SIZE = 64 * 1024  # size of the sample used to measure the ratio
+
+
+class Codec:
+    """A compression codec with the id it is sent as
+
+    :param name: name advertised to peers
+    :type name: str
+    :param id: id written in the message header
+    :type id: int
+    :param compress: function that compresses bytes
+    :type compress: Callable
+    :param decompress: function that decompresses bytes
+    :type decompress: Callable
+    """
+
+    def __init__(self, name: str, id: int, compress: Callable, decompress: Callable) -> None:
+        self.name = name
+        self.id = id
+        self.compress = compress
+        self.decompress = decompress
+
+
+_zstd = threading.local()  # zstandard (de)compressors cannot be shared between threads
+
+
+def _zstd_compress(data: bytes) -> bytes:
+    """Compress with this thread's zstandard compressor"""
+    if not hasattr(_zstd, "compressor"):
+        _zstd.compressor = zstandard.ZstdCompressor()
+    return _zstd.compressor.compress(data)
+
+
+def _zstd_decompress(data: bytes) -> bytes:
+    """Decompress with this thread's zstandard decompressor"""
+    if not hasattr(_zstd, "decompressor"):
+        _zstd.decompressor = zstandard.ZstdDecompressor()
+    return _zstd.decompressor.decompress(data)
+
+
+# in order of preference, lz4 and zstandard are used when they are installed
+_codecs: List[Codec] = []
+if zstandard is not None:
+    _codecs.append(Codec("zstd", 4, _zstd_compress, _zstd_decompress))
+if lz4 is not None:
+    _codecs.append(Codec("lz4", 3, lz4.frame.compress, lz4.frame.decompress))
+_codecs.append(Codec("zlib", 1, lambda data: zlib.compress(data, 1), zlib.decompress))
+_codecs.append(Codec("lzma", 2, lzma.compress, lzma.decompress))
+
+_by_name: Dict[str, Codec] = {c.name: c for c in _codecs}
+_by_id: Dict[int, Codec] = {c.id: c for c in _codecs}
+
+
+def available_codecs() -> List[str]:
+    """Names of the codecs this peer supports, in order of preference
+
+    :return: list of codec names
+    :rtype: List[str]
+    """
+    return [c.name for c in _codecs]
+
+
+def negotiate(peer_codecs: List[str]) -> List[str]:
+    """Codecs supported by both this peer and another peer, in order of preference.
+    Peers advertise their codecs in the NEW_CONNECTION/ACCEPT handshake
+
+    :param peer_codecs: codecs the other peer advertised
+    :type peer_codecs: List[str]
+    :return: list of codec names both peers support
+    :rtype: List[str]
+    """
+    peer_codecs = set(peer_codecs or [])
+    return [c.name for c in _codecs if c.name in peer_codecs]
+
+
+def compress(data: bytes, codecs: List[str],
+             threshold: int = COMPRESSION_THRESHOLD,
+             max_ratio: float = MAX_RATIO) -> Tuple[int, bytes]:
+    """Compress a payload with the preferred codec if it is worth it.
+    A sample of a large payload is compressed first, so payloads that do not compress
+    well (e.g. random or already compressed data) are sent as is
+
+    :param data: payload to compress
+    :type data: bytes
+    :param codecs: codecs the peer supports, in order of preference
+    :type codecs: List[str]
+    :param threshold: minimum size of a payload to compress, defaults to COMPRESSION_THRESHOLD
+    :type threshold: int, optional
+    :param max_ratio: maximum compressed/original size ratio to keep the compression,
+        defaults to MAX_RATIO
+    :type max_ratio: float, optional
+    :return: tuple of the codec id (NONE if not compressed) and the payload
+    :rtype: Tuple[int, bytes]
+    """
+    if not codecs or len(data) < threshold:
+        return NONE, data
+    codec = _by_name[codecs[0]]
+    view = memoryview(data)
+    if len(data) > 2 * SAMPLE_SIZE:
+        sample = view[:SAMPLE_SIZE]
+        if len(codec.compress(sample)) > max_ratio * len(sample):
+            return NONE, data
+    compressed = codec.compress(view)
+    if len(compressed) > max_ratio * len(data):
+        return NONE, data
+    return codec.id, compressed
+
+
+def decompress(codec_id: int, data: bytes) -> bytes:
+    """Decompress a payload
+
+    :param codec_id: id of the codec from the message header
+    :type codec_id: int
+    :param data: compressed payload
+    :type data: bytes
+    :raises ValueError: the codec is not supported by this peer
+    :return: decompressed payload
+    :rtype: bytes
+    """
+    if codec_id not in _by_id:
+        raise ValueError(f"Unsupported compression codec {codec_id}")
+    return _by_id[codec_id].decompress(data)
@@ -0,0 +1,118 @@
+"""Logging of the master and worker servers"""
+
+import atexit
+import logging
+import logging.handlers
+import queue
+import random
+import threading
+from typing import Any, Dict, Union
+
+__all__ = [
+    "FORMAT",
+    "configure",
+    "flush",
+    "summarize",
+    "log_message"
+]
+
+FORMAT = "%(levelname)s %(asctime)s - %(message)s"
+_MAX_STR = 64  # longer strings are truncated in summaries
+_MAX_TUPLE = 4  # longer lists and tuples of scalars are summarized by their length
+
+_lock = threading.Lock()  # guards _listener
+_listener: Union[None, logging.handlers.QueueListener] = None
+_sample_rate = 1.0
+
+
+def configure(filename: str, level: int = logging.INFO, sample_rate: float = 1.0) -> None:
+    """Log to a file through a background thread, so a server never waits on the disk.
+    Like ``logging.basicConfig``, nothing is installed if the root logger already has
+    handlers, the sample rate is always set. Settings are per process: a master and
+    a worker that run in the same process share their log file
+
+    :param filename: log file, it is truncated
+    :type filename: str
+    :param level: level of the root logger, defaults to logging.INFO
+    :type level: int, optional
+    :param sample_rate: fraction of received messages that are logged, defaults to 1.0
+    :type sample_rate: float, optional
+    """
+    global _listener, _sample_rate
+    _sample_rate = min(1.0, max(0.0, sample_rate))
+    with _lock:
+        root = logging.getLogger()
+        if _listener is not None:
+            root.setLevel(level)
+            return
+        if root.handlers:
+            return
+        file_handler = logging.FileHandler(filename, mode="w")
+        file_handler.setFormatter(logging.Formatter(FORMAT))
+        records = queue.Queue()
+        _listener = logging.handlers.QueueListener(records, file_handler)
+        _listener.start()
+        root.addHandler(logging.handlers.QueueHandler(records))
+        root.setLevel(level)
+        atexit.register(_stop)
+
+
+def flush() -> None:
+    """Wait until every queued record has been written"""
+    with _lock:
+        if _listener is not None:
+            _listener.stop()
+            _listener.start()
+
+
+def _stop() -> None:
+    """Write the queued records and stop the background thread"""
+    with _lock:
+        if _listener is not None:
+            _listener.stop()
+
+
+def summarize(ask: Any) -> Dict[str, Any]:
+    """Summary of a message: scalars and short strings as they are,
+    payloads by their size
+
+    :param ask: decoded message
+    :type ask: Any
+    :return: dict of key: value for scalars, key_bytes: size for bytes
+        and key_len: length for other containers
+    :rtype: Dict[str, Any]
+    """
+    if not isinstance(ask, dict):
+        return {"type": type(ask).__name__}
+    summary = {}
+    for key, value in ask.items():
+        if value is None or isinstance(value, (bool, int, float)):
+            summary[key] = value
+        elif isinstance(value, str):
+            summary[key] = value if len(value) <= _MAX_STR else value[:_MAX_STR - 3] + "..."
+        elif isinstance(value, (bytes, bytearray, memoryview)):
+            summary[f"{key}_bytes"] = len(value)
+        elif isinstance(value, (list, tuple)) and len(value) <= _MAX_TUPLE and all(
+                v is None or isinstance(v, (bool, int, float, str)) for v in value):
+            summary[key] = value
+        elif hasattr(value, "__len__"):
+            summary[f"{key}_len"] = len(value)
+        else:
+            summary[key] = type(value).__name__
+    return summary
+
+
+def log_message(ask: Any) -> None:
+    """Log the summary of a received message, subject to the sample rate.
+    The summary is attached to the record as ``record.summary``
+
+    :param ask: decoded message
+    :type ask: Any
+    """
+    if not logging.getLogger().isEnabledFor(logging.INFO):
+        return
+    if _sample_rate < 1.0 and random.random() >= _sample_rate:
+        return
+    summary = summarize(ask)
+    text = " ".join(f"{key}={value}" for key, value in summary.items())
+    logging.info(f"Received {text}", extra={"summary": summary})
@@ -1,53 +1,152 @@
 """This module contains the main master module abstractions"""
 
+import asyncio
+import functools
 import logging
 import socketserver
 import threading
+import time
 import traceback
-from math import ceil
+from collections import deque
+from queue import Queue
 from random import random
-from typing import Dict, Tuple
+from typing import Dict, List, Tuple, Union
 
+import dill
+from overkill.servers import _logging, _metrics, _tracing
+from overkill.servers._channels import (AsyncConnectionPool, Channel,
+                                       ConnectionPool, ThreadedChannelServer,
+                                       recv_or_none)
+from overkill.servers._compression import available_codecs, negotiate
+from overkill.servers._memo import ResultCache
+from overkill.servers._scheduler import Scheduler
+from overkill.servers._serializers import DEFAULT_SERIALIZER, get_serializer
 from overkill.servers._server_data_classes import (WorkerInfo, WorkError,
                                                    WorkOrder)
 from overkill.servers._server_exceptions import AskTypeNotFoundError
 from overkill.servers._server_messaging_standards import (ACCEPT, ACCEPT_WORK,
+                                                          BROADCAST,
+                                                          BROADCAST_MISS,
+                                                          BROADCAST_STORED,
+                                                          CANCEL_WORK,
                                                           CLOSE_CONNECTION,
                                                           DELEGATE_WORK,
                                                           DISTRIBUTE,
+                                                          END_OF_INPUT,
                                                           FINISHED_TASK,
+                                                          FUNCTION_MISS,
+                                                          HEARTBEAT,
+                                                          INPUT_CHUNK,
                                                           NEW_CONNECTION,
                                                           NO_WORKERS_ERROR,
-                                                          REJECT, WORK_ERROR)
-from overkill.servers._utils import (decode_message, encode_dict, flatten,
-                                     recv_msg, send_message,
-                                     socket_send_message, synchronized)
+                                                          PARTIAL_RESULT,
+                                                          REJECT, RELEASE,
+                                                          STARTED_TASK,
+                                                          STATUS,
+                                                          STATUS_REPORT,
+                                                          WORK_ERROR)
+from overkill.servers._utils import (LRUCache, Reassembler, decode_message,
+                                     encode_dict, encode_function, flatten,
+                                     split_weighted)
 
 
 __all__ = [
     "ThreadedMasterServer",
     "MasterServer",
-    "reset_globals"
+    "reset_globals",
+    "use_event_loop",
+    "start_monitor",
+    "stop_monitor",
+    "worker_status",
+    "job_status",
+    "metrics",
+    "close_channels"
 ]
 
 
-_resources = 0  # server resources (must be >0)
+_resources = 0  # server resources, total cores of all workers (must be >0)
 _workers = {}  # dict of worker_id: WorkerInfo
-_work_orders = {}  # dict of work_id: workOrder
-_lock = threading.Lock()
+_evicted = LRUCache(1000)  # worker_id: WorkerInfo of evicted workers, they rejoin on a heartbeat
+_work_orders = {}  # dict of work_id: workOrder, each work order has its own lock
+_open_inputs = {}  # dict of work_id: channel of lazy work orders still recieving input
+_tagged = {}  # dict of work_id: channel of tagged work orders answered in the background
+_broadcasts = {}  # dict of key: dill encoded broadcast variable, sent to every worker
+_completed = deque(maxlen=100)  # summaries of the most recently completed work orders
+_registry_lock = threading.Lock()  # guards _workers, _resources and _scheduler, never held during I/O
+_pool = None  # persistent channels to each worker
+_scheduler = Scheduler()  # queues of chunks waiting for a worker
+_serializer = DEFAULT_SERIALIZER  # serializer used to encode messages
+_codecs = available_codecs()  # compression codecs advertised to peers
+_loop = None  # event loop the master runs on, None when every connection has its own thread
+_memo = None  # cache of computed elements, None when memoization is off
+_monitor_stop = None  # event that stops the thread running periodic checks
+_heartbeat_interval = 0.5  # seconds between heartbeats of a worker, None to disable heartbeats
+_heartbeat_timeout = 3.0  # seconds without a heartbeat after which a worker is evicted
 
 
-def reset_globals():
+def reset_globals(serializer: str = DEFAULT_SERIALIZER, compression: bool = True,
+                  memo: Union[None, ResultCache] = None,
+                  scheduler: Union[None, Scheduler] = None,
+                  heartbeat_interval: Union[None, float] = 0.5,
+                  heartbeat_timeout: float = 3.0):
     """Reset global variables:
-    _resources, _workers, _work_orders
+    _resources, _workers, _evicted, _work_orders, _open_inputs, _tagged, _broadcasts,
+    _completed, _pool, _scheduler, _serializer, _codecs, _loop, _memo, _heartbeat_interval, _heartbeat_timeout
+
+    :param serializer: serializer used to encode messages, defaults to DEFAULT_SERIALIZER
+    :type serializer: str, optional
+    :param compression: whether to compress large messages, defaults to True
+    :type compression: bool, optional
+    :param memo: cache of computed elements, defaults to None (no memoization)
+    :type memo: Union[None, ResultCache], optional
+    :param scheduler: scheduler of the chunks, defaults to None (a default Scheduler)
+    :type scheduler: Union[None, Scheduler], optional
+    :param heartbeat_interval: seconds between heartbeats of a worker,
+        defaults to 0.5. None disables heartbeats
+    :type heartbeat_interval: Union[None, float], optional
+    :param heartbeat_timeout: seconds without a heartbeat after which a worker is evicted,
+        defaults to 3.0
+    :type heartbeat_timeout: float, optional
     """
-    global _resources, _workers, _work_orders
+    global _resources, _workers, _evicted, _work_orders, _open_inputs, _tagged, _broadcasts, _completed
+    global _pool, _scheduler
+    global _serializer, _codecs, _loop, _memo, _heartbeat_interval, _heartbeat_timeout
+    _memo = memo
+    _heartbeat_interval = heartbeat_interval
+    _heartbeat_timeout = heartbeat_timeout
+    _serializer = get_serializer(serializer).name
+    _codecs = available_codecs() if compression else []
     _resources = 0
     _workers = {}
+    _evicted = LRUCache(1000)
     _work_orders = {}
+    _open_inputs = {}
+    _tagged = {}
+    _broadcasts = {}
+    _completed = deque(maxlen=100)
+    _scheduler = scheduler if scheduler is not None else Scheduler()
+    if _pool is not None:
+        _pool.close()
+    _pool = ConnectionPool(on_message=_on_worker_message)
+    _loop = None
+
+
+def use_event_loop(loop: asyncio.AbstractEventLoop) -> None:
+    """Run the master on an event loop instead of a thread per connection.
+    Channels to workers are opened on the loop and work orders complete
+    asyncio events and queues which are awaited instead of blocking a thread.
+    Must be called from the loop's thread before any worker connects
+
+    :param loop: running event loop
+    :type loop: asyncio.AbstractEventLoop
+    """
+    global _pool, _loop
+    _pool.close()
+    _pool = AsyncConnectionPool(loop, on_message=_on_worker_message)
+    _loop = loop
 
 
-class ThreadedMasterServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
+class ThreadedMasterServer(ThreadedChannelServer):
     pass
 
 
@@ -58,175 +157,1064 @@ class MasterServer(socketserver.BaseRequestHandler):
             self, request, client_address, server)
 
     def handle(self):
-        """Handle incoming connections
-
-        :raises Exception: internal error in master server
-        :raises askTypeNotFoundError: occurs when there is no case for an ask type
+        """Handle incoming connections.
+        Connections are persistent, every message recieved is handled
+        until the peer closes the connection.
         """
-        data = recv_msg(self.request)
+        _metrics.inc("connections_total")
+        channel = Channel(sock=self.request)
+        reassembler = Reassembler()
+        while True:
+            data = recv_or_none(self.request, reassembler)
+            if data is None:
+                _close_inputs(channel)
+                return
+            _handle_message(data, channel, self.server.server_address)
+
+
+def _encode(d: Dict) -> bytes:
+    """Encode a message with the server's serializer
+
+    :param d: message to encode
+    :type d: Dict
+    :return: encoded message
+    :rtype: bytes
+    """
+    return encode_dict(d, serializer=_serializer)
+
+
+def _negotiate(peer_codecs: List[str]) -> List[str]:
+    """Compression codecs supported by both the master and a peer
+
+    :param peer_codecs: codecs the peer advertised
+    :type peer_codecs: List[str]
+    :return: codecs to compress messages to the peer with
+    :rtype: List[str]
+    """
+    return [c for c in negotiate(peer_codecs) if c in _codecs]
+
+
+def _handle_message(data: bytes, channel: Channel, master_address: Tuple[str, int]) -> None:
+    """Handle a single message recieved from a user or a worker
+
+    :param data: encoded message
+    :type data: bytes
+    :param channel: channel the message arrived on, replies are sent over it
+    :type channel: Channel
+    :param master_address: address of the master server
+    :type master_address: Tuple[str, int]
+    :raises Exception: internal error in master server
+    :raises askTypeNotFoundError: occurs when there is no case for an ask type
+    """
+    start = time.time()
+    try:
+        ask = decode_message(data)
+    except Exception as e:
+        logging.info(f"Could not decode request: {e}")
+        return
+    _trace_decode(ask, start, len(data))
+    _handle_ask(ask, channel, master_address)
+
+
+def _trace_decode(ask: Dict, start: float, size: int) -> None:
+    """Record the decoding of a message that belongs to a traced task
+
+    :param ask: decoded message
+    :type ask: Dict
+    :param start: time.time() when decoding started
+    :type start: float
+    :param size: size of the encoded message in bytes
+    :type size: int
+    """
+    if isinstance(ask, dict) and ask.get("trace_id") is not None:
+        _tracing.record(ask["trace_id"], "master", f"decode {ask.get('type')}", start,
+                        time.time() - start, bytes=size)
+
+
+def _handle_ask(ask: Dict, channel: Channel, master_address: Tuple[str, int]) -> None:
+    """Handle a single decoded message recieved from a user or a worker
+
+    :param ask: decoded message
+    :type ask: Dict
+    :param channel: channel the message arrived on, replies are sent over it
+    :type channel: Channel
+    :param master_address: address of the master server
+    :type master_address: Tuple[str, int]
+    :raises Exception: internal error in master server
+    :raises askTypeNotFoundError: occurs when there is no case for an ask type
+    """
+    start = time.perf_counter()
+    try:
+        _logging.log_message(ask)
+
+        if ask["type"] == NEW_CONNECTION:
+            _welcome_new_worker(ask, master_address)
+
+        elif ask["type"] == DISTRIBUTE:
+            work_id = _start_task(ask, channel)
+            if work_id is None:
+                return
+            if ask.get("lazy"):
+                t = threading.Thread(target=_stream_results, args=(work_id, channel), daemon=True)
+                t.start()
+                return
+            if work_id in _tagged:
+                # other tasks share the connection, keep reading it while this one runs
+                t = threading.Thread(target=_finish_tagged_task, args=(work_id, channel),
+                                     daemon=True)
+                t.start()
+                return
+            if ask.get("stream"):
+                _stream_results(work_id, channel)
+                return
+            _work_orders[work_id].event.wait()
+            _finish_task(work_id, channel)
+
+        elif ask["type"] == INPUT_CHUNK:
+            _add_input_chunk(ask)
+
+        elif ask["type"] == END_OF_INPUT:
+            _close_input(ask["work_id"])
+
+        elif ask["type"] == ACCEPT_WORK:
+            _recieve_completed_task(ask)
+
+        elif ask["type"] == CLOSE_CONNECTION:
+            resources = _remove_worker(ask)
+            logging.info(f"Worker shutdown, resources left: {resources}")
+
+        elif ask["type"] == WORK_ERROR:
+            _handle_work_error(ask)
+
+        elif ask["type"] == FUNCTION_MISS:
+            _resend_function(ask)
+
+        elif ask["type"] == HEARTBEAT:
+            _record_heartbeat(ask)
+
+        elif ask["type"] == BROADCAST:
+            _store_broadcast(ask)
+            channel.send(_encode({"type": BROADCAST_STORED, "key": ask["key"]}))
+
+        elif ask["type"] == RELEASE:
+            _release_broadcast(ask["key"])
+
+        elif ask["type"] == BROADCAST_MISS:
+            _resend_broadcast(ask)
+
+        elif ask["type"] == STATUS:
+            channel.send(_encode({"type": STATUS_REPORT, **job_status()}))
+
+        else:
+            raise AskTypeNotFoundError(f"No such type {ask['type']}")
+
+    except AskTypeNotFoundError as e:
+        logging.info(f"No such ask exists: {e}")
+        return
+    except Exception as e:
+        logging.info(f"Could not handle request: {e}")
+        logging.info(traceback.format_exc())
+        return
+    finally:
+        _count_message(ask, start)
+
+
+def _count_message(ask: Dict, start: float) -> None:
+    """Count a handled message and how long it took to handle by its type.
+    Users wait for their tasks while a DISTRIBUTE is handled, tasks are timed on their own
+
+    :param ask: decoded message
+    :type ask: Dict
+    :param start: time.perf_counter() when the message started to be handled
+    :type start: float
+    """
+    ask_type = ask.get("type") if isinstance(ask, dict) else None
+    ask_type = ask_type if isinstance(ask_type, str) else "unknown"
+    _metrics.inc("messages_handled_total", type=ask_type)
+    if ask_type != DISTRIBUTE:
+        _metrics.observe("handle_seconds", time.perf_counter() - start, type=ask_type)
+
+
+def _start_task(ask: Dict, channel: Channel) -> Union[None, int]:
+    """Delegate a user's task to the workers, replying with an error
+    if there are no workers or the task cannot be delegated.
+    Replies to a task with a tag carry the tag, so that a user can run
+    many tasks over one connection
+
+    :param ask: dictionary of type, function, array and optionally codecs, stream, tag
+    :type ask: Dict
+    :param channel: channel to the user
+    :type channel: Channel
+    :return: work id of the delegated task or None if an error was sent
+    :rtype: Union[None, int]
+    """
+    channel.codecs = _negotiate(ask.get("codecs"))
+    tag = None if ask.get("lazy") else ask.get("tag")  # lazy tasks are not multiplexed
+    if len(_workers) == 0:
+        err = {"type": NO_WORKERS_ERROR}
+        _reply(channel, err, tag)
+        return None
+    try:
+        work_id = _delegate_task(ask)
+    except WorkError as e:
+        _send_work_error(channel, e, tag)
+        return None
+    if tag is not None:
+        _tagged[work_id] = (channel, tag)
+    if ask.get("lazy"):
+        _open_inputs[work_id] = channel
+        _reply(channel, {"type": STARTED_TASK, "work_id": work_id}, tag)
+    return work_id
+
+
+def _finish_tagged_task(work_id: int, channel: Channel) -> None:
+    """Wait for a tagged work order and send its results (or its error) to the user
+
+    :param work_id: id of the work order
+    :type work_id: int
+    :param channel: channel to the user
+    :type channel: Channel
+    """
+    _work_orders[work_id].event.wait()
+    try:
+        _finish_task(work_id, channel)
+    except OSError as e:
+        logging.info(f"Could not send results to the user: {e}")
+
+
+def _finish_task(work_id: int, channel: Channel) -> None:
+    """Send the results (or the error) of a completed work order to the user
+
+    :param work_id: id of the work order
+    :type work_id: int
+    :param channel: channel to the user
+    :type channel: Channel
+    """
+    work_order = _work_orders.pop(work_id)
+    _record_completed(work_id, work_order)
+    _, tag = _tagged.pop(work_id, (None, None))
+    trace_id = work_order.trace_id
+    if work_order.error:
+        if trace_id is not None:
+            _tracing.collect(trace_id)
+        _send_work_error(channel, work_order.error, tag)
+        return
+    logging.info(f"Completed task {work_order}")
+    if work_order.reducer is not None:
+        start = time.time()
         try:
-            ask = decode_message(data)
-            logging.info(ask)
-
-            if ask["type"] == NEW_CONNECTION:
-                _welcome_new_worker(ask, self.server.server_address)
-
-            elif ask["type"] == DISTRIBUTE:
-                if len(_workers) == 0:
-                    err = {"type": NO_WORKERS_ERROR}
-                    socket_send_message(encode_dict(err), self.request)
-                    return
-                try:
-                    work_id = _delegate_task(ask)
-                except WorkError as e:
-                    self.send_work_error(e)
-                _work_orders[work_id].event.wait()
-                if _work_orders[work_id].error:
-                    self.send_work_error(_work_orders[work_id].error)
-                    return
-                data = flatten(_work_orders[work_id].data)
-                work_order = _work_orders.pop(work_id)
-                logging.info(f"Completed task {work_order}")
-                socket_send_message(
-                    encode_dict({"type": FINISHED_TASK, "data": data}), self.request)
-
-            elif ask["type"] == ACCEPT_WORK:
-                _recieve_completed_task(ask)
-
-            elif ask["type"] == CLOSE_CONNECTION:
-                resources = _remove_worker(ask)
-                logging.info(f"Worker shutdown, resources left: {resources}")
-
-            elif ask["type"] == WORK_ERROR:
-                _handle_work_error(ask)
-
-            else:
-                raise AskTypeNotFoundError(f"No such type {ask['type']}")
-
-        except AskTypeNotFoundError as e:
-            logging.info(f"No such ask exists: {e}")
-            return
+            result = _reduce_results(work_order)
         except Exception as e:
-            logging.info(f"Could not handle request: {e}")
-            logging.info(traceback.format_exc())
+            if trace_id is not None:
+                _tracing.collect(trace_id)
+            _send_work_error(channel, WorkError(
+                f"Could not reduce: {e} \n {traceback.format_exc()}"), tag)
             return
+        if trace_id is not None:
+            _tracing.record(trace_id, "master", "reduce", start, time.time() - start)
+    else:
+        # the chunks are encoded straight from their slots, the user flattens them
+        result = {"type": FINISHED_TASK, "chunks": work_order.results()}
+    if trace_id is not None:
+        result["trace"] = _tracing.collect(trace_id)
+    _reply(channel, result, tag)
 
-    def send_work_error(self, error: WorkError):
-        """Send an error message to the user
 
-        :param error: error message
-        :type error: WorkError
-        """
-        err = {"type": WORK_ERROR,
-               "error": error}
-        socket_send_message(encode_dict(err), self.request)
+def _reduce_results(work_order: WorkOrder) -> Dict:
+    """Combine the partial results of every chunk of a map-reduce, in order
+
+    :param work_order: the completed map-reduce work order
+    :type work_order: WorkOrder
+    :return: message of type, value or of type, empty if there was nothing to reduce
+    :rtype: Dict
+    """
+    partials = flatten(work_order.results())
+    if work_order.has_initial:
+        partials.insert(0, work_order.initial)
+    if not partials:
+        return {"type": FINISHED_TASK, "empty": True}
+    reducer = dill.loads(work_order.reducer)
+    return {"type": FINISHED_TASK, "value": functools.reduce(reducer, partials)}
+
+
+def _stream_results(work_id: int, channel: Channel) -> None:
+    """Send every chunk of a streaming work order to the user as soon as it completes.
+    Chunks are sent in the order they complete, each tagged with its index.
+    The work order is abandoned if the user has gone away
+
+    :param work_id: id of the work order
+    :type work_id: int
+    :param channel: channel to the user
+    :type channel: Channel
+    """
+    work_order = _work_orders[work_id]
+    try:
+        while True:
+            chunk = work_order.stream.get()
+            if chunk is None:
+                break
+            order, data = chunk
+            channel.send(_encode({"type": PARTIAL_RESULT, "order": order, "data": data}))
+    except Exception as e:
+        _abandon_task(work_id)
+        logging.info(f"Could not stream results to the user: {e}")
+        return
+    finally:
+        _work_orders.pop(work_id, None)
+        _record_completed(work_id, work_order)
+    try:
+        _finish_stream(work_order, channel)
+    except OSError as e:
+        logging.info(f"Could not finish streaming results to the user: {e}")
+
+
+def _finish_stream(work_order: WorkOrder, channel: Channel) -> None:
+    """Tell the user a streaming work order is done, or send its error
+
+    :param work_order: the streamed work order
+    :type work_order: WorkOrder
+    :param channel: channel to the user
+    :type channel: Channel
+    """
+    if work_order.error:
+        _send_work_error(channel, work_order.error)
+        return
+    logging.info(f"Completed task {work_order}")
+    channel.send(_encode({"type": FINISHED_TASK, "num_chunks": work_order.num_chunks}))
+
+
+def _on_worker_message(data: bytes, channel: Channel) -> None:
+    """Handle replies sent by a worker over the master's pooled channel to it
+
+    :param data: encoded message
+    :type data: bytes
+    :param channel: pooled channel to the worker
+    :type channel: Channel
+    """
+    _handle_message(data, channel, None)
+
+
+def _send_work_error(channel: Channel, error: WorkError, tag: Union[None, int] = None):
+    """Send an error message to the user
+
+    :param channel: channel to the user
+    :type channel: Channel
+    :param error: error message
+    :type error: WorkError
+    :param tag: tag of the task the error is for, defaults to None
+    :type tag: Union[None, int], optional
+    """
+    err = {"type": WORK_ERROR,
+           "error": error}
+    _reply(channel, err, tag)
+
+
+def _reply(channel: Channel, message: Dict, tag: Union[None, int] = None) -> None:
+    """Send a reply to the user, tagged with the task it is for if the task has a tag
+
+    :param channel: channel to the user
+    :type channel: Channel
+    :param message: reply to send
+    :type message: Dict
+    :param tag: tag of the task, defaults to None
+    :type tag: Union[None, int], optional
+    """
+    if tag is not None:
+        message["tag"] = tag
+    channel.send(_encode(message))
 
 
-@synchronized(_lock)
 def _welcome_new_worker(worker_details: Dict, master_address: Tuple[str, int]) -> None:
     """Process a new worker and either accept or reject
-    Accept: add to list of workers
+    Accept: add to list of workers and hand it any queued chunks
     Reject: send rejection message back to server
 
-    :param worker_details: dictionary of type, name, address
+    :param worker_details: dictionary of type, name, address and optionally cores, codecs
     :type worker_details: Dict
     :param master_address: master's address to send to the worker
     :type master_adress: Tuple[str, int]
     """
-    global _resources, _workers
+    global _resources
     try:
         new_worker = WorkerInfo(
             hash(worker_details["name"] + str(random())),
             worker_details["name"],
-            worker_details["address"]
+            worker_details["address"],
+            cores=max(1, int(worker_details.get("cores", 1))),
+            function_cache_size=worker_details.get("function_cache_size", 16),
+            codecs=_negotiate(worker_details.get("codecs"))
         )
-        send_message(encode_dict({"type": ACCEPT, "id": new_worker.id,
-                                  "master_address": master_address}), new_worker.address)
-        _workers[new_worker.id] = new_worker
-        _resources += 1
-        logging.info("Resources at welcome new worker: %d", _resources)
+        _pool.get(new_worker.address).codecs = new_worker.codecs
+        _pool.send(_encode({"type": ACCEPT, "id": new_worker.id,
+                            "master_address": master_address, "codecs": _codecs,
+                            "heartbeat_interval": _heartbeat_interval}),
+                   new_worker.address)
+        for key, value in list(_broadcasts.items()):
+            _pool.send(_encode({"type": BROADCAST, "key": key, "value": value}),
+                       new_worker.address)
     except Exception as e:
-        send_message(encode_dict({"type": REJECT}), new_worker.address)
+        _pool.send(_encode({"type": REJECT}), worker_details["address"])
         logging.info(f"Could not instantiate new worker: {e}")
+        return
+    with _registry_lock:
+        new_worker.last_seen = time.monotonic()
+        _workers[new_worker.id] = new_worker
+        _resources += new_worker.cores
+        logging.info("Resources at welcome new worker: %d", _resources)
+        messages = _assign()
+    _send_all(messages)
 
 
-@synchronized(_lock)
 def _delegate_task(ask: Dict) -> int:
-    """Delegate tasks to each worker
-    All tasks are currently split evenly between workers
+    """Cut the array into chunks and queue them for the workers.
+    Workers are sent their first chunks straight away and pull
+    the next chunk every time they return one. With memoization on
+    cached elements are served straight away and only the rest is queued,
+    map-reduce tasks are not memoized as workers only return partial results
 
-    :param ask: dictionary of type, function, array
+    :param ask: dictionary of type, function, array and optionally stream, reducer, initial,
+        tenant, priority. Lazy tasks have no array, their chunks arrive one by one
     :type ask: Dict
     :return: work id of the delegated task
     :rtype: int
     """
-    global _work_orders
-    func = ask["function"]
-    array = ask["array"]
+    start = time.perf_counter()
+    wall_start = time.time()
+    lazy = ask.get("lazy", False)
 
     try:
-        logging.info("Array len: %d, num resources: %d",
-                     len(array), _resources)
-        size = ceil(len(array) / _resources)
-        array_split = [array[i: i+size] for i in range(0, len(array), size)]
+        function, digest = encode_function(ask["function"])
+        priority = int(ask.get("priority", 0))
+        reducer = reducer_digest = None
+        if ask.get("reducer") is not None:
+            reducer, reducer_digest = encode_function(ask["reducer"])
+        if lazy:
+            chunks = []
+        else:
+            array = ask["array"]
+            logging.info("Array len: %d, num resources: %d",
+                         len(array), _resources)
+            with _registry_lock:
+                weights = _scheduler.partition(len(array), _workers, digest)
+            chunks = split_weighted(array, weights)
+        memo = {}
+        if _memo is not None and reducer is None:
+            for order, chunk in enumerate(chunks):
+                memo[order] = _memo.plan(digest, chunk)
+                chunks[order] = memo[order].subset(chunk)
         work_id = hash(random())
-        event = threading.Event()
+        event = threading.Event() if _loop is None else asyncio.Event()
+        stream = None
+        if ask.get("stream") or lazy:
+            stream = Queue() if _loop is None else asyncio.Queue()
     except Exception as e:
         raise WorkError(e)
 
-    for worker, (i, data) in zip(_workers.values(), enumerate(array_split)):
-        # assume worker will always accept work
-        work_request = {"type": DELEGATE_WORK, "work_id": work_id,
-                        "function": func, "array": data, "order": i}
-        send_message(encode_dict(work_request), worker.address)
-
-    _work_orders[work_id] = WorkOrder(_resources, event)
-    logging.info(_work_orders[work_id])
+    pending = None
+    if memo:
+        pending = deque(order for order, plan in memo.items() if plan.missing)
+    work_order = WorkOrder(len(chunks), event, function, digest, chunks, pending=pending,
+                           stream=stream, input_complete=not lazy, memo=memo,
+                           reducer=reducer, reducer_digest=reducer_digest,
+                           initial=ask.get("initial"), has_initial="initial" in ask,
+                           tenant=ask.get("tenant"), priority=priority,
+                           trace_id=ask.get("trace_id"))
+    _work_orders[work_id] = work_order
+    for order, plan in memo.items():
+        if not plan.missing:
+            work_order.update(plan.results, order)
+    try:
+        messages = _schedule(work_id, work_order)
+    except WorkError:
+        _work_orders.pop(work_id, None)
+        raise
+    _send_all(messages)
+    logging.info(work_order)
+    _metrics.inc("jobs_submitted_total")
+    _metrics.inc("chunks_queued_total", len(work_order.pending))
+    if not lazy:
+        _metrics.inc("elements_submitted_total", len(array))
+    _metrics.observe("delegate_seconds", time.perf_counter() - start)
+    if work_order.trace_id is not None:
+        _tracing.record(work_order.trace_id, "master", "delegate", wall_start,
+                        time.time() - wall_start, chunks=work_order.num_chunks)
 
     return work_id
 
 
-@synchronized(_lock)
+def _schedule(work_id: int, work_order: WorkOrder) -> List[Tuple[WorkerInfo, Dict]]:
+    """Queue the chunks of a work order and fill the workers' free slots.
+    Must be called without holding the registry lock, the returned
+    messages are sent with :func:`_send_all`
+
+    :param work_id: id of the work order
+    :type work_id: int
+    :param work_order: work order to queue
+    :type work_order: WorkOrder
+    :raises WorkError: the work order could not be scheduled, it is dropped from the queue
+    :return: list of worker, message to send
+    :rtype: List[Tuple[WorkerInfo, Dict]]
+    """
+    with _registry_lock:
+        try:
+            _scheduler.add_job(work_id, work_order)
+            return _assign()
+        except Exception as e:
+            logging.info(f"Could not schedule work order {work_id}: {e}")
+            logging.info(traceback.format_exc())
+            _scheduler.remove_job(work_id)
+            raise WorkError(f"Could not schedule: {e}")
+
+
+def _assign() -> List[Tuple[WorkerInfo, Dict]]:
+    """Fill every worker's free slots with queued chunks, run straggling chunks
+    again on idle workers and cancel chunks that have been stolen from busy workers
+    or lost to a speculative copy.
+    Must be called while holding the registry lock, the returned
+    messages are sent with :func:`_send_all` once it is released
+
+    :return: list of worker, message to send
+    :rtype: List[Tuple[WorkerInfo, Dict]]
+    """
+    messages = []
+    assignments, cancellations = _scheduler.assign(_workers)
+    assignments += _scheduler.speculate(_workers, _work_orders)
+    for stolen in cancellations:
+        messages.append((stolen.worker, {"type": CANCEL_WORK, "work_id": stolen.work_id,
+                                         "order": stolen.order}))
+    for assignment in assignments:
+        message = _chunk_message(assignment.worker, assignment.work_id, assignment.order)
+        if message is not None:
+            messages.append((assignment.worker, message))
+    return messages
+
+
+def _chunk_message(worker: WorkerInfo, work_id: int, order: int) -> Union[None, Dict]:
+    """Build the message that sends a chunk of a work order to a worker.
+    The function is only sent along if the worker does not have it cached.
+    Must be called while holding the registry lock
+
+    :param worker: worker to send to
+    :type worker: WorkerInfo
+    :param work_id: id of the work order
+    :type work_id: int
+    :param order: index of the chunk
+    :type order: int
+    :return: message to send or None if the work order is gone
+    :rtype: Union[None, Dict]
+    """
+    work_order = _work_orders.get(work_id)
+    if work_order is None:
+        return None
+    work_request = {"type": DELEGATE_WORK, "work_id": work_id,
+                    "function_digest": work_order.function_digest,
+                    "array": work_order.chunks[order],
+                    "order": order}
+    if work_order.trace_id is not None:
+        work_request["trace_id"] = work_order.trace_id
+    if work_order.function_digest not in worker.functions:
+        work_request["function"] = work_order.function
+    worker.functions.put(work_order.function_digest, True)
+    if work_order.reducer is not None:
+        work_request["reducer_digest"] = work_order.reducer_digest
+        if work_order.reducer_digest not in worker.functions:
+            work_request["reducer"] = work_order.reducer
+        worker.functions.put(work_order.reducer_digest, True)
+    return work_request
+
+
+def _send_all(messages: List[Tuple[WorkerInfo, Dict]]) -> None:
+    """Send messages to workers, must be called without holding any lock
+
+    :param messages: list of worker, message to send
+    :type messages: List[Tuple[WorkerInfo, Dict]]
+    """
+    for worker, message in messages:
+        _send_to_worker(worker, message)
+
+
+def _send_to_worker(worker: WorkerInfo, message: Dict) -> None:
+    """Send a message to a worker, logging instead of raising on failure
+
+    :param worker: worker to send to
+    :type worker: WorkerInfo
+    :param message: message to send
+    :type message: Dict
+    """
+    try:
+        _pool.send(_encode(message), worker.address)
+    except OSError as e:
+        logging.info(f"Could not send {message['type']} to worker {worker.name}: {e}")
+
+
+def _add_input_chunk(ask: Dict) -> None:
+    """Queue the next chunk of a lazy task and hand it to a worker with a free slot.
+    With memoization on only the elements that are not cached are queued, unless the
+    task reduces its chunks on the workers
+
+    :param ask: dictionary of type, work_id, array
+    :type ask: Dict
+    """
+    work_order = _work_orders.get(ask["work_id"])
+    if work_order is None or work_order.error:
+        return
+    chunk, plan = ask["array"], None
+    if _memo is not None and work_order.reducer is None:
+        plan = _memo.plan(work_order.function_digest, chunk)
+        chunk = plan.subset(chunk)
+    order = work_order.add_chunk(chunk, memo=plan)
+    _metrics.inc("elements_submitted_total", len(ask["array"]))
+    if plan is not None and not plan.missing:
+        work_order.update(plan.results, order)
+        return
+    try:
+        messages = _schedule(ask["work_id"], work_order)
+    except WorkError as e:
+        _fail_work_order(ask["work_id"], e)
+        return
+    _send_all(messages)
+    _metrics.inc("chunks_queued_total")
+
+
+def _close_input(work_id: int) -> None:
+    """Mark the input of a lazy task as complete
+
+    :param work_id: id of the work order
+    :type work_id: int
+    """
+    _open_inputs.pop(work_id, None)
+    work_order = _work_orders.get(work_id)
+    if work_order is not None:
+        work_order.close_input()
+
+
+def _close_inputs(channel: Channel) -> None:
+    """Abandon every lazy task whose user has gone away before sending all of its input
+    and every tagged task whose user has gone away before it completed
+
+    :param channel: channel to the user
+    :type channel: Channel
+    """
+    for work_id, open_channel in list(_open_inputs.items()):
+        if open_channel is channel:
+            _open_inputs.pop(work_id, None)
+            _abandon_task(work_id)
+    for work_id, (tagged_channel, _) in list(_tagged.items()):
+        if tagged_channel is channel:
+            _abandon_task(work_id)
+
+
 def _recieve_completed_task(ask: Dict) -> None:
-    """Recieve a completed task from a worker
+    """Recieve a completed chunk from a worker and hand the worker its next chunk
 
-    :param ask: dictionary of type, work_id, data (array), order (to insert into the correct position)
+    :param ask: dictionary of type, worker_id, work_id, data (array), order (index of the chunk)
+        and optionally items (length of the chunk) and elapsed (seconds the worker
+        spent computing the chunk)
     :type ask: Dict
     """
-    global _work_orders
     work_id = ask["work_id"]
-    new_data = ask["data"]
     order = ask["order"]
-    _work_orders[work_id].update(new_data, order)
-    logging.info(_work_orders[work_id])
-    if _work_orders[work_id].progress == 1:
-        _work_orders[work_id].event.set()
+    work_order = _work_orders.get(work_id)
+    finished = False
+    if work_order is not None:
+        data = ask["data"]
+        plan = work_order.memo.get(order)
+        if plan is not None and not work_order.is_done(order) and _memo is not None:
+            data = _memo.merge(plan, data)
+        work_order.update(data, order)
+        finished = work_order.event.is_set()
+        logging.debug("Work order %s progress %.3f", work_id, work_order.progress)
+    with _registry_lock:
+        worker = _workers.get(ask["worker_id"])
+        if worker is not None:
+            worker.last_seen = time.monotonic()
+        sent = _scheduler.started.get((ask["worker_id"], work_id, order))
+        _scheduler.complete(ask["worker_id"], work_id, order, _workers,
+                            items=ask.get("items", len(ask["data"])),
+                            elapsed=ask.get("elapsed"))
+        if finished:
+            _scheduler.remove_job(work_id)
+        messages = _assign()
+    _send_all(messages)
+    _metrics.inc("chunks_completed_total")
+    _metrics.inc("elements_completed_total", ask.get("items", len(ask["data"])))
+    if sent is not None:
+        _metrics.observe("chunk_seconds", time.monotonic() - sent)
+    if ask.get("trace_id") is not None:
+        _trace_chunk(ask, worker, sent)
 
 
-@synchronized(_lock)
-def _remove_worker(ask: Dict) -> int:
-    """Remove worker by decrementing resource count and removing from the worker db
+def _trace_chunk(ask: Dict, worker: Union[None, WorkerInfo], sent: Union[None, float]) -> None:
+    """Add the spans a worker recorded for a chunk of a traced task to the trace,
+    along with a span from when the chunk was sent to when its results arrived
+
+    :param ask: ACCEPT_WORK message with trace_id and trace (spans of the worker)
+    :type ask: Dict
+    :param worker: worker that computed the chunk or None if it is gone
+    :type worker: Union[None, WorkerInfo]
+    :param sent: time.monotonic() when the chunk was sent or None if unknown
+    :type sent: Union[None, float]
+    """
+    process = f"worker {worker.name if worker is not None else ask['worker_id']}"
+    spans = ask.get("trace", [])
+    for span in spans:
+        if span["process"] == "worker":
+            span["process"] = process
+    _tracing.extend(ask["trace_id"], spans)
+    if sent is not None:
+        elapsed = time.monotonic() - sent
+        _tracing.record(ask["trace_id"], "master", f"chunk {ask['order']}",
+                        time.time() - elapsed, elapsed, worker=process,
+                        items=ask.get("items"))
+
+
+def _resend_function(ask: Dict) -> None:
+    """Resend a chunk along with its function after the worker
+    has evicted the function from its cache
+
+    :param ask: dictionary of type, worker_id, work_id, order, function_digest
+    :type ask: Dict
+    """
+    with _registry_lock:
+        worker = _workers.get(ask["worker_id"])
+        work_order = _work_orders.get(ask["work_id"])
+        if worker is None or work_order is None or work_order.is_done(ask["order"]):
+            return
+        worker.functions.pop(work_order.function_digest)
+        worker.functions.pop(work_order.reducer_digest)
+        message = _chunk_message(worker, ask["work_id"], ask["order"])
+    if message is not None:
+        _send_to_worker(worker, message)
+
+
+def _record_heartbeat(ask: Dict) -> None:
+    """Record the load a worker has reported in a heartbeat.
+    A worker that was evicted (e.g. it held the GIL for too long) rejoins the cluster
+
+    :param ask: dictionary of type, worker_id, queued, running, load, free_memory
+        and optionally metrics
+    :type ask: Dict
+    """
+    global _resources
+    messages = []
+    worker = _evicted.pop(ask["worker_id"])
+    if worker is not None:
+        _pool.get(worker.address).codecs = worker.codecs
+    with _registry_lock:
+        if worker is not None and worker.id not in _workers:
+            _workers[worker.id] = worker
+            _resources += worker.cores
+            logging.info(f"Evicted worker {worker.name} rejoined, resources: {_resources}")
+            messages = _assign()
+        worker = _workers.get(ask["worker_id"])
+        if worker is None:
+            logging.info(f"Heartbeat from unknown worker {ask['worker_id']}")
+            return
+        worker.queued = ask["queued"]
+        worker.running = ask["running"]
+        worker.load = ask["load"]
+        worker.free_memory = ask["free_memory"]
+        worker.metrics = ask.get("metrics", worker.metrics)
+        worker.last_seen = time.monotonic()
+        worker.can_accept_work = True
+    _send_all(messages)
+
+
+def _check_heartbeats() -> List[str]:
+    """Stop giving work to workers that have missed heartbeats
+    and find the workers that have been silent for longer than the timeout
+
+    :return: ids of the workers to evict
+    :rtype: List[str]
+    """
+    if _heartbeat_interval is None:
+        return []
+    now = time.monotonic()
+    evicted = []
+    with _registry_lock:
+        for worker in _workers.values():
+            silent = now - worker.last_seen
+            worker.can_accept_work = silent <= 2 * _heartbeat_interval
+            if silent > _heartbeat_timeout:
+                evicted.append(worker.id)
+    return evicted
+
+
+def worker_status() -> List[Dict]:
+    """Load of every worker as last reported in its heartbeats
+
+    :return: list of dicts of id, name, address, cores, can_accept_work, in_flight,
+        queued, running, load, free_memory, last_seen (seconds since the last heartbeat)
+        and throughput (items per second, relative until the worker has been measured)
+    :rtype: List[Dict]
+    """
+    now = time.monotonic()
+    with _registry_lock:
+        rates = _scheduler.rates(_workers)
+        return [{"id": w.id, "name": w.name, "address": w.address, "cores": w.cores,
+                 "can_accept_work": w.can_accept_work,
+                 "in_flight": len(_scheduler.in_flight.get(w.id, [])),
+                 "queued": w.queued, "running": w.running, "load": w.load,
+                 "free_memory": w.free_memory, "last_seen": now - w.last_seen,
+                 "throughput": rates[w.id] * w.cores}
+                for w in _workers.values()]
+
+
+def job_status() -> Dict[str, List[Dict]]:
+    """State of the job queue. Jobs none of whose chunks have been handed out are queued
+
+    :return: dict of queued, running and completed (the most recently completed jobs),
+        each a list of dicts of work_id, tenant, priority, num_chunks, completed,
+        progress, elapsed (seconds since the job was submitted) and error
+    :rtype: Dict[str, List[Dict]]
+    """
+    with _registry_lock:
+        dispatched = set(_scheduler.dispatched)
+    queued, running = [], []
+    for work_id, work_order in list(_work_orders.items()):
+        started = work_order.completed or work_id in dispatched
+        (running if started else queued).append(_job_summary(work_id, work_order))
+    return {"queued": queued, "running": running, "completed": list(_completed)}
+
+
+def _record_completed(work_id: int, work_order: WorkOrder) -> None:
+    """Keep the summary of a work order that has completed and time it
+
+    :param work_id: id of the work order
+    :type work_id: int
+    :param work_order: the work order
+    :type work_order: WorkOrder
+    """
+    _completed.append(_job_summary(work_id, work_order))
+    _metrics.inc("jobs_failed_total" if work_order.error else "jobs_completed_total")
+    _metrics.observe("job_seconds", time.monotonic() - work_order.submitted)
+
+
+def _job_summary(work_id: int, work_order: WorkOrder) -> Dict:
+    """Summary of a work order without its data
+
+    :param work_id: id of the work order
+    :type work_id: int
+    :param work_order: the work order
+    :type work_order: WorkOrder
+    :return: dict of work_id, tenant, priority, num_chunks, completed, progress, elapsed, error
+    :rtype: Dict
+    """
+    return {"work_id": work_id, "tenant": work_order.tenant, "priority": work_order.priority,
+            "num_chunks": work_order.num_chunks, "completed": work_order.completed,
+            "progress": work_order.progress,
+            "elapsed": time.monotonic() - work_order.submitted,
+            "error": str(work_order.error) if work_order.error else None}
+
+
+def metrics() -> Dict:
+    """Metrics of the master's process, with the gauges of the master's state,
+    and the metrics of every worker as last reported in its heartbeats
+
+    :return: snapshot of :func:`overkill.servers._metrics.snapshot` with workers,
+        a dict of worker name: snapshot of the worker
+    :rtype: Dict
+    """
+    with _registry_lock:
+        _metrics.gauge("workers", len(_workers))
+        _metrics.gauge("cores", _resources)
+        _metrics.gauge("pending_chunks",
+                       sum(len(job.pending) for job in _scheduler.jobs.values()))
+        _metrics.gauge("in_flight_chunks", sum(map(len, _scheduler.in_flight.values())))
+        workers = {w.name: w.metrics for w in _workers.values() if w.metrics is not None}
+    _metrics.gauge("jobs", len(_work_orders))
+    _metrics.gauge("broadcasts", len(_broadcasts))
+    return {**_metrics.snapshot(), "workers": workers}
+
+
+def _store_broadcast(ask: Dict) -> None:
+    """Keep a broadcast variable and send it to every worker.
+    Workers that connect later are sent it when they are welcomed
+
+    :param ask: dictionary of type, key, value (dill encoded variable)
+    :type ask: Dict
+    """
+    if ask["key"] in _broadcasts:
+        return
+    _broadcasts[ask["key"]] = ask["value"]
+    _send_to_all_workers({"type": BROADCAST, "key": ask["key"], "value": ask["value"]})
+
+
+def _release_broadcast(key: str) -> None:
+    """Drop a broadcast variable on the master and every worker
+
+    :param key: digest of the broadcast variable
+    :type key: str
+    """
+    if _broadcasts.pop(key, None) is not None:
+        _send_to_all_workers({"type": RELEASE, "key": key})
+
+
+def _resend_broadcast(ask: Dict) -> None:
+    """Resend a broadcast variable and the chunk that needed it after the worker
+    has evicted the variable from its cache. The work order fails if the
+    variable has been released
+
+    :param ask: dictionary of type, worker_id, work_id, order, key
+    :type ask: Dict
+    """
+    value = _broadcasts.get(ask["key"])
+    if value is None:
+        _handle_work_error({**ask, "error": WorkError(
+            f"Broadcast variable {ask['key']} has been released")})
+        return
+    with _registry_lock:
+        worker = _workers.get(ask["worker_id"])
+        work_order = _work_orders.get(ask["work_id"])
+        if worker is None or work_order is None or work_order.is_done(ask["order"]):
+            return
+        message = _chunk_message(worker, ask["work_id"], ask["order"])
+    _send_to_worker(worker, {"type": BROADCAST, "key": ask["key"], "value": value})
+    if message is not None:
+        _send_to_worker(worker, message)
+
+
+def _send_to_all_workers(message: Dict) -> None:
+    """Send the same message to every worker, it is only encoded once
+
+    :param message: message to send
+    :type message: Dict
+    """
+    with _registry_lock:
+        workers = list(_workers.values())
+    encoded = _encode(message)
+    for worker in workers:
+        try:
+            _pool.send(encoded, worker.address)
+        except OSError as e:
+            logging.info(f"Could not send {message['type']} to worker {worker.name}: {e}")
+
+
+def _remove_worker(ask: Dict, rejoin: bool = False) -> int:
+    """Remove worker by decrementing resource count and removing from the worker db.
+    Chunks the worker had not finished are queued for the remaining workers
 
     :param ask: dictionary of type, worker_id
     :type ask: Dict
+    :param rejoin: whether the worker rejoins if it sends another heartbeat, defaults to False
+    :type rejoin: bool, optional
     :return: number of compute resources left
     :rtype: int
     """
-    global _resources, _workers
-    _resources -= 1
-    _workers.pop(ask["id"])
+    global _resources
+    with _registry_lock:
+        worker = _workers.pop(ask["id"], None)
+        if worker is None:  # already evicted
+            return _resources
+        if rejoin:
+            _evicted.put(worker.id, worker)
+        _resources -= worker.cores
+        resources = _resources
+        _scheduler.forget_worker(worker.id, _work_orders)
+        orphaned = [] if _workers else list(_scheduler.jobs)
+        messages = _assign()
+    _pool.discard(worker.address)
+    for work_id in orphaned:
+        _fail_work_order(work_id, WorkError("All workers disconnected from master"))
+    _send_all(messages)
 
-    return _resources
+    return resources
 
 
-@synchronized(_lock)
 def _handle_work_error(ask: Dict) -> None:
     """Handle work error by setting the error message of the work order
     and by setting the work_id thread to true
 
-    :param ask: _description_
+    :param ask: dictionary of type, worker_id, work_id, order, error
     :type ask: Dict
     """
-    global _work_orders
-    _work_orders[ask["work_id"]].error = ask["error"]
-    _work_orders[ask["work_id"]].event.set()
+    _fail_work_order(ask["work_id"], ask["error"])
+    with _registry_lock:
+        _scheduler.complete(ask["worker_id"], ask["work_id"], ask["order"])
+        messages = _assign()
+    _send_all(messages)
+
+
+def _abandon_task(work_id: int) -> None:
+    """Stop scheduling a work order whose client has gone away
+
+    :param work_id: id of the work order
+    :type work_id: int
+    """
+    _fail_work_order(work_id, WorkError("Client disconnected"))
+
+
+def _fail_work_order(work_id: int, error: WorkError) -> None:
+    """Stop scheduling a work order and wake up its client with an error.
+    Must be called without holding the registry lock
+
+    :param work_id: id of the work order
+    :type work_id: int
+    :param error: error to give the client
+    :type error: WorkError
+    """
+    with _registry_lock:
+        _scheduler.remove_job(work_id)
+    work_order = _work_orders.get(work_id)
+    if work_order is not None:
+        work_order.fail(error)
+
+
+def start_monitor(interval: float = 0.1) -> None:
+    """Start a thread that periodically evicts workers that have stopped sending
+    heartbeats and looks for straggling chunks to run again.
+    When the master runs on an event loop the checks are run on the loop
+
+    :param interval: seconds between checks, defaults to 0.1
+    :type interval: float, optional
+    """
+    global _monitor_stop
+    stop_monitor()
+    _monitor_stop = threading.Event()
+    t = threading.Thread(target=_monitor, args=(_monitor_stop, interval), daemon=True)
+    t.start()
+
+
+def stop_monitor() -> None:
+    """Stop the thread started by :func:`start_monitor`"""
+    if _monitor_stop is not None:
+        _monitor_stop.set()
+
+
+def _monitor(stop: threading.Event, interval: float) -> None:
+    """Run the periodic checks until stopped
+
+    :param stop: event that stops the checks
+    :type stop: threading.Event
+    :param interval: seconds between checks
+    :type interval: float
+    """
+    while not stop.wait(interval):
+        if _loop is None:
+            _tick()
+            continue
+        try:
+            _loop.call_soon_threadsafe(_tick)
+        except RuntimeError:  # the loop has been closed
+            return
+
+
+def _tick() -> None:
+    """Periodic checks: evict silent workers, requeueing their chunks,
+    and hand out chunks that are straggling without any event to trigger it"""
+    try:
+        for worker_id in _check_heartbeats():
+            resources = _remove_worker({"id": worker_id}, rejoin=True)
+            logging.info(f"Evicted worker {worker_id} that missed its heartbeats, "
+                         f"resources left: {resources}")
+        with _registry_lock:
+            messages = _assign()
+        _send_all(messages)
+    except Exception as e:
+        logging.info(f"Periodic check failed: {e}")
+
+
+def close_channels() -> None:
+    """Close every persistent channel the master has opened to workers"""
+    if _pool is not None:
+        _pool.close()
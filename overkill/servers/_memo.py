@@ -0,0 +1,171 @@
+"""Memoization of computed elements on the master"""
+
+import hashlib
+import logging
+import pickle
+import sqlite3
+import threading
+from dataclasses import dataclass
+from typing import Any, Dict, List, Union
+
+from overkill.servers._utils import LRUCache
+
+__all__ = [
+    "MemoChunk",
+    "ResultCache"
+]
+
+_MISSING = object()  # marks an element whose result has not been computed
+_SQL_BATCH = 500  # maximum number of keys looked up on disk per query
+
+
+@dataclass
+class MemoChunk:
+    """Plan of a chunk: the cache key and result of every element,
+    and the positions of the elements that still have to be computed"""
+    keys: List[Union[None, bytes]]
+    results: List[Any]
+    missing: List[int]
+
+    def subset(self, chunk: List) -> List:
+        """Elements of the chunk that have to be computed
+
+        :param chunk: the whole chunk
+        :type chunk: List
+        :return: elements of the chunk that were not cached
+        :rtype: List
+        """
+        return [chunk[i] for i in self.missing]
+
+
+class ResultCache:
+    """Cache of computed elements keyed by (function digest, element).
+    Elements or results that cannot be pickled are never cached
+
+    :param maxsize: maximum number of results kept in memory, defaults to 100000
+    :type maxsize: int, optional
+    :param path: path of an sqlite database to also keep results in, it is shared by every
+        run of the master that uses it, defaults to None
+    :type path: Union[None, str], optional
+    """
+
+    def __init__(self, maxsize: int = 100000, path: Union[None, str] = None) -> None:
+        self._memory = LRUCache(maxsize)
+        self._db = None
+        self._db_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self.hits = 0  # elements served from memory or disk
+        self.disk_hits = 0  # elements served from disk
+        self.misses = 0  # elements sent to the workers
+        if path is not None:
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            with self._db:
+                self._db.execute(
+                    "CREATE TABLE IF NOT EXISTS results (key BLOB PRIMARY KEY, value BLOB)")
+
+    def plan(self, function_digest: str, chunk: List) -> MemoChunk:
+        """Look up every element of a chunk, only the misses are sent to the workers
+
+        :param function_digest: digest of the function
+        :type function_digest: str
+        :param chunk: elements to look up
+        :type chunk: List
+        :return: plan of the chunk
+        :rtype: MemoChunk
+        """
+        keys = [self._key(function_digest, element) for element in chunk]
+        results = [self._memory.get(key, _MISSING) if key is not None else _MISSING
+                   for key in keys]
+        if self._db is not None:
+            on_disk = self._load([k for k, r in zip(keys, results)
+                                  if k is not None and r is _MISSING])
+            for i, key in enumerate(keys):
+                if key in on_disk:
+                    results[i] = on_disk[key]
+                    self._memory.put(key, results[i])
+        else:
+            on_disk = {}
+        missing = [i for i, result in enumerate(results) if result is _MISSING]
+        with self._stats_lock:
+            self.hits += len(chunk) - len(missing)
+            self.disk_hits += len(on_disk)
+            self.misses += len(missing)
+        return MemoChunk(keys, results, missing)
+
+    def merge(self, plan: MemoChunk, computed: List) -> List:
+        """Cache the computed elements of a chunk and merge them with its cached elements
+
+        :param plan: plan of the chunk
+        :type plan: MemoChunk
+        :param computed: results of the missing elements, in order
+        :type computed: List
+        :return: results of the whole chunk
+        :rtype: List
+        """
+        results = list(plan.results)
+        to_save = {}
+        for i, result in zip(plan.missing, computed):
+            results[i] = result
+            key = plan.keys[i]
+            if key is not None:
+                self._memory.put(key, result)
+                to_save[key] = result
+        if self._db is not None:
+            self._save(to_save)
+        return results
+
+    def stats(self) -> Dict[str, int]:
+        """Counters of the cache
+
+        :return: dictionary of hits, disk_hits, misses and size (results in memory)
+        :rtype: Dict[str, int]
+        """
+        with self._stats_lock:
+            return {"hits": self.hits, "disk_hits": self.disk_hits,
+                    "misses": self.misses, "size": len(self._memory)}
+
+    def close(self) -> None:
+        """Close the on-disk tier"""
+        if self._db is not None:
+            with self._db_lock:
+                self._db.close()
+                self._db = None
+
+    @staticmethod
+    def _key(function_digest: str, element: Any) -> Union[None, bytes]:
+        """Key of an element, or None if the element cannot be pickled"""
+        try:
+            encoded = pickle.dumps(element, protocol=pickle.HIGHEST_PROTOCOL)
+        except Exception:
+            return None
+        return hashlib.blake2b(encoded, digest_size=16,
+                               key=function_digest.encode()[:64]).digest()
+
+    def _load(self, keys: List[bytes]) -> Dict[bytes, Any]:
+        """Load results from disk"""
+        found = {}
+        with self._db_lock:
+            if self._db is None:
+                return found
+            for i in range(0, len(keys), _SQL_BATCH):
+                batch = keys[i: i + _SQL_BATCH]
+                rows = self._db.execute(
+                    f"SELECT key, value FROM results WHERE key IN ({','.join('?' * len(batch))})",
+                    batch)
+                for key, value in rows:
+                    found[key] = pickle.loads(value)
+        return found
+
+    def _save(self, results: Dict[bytes, Any]) -> None:
+        """Save results to disk, results that cannot be pickled are skipped"""
+        rows = []
+        for key, result in results.items():
+            try:
+                rows.append((key, pickle.dumps(result, protocol=pickle.HIGHEST_PROTOCOL)))
+            except Exception as e:
+                logging.info(f"Could not cache result on disk: {e}")
+        with self._db_lock:
+            if self._db is None or not rows:
+                return
+            with self._db:
+                self._db.executemany("INSERT OR REPLACE INTO results VALUES (?, ?)", rows)
@@ -0,0 +1,195 @@
+"""Counters, gauges and latency histograms of this process"""
+
+import bisect
+import http.server
+import socketserver
+import threading
+from typing import Callable, Dict, List, Tuple, Union
+
+__all__ = [
+    "BUCKETS",
+    "inc",
+    "gauge",
+    "observe",
+    "snapshot",
+    "reset",
+    "render_prometheus",
+    "MetricsServer"
+]
+
+BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0, 60.0)  # seconds
+
+_lock = threading.Lock()  # guards every registry
+_counters: Dict[Tuple[str, str], float] = {}  # (name, labels): value
+_gauges: Dict[Tuple[str, str], float] = {}  # (name, labels): value
+# (name, labels): [count per bucket (the last is +Inf), sum, count]
+_histograms: Dict[Tuple[str, str], List] = {}
+
+
+def _labels(labels: Dict[str, str]) -> str:
+    """Labels in the Prometheus text format, e.g. type="distribute" """
+    return ",".join(f'{key}="{value}"' for key, value in sorted(labels.items()))
+
+
+def inc(name: str, value: float = 1, **labels) -> None:
+    """Add to a counter
+
+    :param name: name of the counter
+    :type name: str
+    :param value: amount to add, defaults to 1
+    :type value: float, optional
+    """
+    key = (name, _labels(labels) if labels else "")
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+
+
+def gauge(name: str, value: float, **labels) -> None:
+    """Set a gauge
+
+    :param name: name of the gauge
+    :type name: str
+    :param value: current value
+    :type value: float
+    """
+    key = (name, _labels(labels) if labels else "")
+    with _lock:
+        _gauges[key] = value
+
+
+def observe(name: str, seconds: float, **labels) -> None:
+    """Count an observation in a histogram
+
+    :param name: name of the histogram
+    :type name: str
+    :param seconds: observed latency
+    :type seconds: float
+    """
+    key = (name, _labels(labels) if labels else "")
+    bucket = bisect.bisect_left(BUCKETS, seconds)
+    with _lock:
+        histogram = _histograms.get(key)
+        if histogram is None:
+            histogram = _histograms[key] = [[0] * (len(BUCKETS) + 1), 0.0, 0]
+        histogram[0][bucket] += 1
+        histogram[1] += seconds
+        histogram[2] += 1
+
+
+def snapshot() -> Dict:
+    """Every metric of this process as a plain dict that can be sent in a message.
+    A master and a worker that run in the same process share their metrics
+
+    :return: dict of counters and gauges, each a dict of name: {labels: value},
+        and histograms, a dict of name: {labels: {buckets (cumulative count per upper bound
+        of BUCKETS, then +Inf), sum, count}}
+    :rtype: Dict
+    """
+    metrics = {"counters": {}, "gauges": {}, "histograms": {}}
+    with _lock:
+        for kind, registry in (("counters", _counters), ("gauges", _gauges)):
+            for (name, labels), value in registry.items():
+                metrics[kind].setdefault(name, {})[labels] = value
+        for (name, labels), (counts, total, count) in _histograms.items():
+            cumulative, buckets = 0, []
+            for n in counts:
+                cumulative += n
+                buckets.append(cumulative)
+            metrics["histograms"].setdefault(name, {})[labels] = {
+                "buckets": buckets, "sum": total, "count": count}
+    return metrics
+
+
+def reset() -> None:
+    """Forget every metric"""
+    with _lock:
+        _counters.clear()
+        _gauges.clear()
+        _histograms.clear()
+
+
+def render_prometheus(metrics: Dict, prefix: str = "overkill_",
+                      extra: Union[None, Dict[str, Dict]] = None) -> str:
+    """Render a snapshot in the Prometheus text exposition format
+
+    :param metrics: snapshot from :func:`snapshot`
+    :type metrics: Dict
+    :param prefix: prefix of every metric name, defaults to "overkill_"
+    :type prefix: str, optional
+    :param extra: snapshots of other processes by the value of their worker label,
+        defaults to None
+    :type extra: Union[None, Dict[str, Dict]], optional
+    :return: metrics in the Prometheus text format
+    :rtype: str
+    """
+    sources = [("", metrics)] + [(_labels({"worker": worker}), snap)
+                                 for worker, snap in (extra or {}).items()]
+    lines = []
+    for kind, type_ in (("counters", "counter"), ("gauges", "gauge")):
+        names = sorted({name for _, snap in sources for name in snap.get(kind, {})})
+        for name in names:
+            lines.append(f"# TYPE {prefix}{name} {type_}")
+            for source, snap in sources:
+                for labels, value in snap.get(kind, {}).get(name, {}).items():
+                    lines.append(f"{prefix}{name}{_series(labels, source)} {value}")
+    bounds = [str(bound) for bound in BUCKETS] + ["+Inf"]
+    names = sorted({name for _, snap in sources for name in snap.get("histograms", {})})
+    for name in names:
+        lines.append(f"# TYPE {prefix}{name} histogram")
+        for source, snap in sources:
+            for labels, histogram in snap.get("histograms", {}).get(name, {}).items():
+                for bound, count in zip(bounds, histogram["buckets"]):
+                    series = _series(labels, source, f'le="{bound}"')
+                    lines.append(f"{prefix}{name}_bucket{series} {count}")
+                lines.append(f"{prefix}{name}_sum{_series(labels, source)} {histogram['sum']}")
+                lines.append(f"{prefix}{name}_count{_series(labels, source)} "
+                             f"{histogram['count']}")
+    return "\n".join(lines) + "\n"
+
+
+def _series(*labels: str) -> str:
+    """Label set of a series from the labels of its parts, empty parts are skipped"""
+    joined = ",".join(label for label in labels if label)
+    return f"{{{joined}}}" if joined else ""
+
+
+class _ThreadedHTTPServer(socketserver.ThreadingMixIn, http.server.HTTPServer):
+    daemon_threads = True
+
+
+class MetricsServer:
+    """Serve metrics in the Prometheus text format over HTTP at /metrics.
+    The server starts listening as soon as it is created
+
+    :param render: function returning the metrics in the Prometheus text format
+    :type render: Callable[[], str]
+    :param address: tuple of ip, port to bind to, defaults to ("localhost", 0)
+    :type address: Tuple[str, int], optional
+    """
+
+    def __init__(self, render: Callable[[], str],
+                 address: Tuple[str, int] = ("localhost", 0)) -> None:
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] != "/metrics":
+                    self.send_error(404)
+                    return
+                body = render().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass  # scrapes are not logged
+
+        self._server = _ThreadedHTTPServer(address, Handler)
+        self.server_address = self._server.server_address[:2]
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+
+    def stop(self) -> None:
+        """Stop serving and close the socket"""
+        self._server.shutdown()
+        self._server.server_close()
@@ -0,0 +1,547 @@
+"""Dynamic chunk scheduling for the master server"""
+
+import math
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from statistics import median
+from typing import Dict, List, Set, Tuple, Union
+
+from overkill.servers._server_data_classes import WorkerInfo, WorkOrder
+
+__all__ = [
+    "Assignment",
+    "Scheduler"
+]
+
+
+@dataclass
+class Assignment:
+    """A chunk of a job assigned to a worker"""
+    worker: WorkerInfo
+    work_id: int
+    order: int
+
+
+class Scheduler:
+    """Keep a queue of chunks per job and hand them out to workers as they free up,
+    so faster workers compute a larger share of a job. The scheduler only tracks state,
+    the caller sends work and cancellations to the workers and holds the master's lock
+
+    :param chunks_per_core: number of chunks to cut a job into per worker core, defaults to 4
+    :type chunks_per_core: int, optional
+    :param prefetch: number of chunks queued on a worker beyond its cores, defaults to 1
+    :type prefetch: int, optional
+    :param speculation: whether to run straggling chunks again on idle workers, defaults to True
+    :type speculation: bool, optional
+    :param speculate_after: fraction of a job's chunks that must be done before its
+        stragglers are run again, defaults to 0.75
+    :type speculate_after: float, optional
+    :param straggler_factor: a chunk is straggling once it has been running for this many
+        times the job's median chunk time, defaults to 2.0
+    :type straggler_factor: float, optional
+    :param min_straggler_time: minimum number of seconds a chunk must have been running
+        before it is run again, defaults to 0.1
+    :type min_straggler_time: float, optional
+    :param overload: cpu load average per cpu above which a worker's machine is overloaded
+        and the worker is not given chunks beyond its cores, defaults to 1.5
+    :type overload: float, optional
+    :param smoothing: weight of the newest measurement in a worker's average throughput,
+        defaults to 0.3
+    :type smoothing: float, optional
+    :param half_life: seconds after which a worker's measured throughput is trusted half
+        as much as the cluster's median, defaults to 300
+    :type half_life: float, optional
+    :param per_function: whether to also measure throughput per function, defaults to True
+    :type per_function: bool, optional
+    :param weights: dict of tenant: share of the cluster relative to other tenants,
+        tenants that are not listed have a weight of 1, defaults to None
+    :type weights: Union[None, Dict[str, float]], optional
+    :param small_job: jobs of at most this many elements take the fast lane,
+        defaults to 1000. 0 disables the fast lane
+    :type small_job: int, optional
+    """
+
+    def __init__(self, chunks_per_core: int = 4, prefetch: int = 1, speculation: bool = True,
+                 speculate_after: float = 0.75, straggler_factor: float = 2.0,
+                 min_straggler_time: float = 0.1, overload: float = 1.5,
+                 smoothing: float = 0.3, half_life: float = 300.0,
+                 per_function: bool = True,
+                 weights: Union[None, Dict[str, float]] = None,
+                 small_job: int = 1000) -> None:
+        self.chunks_per_core = chunks_per_core
+        self.prefetch = prefetch
+        self.speculation = speculation
+        self.speculate_after = speculate_after
+        self.straggler_factor = straggler_factor
+        self.min_straggler_time = min_straggler_time
+        self.overload = overload
+        self.smoothing = smoothing
+        self.half_life = half_life
+        self.per_function = per_function
+        self.weights = dict(weights or {})
+        self.small_job = small_job
+        self.jobs: Dict[int, WorkOrder] = OrderedDict()  # jobs with chunks left to run
+        self.in_flight: Dict[str, List[Tuple[int, int]]] = {}  # worker_id: [(work_id, order)]
+        self.started: Dict[Tuple[str, int, int], float] = {}  # (worker_id, work_id, order): time
+        self.durations: Dict[int, List[float]] = {}  # work_id: times of its completed chunks
+        # (work_id, order): (worker_id of the original, worker_id of the speculative copy)
+        self.copies: Dict[Tuple[int, int], Tuple[str, str]] = {}
+        self.stats = {"speculated": 0, "won": 0, "lost": 0}  # speculative copies run, won, lost
+        self.digests: Dict[int, str] = {}  # work_id: function digest
+        # (worker_id, function digest or None for every function): (items per second per core,
+        # time of the last measurement)
+        self.throughput: Dict[Tuple[str, Union[None, str]], Tuple[float, float]] = {}
+        self._cancellations: List[Assignment] = []  # losing copies to cancel
+        self.usage: Dict[str, float] = {}  # tenant: elements handed out divided by its weight
+        self.small: Set[int] = set()  # work_ids of jobs in the fast lane
+        self.dispatched: Dict[int, int] = {}  # work_id: number of chunks handed out
+        self.work_orders: Dict[int, WorkOrder] = {}  # work_id: WorkOrder of every job added
+
+    def partition(self, length: int, workers: Dict[str, WorkerInfo],
+                  function_digest: Union[None, str] = None) -> List[int]:
+        """Relative sizes of the chunks to cut an array into, largest first.
+        Every core of a worker is given ``chunks_per_core`` chunks sized in proportion
+        to the worker's throughput per core
+
+        :param length: length of the array
+        :type length: int
+        :param workers: dict of worker_id: WorkerInfo
+        :type workers: Dict[str, WorkerInfo]
+        :param function_digest: digest of the function to compute, defaults to None
+        :type function_digest: Union[None, str], optional
+        :return: one weight per chunk for :func:`overkill.servers._utils.split_weighted`
+        :rtype: List[int]
+        """
+        rates = self.rates(workers, function_digest)
+        fastest = max(rates.values(), default=1.0)
+        weights = []
+        for worker in workers.values():
+            # never let a chunk shrink to nothing, a slow worker still takes part
+            weight = max(1, round(1000 * rates[worker.id] / fastest))
+            weights += [weight] * (worker.cores * self.chunks_per_core)
+        weights.sort(reverse=True)
+        return weights[:self.num_chunks(length, len(weights) // self.chunks_per_core)]
+
+    def rates(self, workers: Dict[str, WorkerInfo],
+              function_digest: Union[None, str] = None) -> Dict[str, float]:
+        """Items per second per core of every worker.
+        Measurements of the function are used when there are any, otherwise measurements
+        of every function. Workers without measurements are given the median rate and
+        old measurements are blended with it
+
+        :param workers: dict of worker_id: WorkerInfo
+        :type workers: Dict[str, WorkerInfo]
+        :param function_digest: digest of the function, defaults to None
+        :type function_digest: Union[None, str], optional
+        :return: dict of worker_id: items per second per core
+        :rtype: Dict[str, float]
+        """
+        key = function_digest if self.per_function else None
+        if not any((worker_id, key) in self.throughput for worker_id in workers):
+            key = None
+        measured = {worker_id: self.throughput[(worker_id, key)] for worker_id in workers
+                    if (worker_id, key) in self.throughput}
+        if not measured:
+            return {worker_id: 1.0 for worker_id in workers}
+        default = median(rate for rate, _ in measured.values())
+        now = time.monotonic()
+        rates = {}
+        for worker_id in workers:
+            if worker_id not in measured:
+                rates[worker_id] = default
+                continue
+            rate, measured_at = measured[worker_id]
+            trust = 0.5 ** ((now - measured_at) / self.half_life)
+            rates[worker_id] = trust * rate + (1 - trust) * default
+        return rates
+
+    def num_chunks(self, length: int, resources: int) -> int:
+        """Number of chunks to cut an array into
+
+        :param length: length of the array
+        :type length: int
+        :param resources: total cores of all workers
+        :type resources: int
+        :return: number of chunks
+        :rtype: int
+        """
+        return min(length, max(1, resources) * self.chunks_per_core)
+
+    def add_job(self, work_id: int, work_order: WorkOrder) -> None:
+        """Queue every chunk of a job.
+        A tenant without queued jobs is charged as much as the least charged busy tenant
+
+        :param work_id: id of the job
+        :type work_id: int
+        :param work_order: work order of the job, its chunks are queued in order
+        :type work_order: WorkOrder
+        """
+        if work_order.pending:
+            if work_id not in self.jobs:
+                busy = {job.tenant for job in self.jobs.values() if job.pending}
+                self.usage = {tenant: self.usage[tenant] for tenant in busy
+                              if tenant in self.usage}
+                # tenants whose chunks were handed back after they went idle start level too
+                level = min(self.usage.values(), default=0.0)
+                for tenant in busy | {work_order.tenant}:
+                    self.usage.setdefault(tenant, level)
+                if (work_order.input_complete and
+                        sum(len(chunk or ()) for chunk in work_order.chunks) <= self.small_job):
+                    self.small.add(work_id)
+            self.jobs[work_id] = work_order
+            self.work_orders[work_id] = work_order
+            self.durations.setdefault(work_id, [])
+            self.digests[work_id] = work_order.function_digest
+
+    def remove_job(self, work_id: int) -> None:
+        """Drop a job's queue, chunks already in flight are left to finish
+
+        :param work_id: id of the job
+        :type work_id: int
+        """
+        self.jobs.pop(work_id, None)
+        self.durations.pop(work_id, None)
+        self.digests.pop(work_id, None)
+        self.small.discard(work_id)
+        self.dispatched.pop(work_id, None)
+        self.work_orders.pop(work_id, None)
+        for key in [key for key in self.copies if key[0] == work_id]:
+            self.copies.pop(key)
+
+    def complete(self, worker_id: str, work_id: int, order: int,
+                 workers: Union[None, Dict[str, WorkerInfo]] = None,
+                 items: Union[None, int] = None, elapsed: Union[None, float] = None) -> None:
+        """Free the worker's slot for a chunk it has returned and record how long it took
+        and the worker's throughput.
+        If the chunk was run speculatively the other copy lost and is cancelled
+
+        :param worker_id: id of the worker
+        :type worker_id: str
+        :param work_id: id of the job
+        :type work_id: int
+        :param order: index of the chunk
+        :type order: int
+        :param workers: dict of worker_id: WorkerInfo, used to cancel the losing copy
+            of a speculative chunk, defaults to None
+        :type workers: Union[None, Dict[str, WorkerInfo]], optional
+        :param items: number of items the worker computed, defaults to None
+        :type items: Union[None, int], optional
+        :param elapsed: seconds the worker spent computing the chunk, defaults to None
+            (the time since the chunk was sent)
+        :type elapsed: Union[None, float], optional
+        """
+        key = (work_id, order)
+        self._free(worker_id, work_id, order)
+        start = self.started.pop((worker_id, work_id, order), None)
+        if start is not None and work_id in self.durations:
+            self.durations[work_id].append(time.monotonic() - start)
+        if elapsed is None and start is not None:
+            elapsed = time.monotonic() - start
+        if items and elapsed and workers is not None and worker_id in workers:
+            self._measure(workers[worker_id], self.digests.get(work_id), items, elapsed)
+        if key in self.copies:
+            original, copy = self.copies.pop(key)
+            self.stats["won" if worker_id == copy else "lost"] += 1
+            loser = original if worker_id == copy else copy
+            if workers is not None and loser in workers and self._free(loser, work_id, order):
+                self.started.pop((loser, work_id, order), None)
+                self._cancellations.append(Assignment(workers[loser], work_id, order))
+
+    def _measure(self, worker: WorkerInfo, function_digest: Union[None, str],
+                 items: int, elapsed: float) -> None:
+        """Fold a measurement into the worker's average throughput, overall and per function
+
+        :param worker: the worker
+        :type worker: WorkerInfo
+        :param function_digest: digest of the function computed
+        :type function_digest: Union[None, str]
+        :param items: number of items computed
+        :type items: int
+        :param elapsed: seconds spent computing them
+        :type elapsed: float
+        """
+        rate = items / max(elapsed, 1e-6) / worker.cores
+        now = time.monotonic()
+        keys = [(worker.id, None)]
+        if self.per_function and function_digest is not None:
+            keys.append((worker.id, function_digest))
+        for key in keys:
+            if key in self.throughput:
+                old, measured_at = self.throughput[key]
+                # the older the average the more the new measurement counts
+                weight = max(self.smoothing, 1 - 0.5 ** ((now - measured_at) / self.half_life))
+                average = weight * rate + (1 - weight) * old
+            else:
+                average = rate
+            if math.isfinite(average):
+                self.throughput[key] = (average, now)
+
+    def _free(self, worker_id: str, work_id: int, order: int) -> bool:
+        """Free a worker's slot
+
+        :return: whether the worker had the chunk in flight
+        :rtype: bool
+        """
+        in_flight = self.in_flight.get(worker_id, [])
+        if (work_id, order) in in_flight:
+            in_flight.remove((work_id, order))
+            return True
+        return False
+
+    def forget_worker(self, worker_id: str, work_orders: Dict[int, WorkOrder]) -> None:
+        """Requeue every unfinished chunk of a worker that has gone away
+
+        :param worker_id: id of the worker
+        :type worker_id: str
+        :param work_orders: dict of work_id: WorkOrder of all running jobs
+        :type work_orders: Dict[int, WorkOrder]
+        """
+        for key in [key for key in self.throughput if key[0] == worker_id]:
+            self.throughput.pop(key)
+        for work_id, order in reversed(self.in_flight.pop(worker_id, [])):
+            self.started.pop((worker_id, work_id, order), None)
+            copy = self.copies.pop((work_id, order), None)
+            if copy is not None and worker_id in copy:
+                continue  # the other copy is still running
+            work_order = work_orders.get(work_id)
+            if work_order is None or work_order.error or work_order.is_done(order):
+                continue
+            work_order.pending.appendleft(order)
+            self.jobs[work_id] = work_order
+
+    def assign(self, workers: Dict[str, WorkerInfo]) -> Tuple[List[Assignment], List[Assignment]]:
+        """Fill the free slots of every worker that accepts work.
+        Workers take turns, least loaded first, so that chunks are spread across the cluster.
+        A full worker hands back a chunk that has not started when a more urgent job is waiting
+
+        :param workers: dict of worker_id: WorkerInfo
+        :type workers: Dict[str, WorkerInfo]
+        :return: new assignments and the assignments stolen from a busy worker or
+            handed back for a more urgent job, which should be cancelled on that worker
+        :rtype: Tuple[List[Assignment], List[Assignment]]
+        """
+        assignments, cancellations = [], self._cancellations
+        self._cancellations = []
+        now = time.monotonic()
+        available = self._by_load(workers)
+        slow = self._slow(workers)
+        assigned = True
+        while assigned:
+            assigned = False
+            for worker in available:
+                in_flight = self.in_flight.setdefault(worker.id, [])
+                if len(in_flight) >= self._capacity(worker):
+                    preempted = self._preempt(worker)
+                    if preempted is None:
+                        continue
+                    cancellations.append(preempted)
+                work_id, order = self._next_chunk(slow=worker.id in slow)
+                if work_id is None:
+                    if in_flight:
+                        continue
+                    stolen = self._steal(workers)
+                    if stolen is None:
+                        continue
+                    cancellations.append(stolen)
+                    work_id, order = stolen.work_id, stolen.order
+                    copy = self.copies.get((work_id, order))
+                    if copy is not None:  # a speculative copy moves with the chunk
+                        self.copies[(work_id, order)] = tuple(
+                            worker.id if w == stolen.worker.id else w for w in copy)
+                in_flight.append((work_id, order))
+                self.started[(worker.id, work_id, order)] = now
+                assignments.append(Assignment(worker, work_id, order))
+                assigned = True
+        return assignments, cancellations
+
+    def speculate(self, workers: Dict[str, WorkerInfo],
+                  work_orders: Dict[int, WorkOrder]) -> List[Assignment]:
+        """Run straggling chunks again on workers with an idle core.
+        A chunk straggles once most of its job is done and it has been running
+        for much longer than the job's median chunk time
+
+        :param workers: dict of worker_id: WorkerInfo
+        :type workers: Dict[str, WorkerInfo]
+        :param work_orders: dict of work_id: WorkOrder of all running jobs
+        :type work_orders: Dict[int, WorkOrder]
+        :return: speculative copies to send
+        :rtype: List[Assignment]
+        """
+        if not self.speculation:
+            return []
+        idle = [w for w in self._by_load(workers) if len(self.in_flight.get(w.id, [])) < w.cores]
+        assignments = []
+        now = time.monotonic()
+        for (worker_id, work_id, order), start in sorted(self.started.items(),
+                                                         key=lambda item: item[1]):
+            if not idle:
+                break
+            work_order = work_orders.get(work_id)
+            durations = self.durations.get(work_id)
+            if ((work_id, order) in self.copies or work_order is None or not durations
+                    or work_order.error or work_order.pending or not work_order.input_complete
+                    or work_order.is_done(order)
+                    or work_order.completed < self.speculate_after * work_order.num_chunks):
+                continue
+            threshold = max(self.min_straggler_time, self.straggler_factor * median(durations))
+            if now - start < threshold:
+                continue
+            worker = next((w for w in idle if w.id != worker_id), None)
+            if worker is None:
+                continue
+            self.in_flight.setdefault(worker.id, []).append((work_id, order))
+            self.started[(worker.id, work_id, order)] = now
+            self.copies[(work_id, order)] = (worker_id, worker.id)
+            self.stats["speculated"] += 1
+            assignments.append(Assignment(worker, work_id, order))
+            if len(self.in_flight[worker.id]) >= worker.cores:
+                idle.remove(worker)
+        return assignments
+
+    def _capacity(self, worker: WorkerInfo) -> int:
+        """Number of chunks a worker can have in flight
+
+        :param worker: the worker
+        :type worker: WorkerInfo
+        :return: cores of the worker, plus prefetch unless its machine is overloaded
+        :rtype: int
+        """
+        if worker.load is not None and worker.load > self.overload:
+            return worker.cores
+        return worker.cores + self.prefetch
+
+    def _by_load(self, workers: Dict[str, WorkerInfo]) -> List[WorkerInfo]:
+        """Workers that accept work, least loaded first.
+        Workers are ordered by the fraction of their slots in use, then by the load of their machine
+
+        :param workers: dict of worker_id: WorkerInfo
+        :type workers: Dict[str, WorkerInfo]
+        :return: list of workers
+        :rtype: List[WorkerInfo]
+        """
+        return sorted((w for w in workers.values() if w.can_accept_work),
+                      key=lambda w: (len(self.in_flight.get(w.id, [])) / w.cores, w.load or 0))
+
+    def _slow(self, workers: Dict[str, WorkerInfo]) -> Set[str]:
+        """Workers slower than the median worker, they take the smallest chunks
+
+        :param workers: dict of worker_id: WorkerInfo
+        :type workers: Dict[str, WorkerInfo]
+        :return: set of worker ids
+        :rtype: Set[str]
+        """
+        if not any(key[1] is None for key in self.throughput):
+            return set()
+        rates = self.rates(workers)
+        middle = median(rates.values()) if rates else 0
+        return {worker_id for worker_id, rate in rates.items() if rate < middle}
+
+    def _next_chunk(self, slow: bool = False) -> Tuple[Union[None, int], Union[None, int]]:
+        """Pop the next chunk of the job that is served next and charge its tenant.
+        Chunks are queued largest first, slow workers take from the back of the queue
+
+        :param slow: whether the chunk is for a slow worker, defaults to False
+        :type slow: bool, optional
+        :return: work_id, order of the chunk or None, None if every queue is empty
+        :rtype: Tuple[Union[None, int], Union[None, int]]
+        """
+        work_id = self._next_job()
+        if work_id is None:
+            return None, None
+        work_order = self.jobs[work_id]
+        order = work_order.pending.pop() if slow else work_order.pending.popleft()
+        self.jobs.move_to_end(work_id)  # jobs of a tenant take turns
+        self.dispatched[work_id] = self.dispatched.get(work_id, 0) + 1
+        self.usage[work_order.tenant] = (self.usage.get(work_order.tenant, 0.0) +
+                                         self._cost(work_order, order))
+        return work_id, order
+
+    def _cost(self, work_order: WorkOrder, order: int) -> float:
+        """What a chunk is charged to its tenant: its elements divided by the tenant's weight
+
+        :param work_order: work order of the chunk
+        :type work_order: WorkOrder
+        :param order: index of the chunk
+        :type order: int
+        :return: charge of the chunk
+        :rtype: float
+        """
+        size = max(1, len(work_order.chunks[order] or ()))
+        return size / self.weights.get(work_order.tenant, 1.0)
+
+    def _next_job(self) -> Union[None, int]:
+        """Pick the job to serve next: small jobs first, then the highest priority,
+        then the least charged tenant, then the job of that tenant served longest ago.
+        Jobs with nothing left to queue are dropped
+
+        :return: work_id of the job or None if every queue is empty
+        :rtype: Union[None, int]
+        """
+        best, best_rank = None, None
+        for work_id, work_order in list(self.jobs.items()):
+            if work_order.error or not work_order.pending:
+                self.jobs.pop(work_id)
+                continue
+            rank = (work_id not in self.small, -work_order.priority,
+                    self.usage.get(work_order.tenant, 0.0))
+            if best_rank is None or rank < best_rank:
+                best, best_rank = work_id, rank
+        return best
+
+    def _urgency(self, work_id: int) -> Tuple[bool, int]:
+        """Rank of a job that decides whether it may take a queued chunk's place, lower first
+
+        :param work_id: id of the job
+        :type work_id: int
+        :return: whether the job is not in the fast lane, minus its priority
+        :rtype: Tuple[bool, int]
+        """
+        work_order = self.work_orders.get(work_id)
+        return work_id not in self.small, -(work_order.priority if work_order else 0)
+
+    def _preempt(self, worker: WorkerInfo) -> Union[None, Assignment]:
+        """Hand back the most recently queued chunk of a full worker if it has not started
+        and a more urgent job is waiting. The chunk is put back at the front of its queue
+
+        :param worker: the full worker
+        :type worker: WorkerInfo
+        :return: the assignment handed back or None if nothing is more urgent
+        :rtype: Union[None, Assignment]
+        """
+        in_flight = self.in_flight[worker.id]
+        if len(in_flight) <= worker.cores:
+            return None  # every chunk may be running
+        work_id, order = in_flight[-1]
+        urgent = self._next_job()
+        work_order = self.work_orders.get(work_id)
+        if (urgent is None or work_order is None or (work_id, order) in self.copies or
+                self._urgency(urgent) >= self._urgency(work_id)):
+            return None
+        in_flight.pop()
+        self.started.pop((worker.id, work_id, order), None)
+        work_order.pending.appendleft(order)
+        self.jobs[work_id] = work_order
+        if work_order.tenant in self.usage:
+            self.usage[work_order.tenant] -= self._cost(work_order, order)
+        return Assignment(worker, work_id, order)
+
+    def _steal(self, workers: Dict[str, WorkerInfo]) -> Union[None, Assignment]:
+        """Take the most recently queued chunk from the worker with the longest backlog.
+        Only chunks queued beyond a worker's cores are stolen, they have not started yet
+
+        :param workers: dict of worker_id: WorkerInfo
+        :type workers: Dict[str, WorkerInfo]
+        :return: the stolen assignment or None if there is nothing to steal
+        :rtype: Union[None, Assignment]
+        """
+        victim, backlog = None, 0
+        for worker in workers.values():
+            queued = len(self.in_flight.get(worker.id, [])) - worker.cores
+            if queued > backlog:
+                victim, backlog = worker, queued
+        if victim is None:
+            return None
+        work_id, order = self.in_flight[victim.id].pop()
+        self.started.pop((victim.id, work_id, order), None)
+        return Assignment(victim, work_id, order)
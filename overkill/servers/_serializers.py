@@ -0,0 +1,177 @@
+"""Serializers used to encode messages, functions are always encoded with dill"""
+
+import logging
+import pickle
+from typing import Any, Callable, Dict, List, Union
+
+import dill
+
+try:
+    import msgpack
+except ImportError:  # msgpack is optional
+    msgpack = None
+
+__all__ = [
+    "DILL",
+    "PICKLE",
+    "MSGPACK",
+    "DEFAULT_SERIALIZER",
+    "Serializer",
+    "get_serializer",
+    "serializer_for_tag"
+]
+
+DILL = "dill"
+PICKLE = "pickle"
+MSGPACK = "msgpack"
+DEFAULT_SERIALIZER = PICKLE
+
+_PROTOCOL = min(5, pickle.HIGHEST_PROTOCOL)  # protocol 5 adds out-of-band buffers
+
+
+class Serializer:
+    """Base serializer, subclasses set a name, a one byte tag and
+    the name of the serializer to fall back to when an object is not supported.
+    Encoded messages start with the tag, so peers can use different serializers"""
+    name: str = None
+    tag: bytes = None
+    fallback: Union[None, str] = None
+
+    def dump(self, obj: Any, file, buffer_callback: Union[None, Callable] = None) -> None:
+        """Write the encoded object to a binary file
+
+        :param obj: object to encode
+        :type obj: Any
+        :param file: binary file to write to
+        :param buffer_callback: pickle protocol 5 buffer callback, defaults to None
+        :type buffer_callback: Union[None, Callable], optional
+        """
+        raise NotImplementedError()
+
+    def loads(self, data: memoryview, buffers: Union[None, List] = None) -> Any:
+        """Decode an object
+
+        :param data: encoded object, without the tag
+        :type data: memoryview
+        :param buffers: out-of-band buffers, defaults to None
+        :type buffers: Union[None, List], optional
+        :return: decoded object
+        :rtype: Any
+        """
+        raise NotImplementedError()
+
+
+class DillSerializer(Serializer):
+    """Slow, but able to encode almost anything"""
+    name = DILL
+    tag = b"D"
+
+    def dump(self, obj, file, buffer_callback=None):
+        if _PROTOCOL < 5:
+            dill.dump(obj, file)
+        else:
+            dill.dump(obj, file, protocol=_PROTOCOL, buffer_callback=buffer_callback)
+
+    def loads(self, data, buffers=None):
+        if buffers:
+            return dill.loads(data, buffers=buffers)
+        return dill.loads(data)
+
+
+class PickleSerializer(Serializer):
+    """The C pickle at the highest protocol, falls back to dill"""
+    name = PICKLE
+    tag = b"P"
+    fallback = DILL
+
+    def dump(self, obj, file, buffer_callback=None):
+        if _PROTOCOL < 5:
+            pickle.dump(obj, file, protocol=pickle.HIGHEST_PROTOCOL)
+        else:
+            pickle.dump(obj, file, protocol=pickle.HIGHEST_PROTOCOL,
+                        buffer_callback=buffer_callback)
+
+    def loads(self, data, buffers=None):
+        if buffers:
+            return pickle.loads(data, buffers=buffers)
+        return pickle.loads(data)
+
+
+class MsgpackSerializer(Serializer):
+    """msgpack for plain data, falls back to pickle.
+    Tuples are encoded as an extension type so that they are not decoded as lists
+    (e.g. addresses, which are used as dict keys)"""
+    name = MSGPACK
+    tag = b"M"
+    fallback = PICKLE
+
+    def dump(self, obj, file, buffer_callback=None):
+        file.write(_packb(obj))
+
+    def loads(self, data, buffers=None):
+        return _unpackb(data)
+
+
+_MSGPACK_TUPLE = 1  # msgpack extension type code of tuples
+
+
+def _packb(obj: Any) -> bytes:
+    """Encode with msgpack, only exact types are encoded natively"""
+    return msgpack.packb(obj, use_bin_type=True, strict_types=True, default=_msgpack_default)
+
+
+def _unpackb(data: Union[bytes, memoryview]) -> Any:
+    """Decode with msgpack"""
+    return msgpack.unpackb(data, raw=False, strict_map_key=False, ext_hook=_msgpack_ext_hook)
+
+
+def _msgpack_default(obj: Any) -> Any:
+    """Encode the types msgpack does not support natively,
+    anything other than a tuple raises so that pickle is used instead"""
+    if type(obj) is tuple:
+        return msgpack.ExtType(_MSGPACK_TUPLE, _packb(list(obj)))
+    raise TypeError(f"msgpack cannot encode {type(obj).__name__}")
+
+
+def _msgpack_ext_hook(code: int, data: bytes) -> Any:
+    """Decode the extension types written by :func:`_msgpack_default`"""
+    if code == _MSGPACK_TUPLE:
+        return tuple(_unpackb(data))
+    return msgpack.ExtType(code, data)
+
+
+_serializers: Dict[str, Serializer] = {s.name: s for s in (DillSerializer(), PickleSerializer(),
+                                                           MsgpackSerializer())}
+_tags: Dict[bytes, Serializer] = {s.tag: s for s in _serializers.values()}
+
+
+def get_serializer(name: str) -> Serializer:
+    """Get a serializer by name.
+    msgpack falls back to pickle if it is not installed
+
+    :param name: one of "dill", "pickle" or "msgpack"
+    :type name: str
+    :raises ValueError: no such serializer
+    :return: serializer
+    :rtype: Serializer
+    """
+    if name not in _serializers:
+        raise ValueError(f"No such serializer {name}, use one of {list(_serializers)}")
+    if name == MSGPACK and msgpack is None:
+        logging.warning("msgpack is not installed, using pickle instead")
+        name = PICKLE
+    return _serializers[name]
+
+
+def serializer_for_tag(tag: bytes) -> Serializer:
+    """Get the serializer that encoded a message from the message's tag
+
+    :param tag: one byte tag
+    :type tag: bytes
+    :raises ValueError: no serializer has the tag
+    :return: serializer
+    :rtype: Serializer
+    """
+    if tag not in _tags:
+        raise ValueError(f"Unknown serializer tag {tag}")
+    return _tags[tag]
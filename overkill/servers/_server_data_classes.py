@@ -1,19 +1,40 @@
 """Module stores information about the servers"""
 
+import time
+from collections import deque
 from dataclasses import dataclass, field
-from threading import Event
-from typing import List, Tuple, Union
+from queue import Queue
+from threading import Event, Lock
+from typing import Any, Deque, Dict, List, Tuple, Union
 
+from overkill.servers._memo import MemoChunk
 from overkill.servers._server_exceptions import WorkError
+from overkill.servers._utils import LRUCache
 
 
 @dataclass
 class WorkerInfo:
-    """Worker inforamtion class"""
+    """Worker inforamtion class.
+    The load of the worker is refreshed by every heartbeat it sends,
+    a worker that has missed heartbeats does not accept work until its next heartbeat"""
     id: str
     name: str
     address: Tuple
     can_accept_work: bool = True
+    cores: int = 1
+    function_cache_size: int = 16
+    functions: LRUCache = field(default=None, repr=False)  # digests cached by the worker
+    queued: int = 0  # chunks waiting on the worker
+    running: int = 0  # chunks being computed by the worker
+    load: Union[None, float] = None  # cpu load average per cpu of the worker's machine
+    free_memory: Union[None, int] = None  # bytes of memory available on the worker's machine
+    last_seen: float = field(default_factory=time.monotonic, repr=False)  # last heartbeat
+    metrics: Union[None, Dict] = field(default=None, repr=False)  # reported in heartbeats
+    codecs: List[str] = field(default_factory=list, repr=False)  # negotiated with the worker
+
+    def __post_init__(self):
+        if self.functions is None:
+            self.functions = LRUCache(self.function_cache_size)
 
 
 @dataclass
@@ -24,23 +45,137 @@ class MasterInfo:
 
 @dataclass
 class WorkOrder:
-    """Class documents information about a work order from a client"""
-    num_workers: int
-    event: Event
-    data: List = field(default_factory=lambda: [], repr=False)
+    """Class documents information about a work order from a client.
+    The array is cut into chunks, every computed chunk is stored in its own slot"""
+    num_chunks: int
+    event: Event  # set once the work order is complete or failed, asyncio's on an event loop
+    function: bytes = field(default=None, repr=False)  # dill encoded function
+    function_digest: str = None
+    chunks: List[List] = field(default_factory=lambda: [], repr=False)
+    pending: Deque[int] = field(default=None, repr=False)  # chunks waiting for a worker
+    data: List[List] = field(default=None, repr=False)  # one slot per chunk
+    done: bytearray = field(default=None, repr=False)  # one flag per chunk
+    stream: Union[None, Queue] = field(default=None, repr=False)  # computed chunks, if streamed
+    completed: int = 0
     progress: float = 0
+    input_complete: bool = True  # False until every chunk of a lazy work order has arrived
+    memo: Dict[int, MemoChunk] = field(default_factory=dict, repr=False)  # cached elements
+    # dill encoded reducer of a map-reduce, each slot then holds the chunk's partial result
+    reducer: bytes = field(default=None, repr=False)
+    reducer_digest: str = None
+    initial: Any = field(default=None, repr=False)  # initial value of a map-reduce
+    has_initial: bool = False  # whether the map-reduce has an initial value
+    tenant: str = None  # user the work order is charged to
+    priority: int = 0  # work orders with a higher priority are served first
+    submitted: float = field(default_factory=time.monotonic, repr=False)
+    trace_id: str = None  # id of the trace of a traced task
     error: Union[None, WorkError] = None
+    lock: Lock = field(default_factory=Lock, repr=False, compare=False)  # of this work order only
+
+    def __post_init__(self):
+        if self.pending is None:
+            self.pending = deque(range(len(self.chunks)))
+        if self.done is None:
+            self.done = bytearray(self.num_chunks)
+        if self.data is None and self.stream is None:
+            self.data = [None] * self.num_chunks
+        self._finish_if_complete()
 
     def update(self, new_data: List, order: int) -> float:
-        """Update the work order given new data
+        """Update the work order given new data for a chunk.
+        Streaming work orders put the chunk on the stream instead of keeping it,
+        a None on the stream marks the end of the work order.
+        Duplicate results for a chunk and results after an error are discarded
 
         :param new_data: array of new data
         :type new_data: List
-        :param order: order in the original list (i.e where to insert)
+        :param order: index of the chunk in the original list
         :type order: int
         :return: Progress of the order between 0-1 where 1 is completely done
         :rtype: float
         """
-        self.data.insert(order, new_data)
-        self.progress = len(self.data) / self.num_workers
-        return self.progress
+        with self.lock:
+            if self.done[order] or self.error:
+                return self.progress
+            self.done[order] = 1
+            self.completed += 1
+            if self.stream is None:
+                self.data[order] = new_data
+            else:
+                self.stream.put_nowait((order, new_data))
+            self.chunks[order] = None  # input is no longer needed
+            self.progress = self.completed / self.num_chunks
+            self._finish_if_complete()
+            return self.progress
+
+    def add_chunk(self, chunk: List, memo: Union[None, MemoChunk] = None) -> int:
+        """Add the next chunk of a lazy work order's input, a lazy work order is only
+        complete once its input is closed.
+        Chunks whose every element is cached are not queued for the workers
+
+        :param chunk: chunk of the input array, without its cached elements
+        :type chunk: List
+        :param memo: plan of the chunk if memoization is on, defaults to None
+        :type memo: Union[None, MemoChunk], optional
+        :return: index of the chunk
+        :rtype: int
+        """
+        with self.lock:
+            order = self.num_chunks
+            self.chunks.append(chunk)
+            self.done.append(0)
+            self.num_chunks += 1
+            self.progress = self.completed / self.num_chunks
+            if memo is not None:
+                self.memo[order] = memo
+            if memo is None or memo.missing:
+                self.pending.append(order)
+            return order
+
+    def close_input(self) -> None:
+        """Mark the input of a lazy work order as complete"""
+        with self.lock:
+            self.input_complete = True
+            self._finish_if_complete()
+
+    def _finish_if_complete(self) -> None:
+        """Wake up anyone waiting on the work order once every chunk has been computed.
+        Must be called while holding the work order's lock"""
+        if self.input_complete and self.completed == self.num_chunks and not self.event.is_set():
+            self.event.set()
+            if self.stream is not None:
+                self.stream.put_nowait(None)
+
+    def is_done(self, order: int) -> bool:
+        """Whether a chunk has been computed
+
+        :param order: index of the chunk
+        :type order: int
+        :return: True if the chunk's result has been recorded
+        :rtype: bool
+        """
+        return bool(self.done[order])
+
+    def fail(self, error: WorkError) -> None:
+        """Stop the work order with an error and wake up anyone waiting on it.
+        Work orders that have already completed or failed are left as they are
+
+        :param error: error to give the client
+        :type error: WorkError
+        """
+        with self.lock:
+            if self.error or self.event.is_set():
+                return
+            self.error = error
+            self.event.set()
+            if self.stream is not None:
+                self.stream.put_nowait(None)
+
+    def results(self) -> List[List]:
+        """Get the computed chunks in their original order.
+        The slots are returned as they are, without copying or flattening them
+
+        :return: list of computed chunks
+        :rtype: List[List]
+        """
+        return self.data
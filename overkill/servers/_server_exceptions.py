@@ -17,6 +17,17 @@ class WorkError(Exception):
     execute the user's aray on the function"""
 
 
+class FunctionNotCachedError(KeyError):
+    """Raise this error when a worker is asked to compute a function
+    it does not have in its cache"""
+
+
+class BroadcastNotCachedError(Exception):
+    """Raise this error when a function dereferences a broadcast variable
+    the worker does not have in its cache.
+    Not a KeyError so that functions catching KeyError do not swallow it"""
+
+
 class NoWorkersError(Exception):
     """Raise this error when there are no workers connected to Master and
     the user tries to ask for work"""
@@ -6,16 +6,29 @@ interact with each other
 
 # User messaging standards:
 DISTRIBUTE = "distribute"  # ask master to distribute task
+INPUT_CHUNK = "input_chunk"  # next chunk of the input of a lazy task
+END_OF_INPUT = "end_of_input"  # every chunk of a lazy task has been sent
+BROADCAST = "broadcast"  # store a broadcast variable (the master sends it on to every worker)
+RELEASE = "release"  # drop a broadcast variable (the master sends it on to every worker)
+STATUS = "status"  # ask master for the state of its job queue
 
 # Master messaging standards:
 NEW_CONNECTION = "new_connect"  # recieve connection from a worker
 REJECT = "reject"  # reject a worker that is trying to connect to master
 ACCEPT = "accept"  # accept a worker that is trying to connect to master
 DELEGATE_WORK = "delegate_work"  # delegate work to a worker
+STARTED_TASK = "started_task"  # lazy task has started, the user can send its input
+CANCEL_WORK = "cancel_work"  # cancel a queued chunk that has been given to another worker
+PARTIAL_RESULT = "partial_result"  # a chunk of a streamed task has been finished
 FINISHED_TASK = "finished_task"  # task from user has been completely finished
 NO_WORKERS_ERROR = "no_workers_error" # error when there are no workers when the user asks for work
+BROADCAST_STORED = "broadcast_stored"  # the master has stored a broadcast variable
+STATUS_REPORT = "status_report"  # queued, running and recently completed jobs
 
 # Worker messsaging standards:
 CLOSE_CONNECTION = "close"  # close connection with master
 ACCEPT_WORK = "accept_work"  # accept work from a worker
 WORK_ERROR = "work_error"  # error when computing the function on the array
+FUNCTION_MISS = "function_miss"  # ask master to resend a function missing from the worker's cache
+BROADCAST_MISS = "broadcast_miss"  # ask master to resend a broadcast variable missing from the worker's cache
+HEARTBEAT = "heartbeat"  # periodic report of the worker's load, workers that stop sending it are evicted
@@ -0,0 +1,116 @@
+"""Tracing of single tasks across the user, the master and the workers"""
+
+import json
+import threading
+import uuid
+from collections import OrderedDict
+from typing import Dict, List
+
+__all__ = [
+    "new_trace_id",
+    "record",
+    "extend",
+    "collect",
+    "chrome_trace",
+    "write_chrome_trace"
+]
+
+_MAX_TRACES = 1000  # spans of the oldest trace are dropped beyond this many traces
+
+_lock = threading.Lock()  # guards _spans
+_spans: "OrderedDict[str, List[Dict]]" = OrderedDict()  # trace id: spans
+
+
+def new_trace_id() -> str:
+    """A new random trace id. It travels with every message of the task,
+    tasks without a trace id record nothing
+
+    :return: trace id
+    :rtype: str
+    """
+    return uuid.uuid4().hex
+
+
+def record(trace_id: str, process: str, name: str, start: float, duration: float,
+           **args) -> None:
+    """Record a span of a trace. Spans are timed with the wall clock so the spans of
+    different computers share one timeline, their clocks should be synchronised (e.g. NTP)
+
+    :param trace_id: id of the trace
+    :type trace_id: str
+    :param process: process the span ran on, e.g. "master"
+    :type process: str
+    :param name: name of the stage
+    :type name: str
+    :param start: time.time() when the stage started
+    :type start: float
+    :param duration: seconds the stage took
+    :type duration: float
+    """
+    span = {"name": name, "process": process, "start": start, "duration": duration,
+            "thread": threading.get_ident(), "args": args}
+    extend(trace_id, [span])
+
+
+def extend(trace_id: str, spans: List[Dict]) -> None:
+    """Add spans recorded by another process to a trace
+
+    :param trace_id: id of the trace
+    :type trace_id: str
+    :param spans: spans to add
+    :type spans: List[Dict]
+    """
+    with _lock:
+        if trace_id not in _spans:
+            _spans[trace_id] = []
+            if len(_spans) > _MAX_TRACES:
+                _spans.popitem(last=False)
+        _spans[trace_id].extend(spans)
+
+
+def collect(trace_id: str) -> List[Dict]:
+    """Take every span of a trace recorded in this process so far
+
+    :param trace_id: id of the trace
+    :type trace_id: str
+    :return: list of spans, dicts of name, process, start (seconds since the epoch),
+        duration (seconds), thread and args
+    :rtype: List[Dict]
+    """
+    with _lock:
+        return _spans.pop(trace_id, [])
+
+
+def chrome_trace(spans: List[Dict]) -> Dict:
+    """Convert spans to the Chrome trace event format, every process
+    gets its own row. Load it in chrome://tracing or https://ui.perfetto.dev,
+    gaps between spans are time spent on the network
+
+    :param spans: spans of a trace
+    :type spans: List[Dict]
+    :return: dict of traceEvents and displayTimeUnit
+    :rtype: Dict
+    """
+    pids = {}
+    events = []
+    for span in sorted(spans, key=lambda span: span["start"]):
+        if span["process"] not in pids:
+            pids[span["process"]] = len(pids) + 1
+            events.append({"name": "process_name", "ph": "M", "pid": pids[span["process"]],
+                           "args": {"name": span["process"]}})
+        events.append({"name": span["name"], "ph": "X", "pid": pids[span["process"]],
+                       "tid": span["thread"], "ts": span["start"] * 1e6,
+                       "dur": span["duration"] * 1e6, "args": span["args"]})
+    return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+
+def write_chrome_trace(spans: List[Dict], path: str) -> None:
+    """Write spans to a file in the Chrome trace event format
+
+    :param spans: spans of a trace
+    :type spans: List[Dict]
+    :param path: file to write
+    :type path: str
+    """
+    with open(path, "w") as f:
+        json.dump(chrome_trace(spans), f)
@@ -1,19 +1,65 @@
 """General unsorted utility functions"""
 
+import asyncio
 import functools
+import hashlib
+import io
+import itertools
+import pickle
 import socket
 import struct
 import threading
-from typing import Any, Dict, List, Tuple, Union
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, List, Tuple, Union
 import dill
 
+from overkill.servers import _metrics
+from overkill.servers._compression import NONE, compress, decompress
+from overkill.servers._serializers import (DEFAULT_SERIALIZER, get_serializer,
+                                           serializer_for_tag)
+
 # sending and recieving data adapted from:
 # https://stackoverflow.com/questions/17667903/python-socket-receive-large-amount-of-data
 
+# Messages are sent as a sequence of frames so that messages of any size can be sent
+# and so that frames of different messages can interleave on the same connection.
+# Every frame starts with the protocol version, flags, the id of its message and
+# the length of its body. The first frame of a message carries the message header:
+# the payload length, the number of out-of-band buffers, the codec id and the length
+# of every buffer. The following frames carry the payload and then the buffers,
+# at most FRAME_SIZE bytes at a time, the last frame of a message is flagged as such.
+VERSION = 2  # version of the framing protocol
+FRAME_SIZE = 1024 * 1024  # maximum number of bytes of a message carried by a frame
+_FRAME = struct.Struct(">BBIQ")  # version, flags, message id, length of the frame's body
+_MESSAGE = struct.Struct(">QHB")  # payload length, number of out-of-band buffers, codec id
+_BUFFER_LENGTH = struct.Struct(">Q")  # length of each out-of-band buffer
+_FIRST = 1  # the frame carries the message header
+_LAST = 2  # the frame is the last frame of its message
+_MAX_HEADER = _MESSAGE.size + 0xFFFF * _BUFFER_LENGTH.size  # longest possible message header
+MAX_MESSAGE_SIZE = 4 * 1024 ** 3  # longer messages (payload and buffers) are rejected
+_IOV_MAX = 1024  # maximum number of buffers given to a single sendmsg call
+OUT_OF_BAND_THRESHOLD = 64 * 1024  # smaller buffers are kept in the pickle stream
+
+_message_ids = itertools.count()  # ids of the messages sent by this process
+
+
+class Message(bytearray):
+    """Encoded message along with the buffers that travel out-of-band
+    as separate frames, e.g. the data of a large NumPy array"""
+
+    def __init__(self, *args, buffers: List = None) -> None:
+        super().__init__(*args)
+        self.buffers = buffers or []
+
+
+class FramingError(ValueError):
+    """A frame does not follow the framing protocol"""
+
 
 def send_message(message: bytes, address: Tuple[str, int]) -> None:
     """Send a message to an arbitrary address. Function also
-    prepends 4 bytes which includes the size of the message.
+    prepends a header which includes the size of the message.
     Warning: does not handle any exceptions
 
     :param message: bytes to be sent
@@ -23,39 +69,270 @@ def send_message(message: bytes, address: Tuple[str, int]) -> None:
     """
     with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
         s.connect(address)
-        message = struct.pack(">I", len(message)) + message
-        s.sendall(message)
+        socket_send_message(message, s)
 
 
-def socket_send_message(message: bytes, sock: socket.socket) -> None:
-    """Send a message using a connected socket. Function also
-    prepends 4 bytes which includes the size of the message.
+def socket_send_message(message: bytes, sock: socket.socket,
+                        codecs: Union[None, List[str]] = None) -> None:
+    """Send a message using a connected socket. The message is cut
+    into frames, the frame headers, message and buffers are sent
+    with scatter/gather calls so none of them are copied.
     Warning: does not handle any exceptions
 
-    :param message: bytes to be sent
+    :param message: bytes to be sent, a :class:`Message` also sends its buffers
     :type message: bytes
     :param sock: connected socket
     :type sock: socket.socket
+    :param codecs: compression codecs the peer supports, defaults to None (no compression)
+    :type codecs: Union[None, List[str]], optional
     """
-    message = struct.pack(">I", len(message)) + message
-    sock.sendall(message)
+    send_buffers([b for frame in frame_message(message, codecs) for b in frame], sock)
+
+
+def frame_message(message: bytes, codecs: Union[None, List[str]] = None,
+                  frame_size: int = FRAME_SIZE) -> List[List]:
+    """Compress the message if it is worth it and cut it into frames.
+    The frames are views of the message and its buffers, nothing is copied
+
+    :param message: bytes to be sent, a :class:`Message` also sends its buffers
+    :type message: bytes
+    :param codecs: compression codecs the peer supports, defaults to None (no compression)
+    :type codecs: Union[None, List[str]], optional
+    :param frame_size: maximum number of bytes of the message per frame, defaults to FRAME_SIZE
+    :type frame_size: int, optional
+    :return: list of frames, each a list of the frame header and the views of its body
+    :rtype: List[List]
+    """
+    buffers = [memoryview(b).cast("B") for b in getattr(message, "buffers", [])]
+    codec, payload = compress(message, codecs)
+    parts = [memoryview(payload).cast("B"), *buffers]
+    message_id = next(_message_ids) & 0xFFFFFFFF
+    total = sum(part.nbytes for part in parts)
+    if total > MAX_MESSAGE_SIZE:
+        raise FramingError(f"Message of {total} bytes is longer than {MAX_MESSAGE_SIZE} bytes")
+    _metrics.inc("messages_sent_total")
+    _metrics.inc("bytes_sent_total", total)
+
+    header = _MESSAGE.pack(len(payload), len(buffers), codec) + b"".join(
+        _BUFFER_LENGTH.pack(b.nbytes) for b in buffers)
+    flags = _FIRST | (_LAST if total == 0 else 0)
+    frames = [[_FRAME.pack(VERSION, flags, message_id, len(header)), header]]
+
+    body, size = [], 0
+    for part in parts:
+        while part.nbytes:
+            view = part[:frame_size - size]
+            part = part[view.nbytes:]
+            body.append(view)
+            size += view.nbytes
+            total -= view.nbytes
+            if size == frame_size or total == 0:
+                flags = _LAST if total == 0 else 0
+                frames.append([_FRAME.pack(VERSION, flags, message_id, size), *body])
+                body, size = [], 0
+    return frames
+
+
+def send_buffers(buffers: List, sock: socket.socket) -> None:
+    """Send every buffer in order without joining them together first
+
+    :param buffers: list of bytes-like objects
+    :type buffers: List
+    :param sock: connected socket
+    :type sock: socket.socket
+    """
+    views = [memoryview(b).cast("B") for b in buffers if len(b)]
+    if not hasattr(sock, "sendmsg"):
+        for view in views:
+            sock.sendall(view)
+        return
+    while views:
+        sent = sock.sendmsg(views[:_IOV_MAX])
+        while sent:
+            if sent >= views[0].nbytes:
+                sent -= views.pop(0).nbytes
+            else:
+                views[0] = views[0][sent:]
+                sent = 0
+
 
+class _PartialMessage:
+    """A message whose frames are still arriving.
+    Frame bodies are written straight into the preallocated payload and buffers
 
-def recv_msg(sock: socket.socket) -> Union[None, bytearray]:
+    :param header: body of the message's first frame
+    :type header: bytes
+    """
+
+    def __init__(self, header: bytes) -> None:
+        msglen, num_buffers, self.codec = _MESSAGE.unpack_from(header)
+        lengths = [length for (length,) in
+                   _BUFFER_LENGTH.iter_unpack(memoryview(header)[_MESSAGE.size:])]
+        if len(lengths) != num_buffers:
+            raise FramingError("Message header does not match its number of buffers")
+        if msglen + sum(lengths) > MAX_MESSAGE_SIZE:
+            raise FramingError(f"Message is longer than {MAX_MESSAGE_SIZE} bytes")
+        self.message = Message(msglen, buffers=[bytearray(length) for length in lengths])
+        self._parts = [memoryview(self.message), *map(memoryview, self.message.buffers)]
+
+    def views(self, n: int) -> List[memoryview]:
+        """Reserve the next n bytes of the message
+
+        :param n: length of the next frame's body
+        :type n: int
+        :raises FramingError: the frame is longer than what is left of the message
+        :return: views of the message to write the frame's body into
+        :rtype: List[memoryview]
+        """
+        views = []
+        while n:
+            if not self._parts:
+                raise FramingError("Frame is longer than its message")
+            part = self._parts[0]
+            view, part = part[:n], part[n:]
+            n -= view.nbytes
+            views.append(view)
+            if part.nbytes:
+                self._parts[0] = part
+            else:
+                self._parts.pop(0)
+        return views
+
+    def finish(self) -> Message:
+        """Get the complete message, decompressing it if necessary
+
+        :raises FramingError: the message is missing some of its data
+        :return: recieved message
+        :rtype: Message
+        """
+        if any(part.nbytes for part in self._parts):
+            raise FramingError("Message ended before all of its data was recieved")
+        if self.codec != NONE:
+            return Message(decompress(self.codec, self.message), buffers=self.message.buffers)
+        return self.message
+
+
+class Reassembler:
+    """Reassemble the messages recieved on a connection from their frames.
+    Frames of different messages may interleave, use one reassembler per connection
+    and keep it for as long as the connection is open"""
+
+    def __init__(self) -> None:
+        self._partial: Dict[int, _PartialMessage] = {}
+
+    def recv(self, sock: socket.socket) -> Union[None, Message]:
+        """Recieve frames until a message is complete
+
+        :param sock: connected socket
+        :type sock: socket.socket
+        :raises FramingError: a frame does not follow the framing protocol
+        :return: recieved message, or none if the connection is closed
+        :rtype: Union[None, Message]
+        """
+        while True:
+            raw_header = recvall(sock, _FRAME.size)
+            if raw_header is None:
+                return None
+            flags, message_id, length = self._parse(raw_header)
+            if flags & _FIRST:
+                body = recvall(sock, length)
+                if body is None:
+                    return None
+                views = self._first(message_id, body)
+            else:
+                views = self._views(message_id, length)
+            for view in views:
+                if not recv_into(sock, view):
+                    return None
+            if flags & _LAST:
+                return self._partial.pop(message_id).finish()
+
+    async def read(self, reader: asyncio.StreamReader) -> Union[None, Message]:
+        """Read frames from an asyncio stream until a message is complete
+
+        :param reader: stream of a connected socket
+        :type reader: asyncio.StreamReader
+        :raises FramingError: a frame does not follow the framing protocol
+        :return: recieved message, or none if the connection is closed
+        :rtype: Union[None, Message]
+        """
+        try:
+            while True:
+                flags, message_id, length = self._parse(await reader.readexactly(_FRAME.size))
+                if flags & _FIRST:
+                    views = self._first(message_id, await reader.readexactly(length))
+                else:
+                    views = self._views(message_id, length)
+                for view in views:
+                    view[:] = await reader.readexactly(view.nbytes)
+                if flags & _LAST:
+                    return self._partial.pop(message_id).finish()
+        except (asyncio.IncompleteReadError, OSError):
+            return None
+
+    def _parse(self, raw_header: bytes) -> Tuple[int, int, int]:
+        version, flags, message_id, length = _FRAME.unpack(raw_header)
+        if version != VERSION:
+            raise FramingError(f"Unsupported framing protocol version {version}")
+        if flags & _FIRST and length > _MAX_HEADER:
+            raise FramingError(f"Message header of {length} bytes is too long")
+        return flags, message_id, length
+
+    def _first(self, message_id: int, body: bytes) -> List[memoryview]:
+        self._partial[message_id] = _PartialMessage(body)
+        return []
+
+    def _views(self, message_id: int, length: int) -> List[memoryview]:
+        if message_id not in self._partial:
+            raise FramingError(f"Frame of unknown message {message_id}")
+        return self._partial[message_id].views(length)
+
+
+def recv_msg(sock: socket.socket, reassembler: Union[None, Reassembler] = None
+             ) -> Union[None, Message]:
     """Recieve a message from the socket
-    All messages should be prepended with the length,
-    function will keep fetching data until message length
+    Frames are recieved until the message is complete. The payload and
+    out-of-band buffers are recieved straight into their own preallocated
+    bytearrays. Compressed messages are decompressed
 
     :param sock: connected socket
     :type sock: socket.socket
+    :param reassembler: reassembler of the connection, required if other messages may
+        interleave with this one, defaults to None
+    :type reassembler: Union[None, Reassembler], optional
     :return: recieved data, or none in case of no data
-    :rtype: Union[None, bytearray]
+    :rtype: Union[None, Message]
     """
-    raw_msglen = recvall(sock, 4)
-    if not raw_msglen:
-        return None
-    msglen = struct.unpack('>I', raw_msglen)[0]
-    return recvall(sock, msglen)
+    message = (reassembler or Reassembler()).recv(sock)
+    if message is not None:
+        _count_received(message)
+    return message
+
+
+async def read_msg(reader: asyncio.StreamReader,
+                   reassembler: Union[None, Reassembler] = None) -> Union[None, Message]:
+    """Recieve a message from an asyncio stream, the counterpart of :func:`recv_msg`
+    for servers running on an event loop
+
+    :param reader: stream of a connected socket
+    :type reader: asyncio.StreamReader
+    :param reassembler: reassembler of the connection, required if other messages may
+        interleave with this one, defaults to None
+    :type reassembler: Union[None, Reassembler], optional
+    :return: recieved data, or none if the connection is closed
+    :rtype: Union[None, Message]
+    """
+    message = await (reassembler or Reassembler()).read(reader)
+    if message is not None:
+        _count_received(message)
+    return message
+
+
+def _count_received(message: Message) -> None:
+    """Count a received message and its bytes"""
+    _metrics.inc("messages_received_total")
+    _metrics.inc("bytes_received_total",
+                 len(message) + sum(len(b) for b in message.buffers))
 
 
 def recvall(sock: socket.socket, n: int) -> Union[None, bytearray]:
@@ -68,32 +345,89 @@ def recvall(sock: socket.socket, n: int) -> Union[None, bytearray]:
     :return: recieved data or none in the case of no data
     :rtype: Union[None, bytearray]
     """
-    data = bytearray()
-    while len(data) < n:
-        packet = sock.recv(n - len(data))
-        if not packet:
-            return None
-        data.extend(packet)
+    data = bytearray(n)
+    if not recv_into(sock, data):
+        return None
     return data
 
 
-def encode_dict(d: Dict) -> bytes:
-    """Ecode the dictionary using dill.
-    Dill is used to ensure that functions are encoded correctly
+def recv_into(sock: socket.socket, buffer: bytearray) -> bool:
+    """Fill a preallocated buffer with data from the socket
+
+    :param sock: connected socket
+    :type sock: socket.socket
+    :param buffer: buffer to fill
+    :type buffer: bytearray
+    :return: whether the buffer was filled before the connection closed
+    :rtype: bool
+    """
+    view = memoryview(buffer)
+    while view.nbytes:
+        n = sock.recv_into(view)
+        if not n:
+            return False
+        view = view[n:]
+    return True
+
+
+def encode_dict(d: Dict, threshold: int = OUT_OF_BAND_THRESHOLD,
+                serializer: str = DEFAULT_SERIALIZER) -> bytes:
+    """Ecode the dictionary using the chosen serializer.
+    The serializer falls back to the next one in its chain (ending with dill)
+    if it cannot encode the dictionary. The encoding starts with the tag of
+    the serializer that was used.
+    Contiguous buffers larger than the threshold (e.g. the data of a NumPy array)
+    are not copied into the pickle stream, they are kept aside to be sent out-of-band
     Warning: does not handle any exceptions
 
     :param d: dictionary to encode
     :type d: Dict
-    :return: dictionary in bytes form
+    :param threshold: minimum size of a buffer sent out-of-band, defaults to OUT_OF_BAND_THRESHOLD
+    :type threshold: int, optional
+    :param serializer: name of the serializer, defaults to DEFAULT_SERIALIZER
+    :type serializer: str, optional
+    :return: dictionary in bytes form, a :class:`Message` if there are out-of-band buffers
     :rtype: bytes
     """
-    return dill.dumps(d)
+    start = time.perf_counter()
+    buffers = []
+
+    def out_of_band(buffer: "pickle.PickleBuffer") -> bool:
+        try:
+            raw = buffer.raw()
+        except BufferError:  # not contiguous
+            return True
+        if raw.nbytes < threshold:
+            return True
+        buffers.append(raw)
+        return False
+
+    # out-of-band buffers need pickle protocol 5 (Python 3.8+)
+    callback = out_of_band if pickle.HIGHEST_PROTOCOL >= 5 else None
+    encoder = get_serializer(serializer)
+    while True:
+        buffers.clear()
+        file = io.BytesIO()
+        file.write(encoder.tag)
+        try:
+            encoder.dump(d, file, buffer_callback=callback)
+            break
+        except Exception:
+            if encoder.fallback is None:
+                raise
+            encoder = get_serializer(encoder.fallback)
+
+    data = file.getbuffer()
+    _metrics.observe("encode_seconds", time.perf_counter() - start)
+    if not buffers:
+        return data
+    return Message(data, buffers=buffers)
 
 
 def decode_message(b: bytes) -> Any:
-    """Decode arbitrary bytes using Dill.
+    """Decode arbitrary bytes using the serializer named by its first byte.
     Most common usecase is to decode a message.
-    Dill is used to ensure functions are decoded correctly
+    Out-of-band buffers of a :class:`Message` are used in place, without copying
     Warning: does not handle any exceptions
 
     :param b: bytes to decode
@@ -101,7 +435,117 @@ def decode_message(b: bytes) -> Any:
     :return: decoded object (usually a dict)
     :rtype: Any
     """
-    return dill.loads(b)
+    start = time.perf_counter()
+    view = memoryview(b)
+    decoded = serializer_for_tag(bytes(view[:1])).loads(view[1:], getattr(b, "buffers", None))
+    _metrics.observe("decode_seconds", time.perf_counter() - start)
+    return decoded
+
+
+def encode_broadcast(obj: Any) -> Tuple[bytes, str]:
+    """Encode a broadcast variable using dill and compute its content digest
+
+    :param obj: object to broadcast
+    :type obj: Any
+    :return: tuple of the encoded object and its digest
+    :rtype: Tuple[bytes, str]
+    """
+    encoded = dill.dumps(obj)
+    return encoded, hashlib.sha256(encoded).hexdigest()
+
+
+def encode_function(function: Union[bytes, Callable]) -> Tuple[bytes, str]:
+    """Encode a function using dill and compute its content digest.
+    Functions that have already been encoded are only digested
+
+    :param function: function or dill encoded function
+    :type function: Union[bytes, Callable]
+    :return: tuple of the encoded function and its digest
+    :rtype: Tuple[bytes, str]
+    """
+    if not isinstance(function, (bytes, bytearray)):
+        function = dill.dumps(function)
+    return bytes(function), hashlib.sha256(function).hexdigest()
+
+
+class LRUCache:
+    """Thread safe mapping that evicts the least recently used item once full
+
+    :param maxsize: maximum number of items to keep
+    :type maxsize: int
+    :param on_evict: called with the key and item of every evicted item, defaults to None
+    :type on_evict: Union[None, Callable], optional
+    """
+
+    def __init__(self, maxsize: int, on_evict: Union[None, Callable] = None) -> None:
+        self.maxsize = maxsize
+        self.on_evict = on_evict
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """Get an item and mark it as recently used
+
+        :param key: key of the item
+        :type key: Hashable
+        :param default: value to return if the key is missing, defaults to None
+        :type default: Any, optional
+        :return: the item or default
+        :rtype: Any
+        """
+        with self._lock:
+            if key not in self._items:
+                return default
+            self._items.move_to_end(key)
+            return self._items[key]
+
+    def put(self, key: Hashable, value: Any) -> None:
+        """Add an item, evicting the least recently used item if the cache is full
+
+        :param key: key of the item
+        :type key: Hashable
+        :param value: item to cache
+        :type value: Any
+        """
+        evicted = []
+        with self._lock:
+            self._items[key] = value
+            self._items.move_to_end(key)
+            while len(self._items) > self.maxsize:
+                evicted.append(self._items.popitem(last=False))
+        if self.on_evict is not None:
+            for item in evicted:
+                self.on_evict(*item)
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        """Remove an item
+
+        :param key: key of the item
+        :type key: Hashable
+        :param default: value to return if the key is missing, defaults to None
+        :type default: Any, optional
+        :return: the removed item or default
+        :rtype: Any
+        """
+        with self._lock:
+            return self._items.pop(key, default)
+
+    def keys(self) -> List[Hashable]:
+        """Keys of every item, least recently used first
+
+        :return: list of keys
+        :rtype: List[Hashable]
+        """
+        with self._lock:
+            return list(self._items)
+
+    def __contains__(self, key: Hashable) -> bool:
+        with self._lock:
+            return key in self._items
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._items)
 
 
 # https://stackoverflow.com/questions/952914/how-to-make-a-flat-list-out-of-a-list-of-lists
@@ -115,7 +559,31 @@ def flatten(lst: List) -> List:
     :return: flattened list
     :rtype: List
     """
-    return [item for sublist in lst for item in sublist]
+    return list(itertools.chain.from_iterable(lst))
+
+
+def split_weighted(array: List, weights: List[int]) -> List[List]:
+    """Split an array into one contiguous slice per weight,
+    each slice is sized in proportion to its weight
+
+    E.g. split_weighted([1, 2, 3, 4], [1, 3]) = [[1], [2, 3, 4]]
+
+    :param array: array to split
+    :type array: List
+    :param weights: relative size of each slice
+    :type weights: List[int]
+    :return: list of slices, some slices may be empty
+    :rtype: List[List]
+    """
+    total = sum(weights)
+    slices = []
+    start = cumulative = 0
+    for weight in weights:
+        cumulative += weight
+        end = len(array) * cumulative // total
+        slices.append(array[start: end])
+        start = end
+    return slices
 
 
 # https://stackoverflow.com/questions/489720/what-are-some-common-uses-for-python-decorators/490090#490090
@@ -1,27 +1,74 @@
 
+import functools
 import logging
+import os
+import shutil
 import socketserver
+import tempfile
+import threading
+import time
 import traceback
-from typing import Dict, List
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Tuple, Union
 
+import dill
+
+from overkill.servers import _logging, _metrics, _tracing
+from overkill.servers._channels import (Channel, ConnectionPool,
+                                       ThreadedChannelServer, recv_or_none)
+from overkill.servers._compression import available_codecs, negotiate
+from overkill.servers._serializers import DEFAULT_SERIALIZER, get_serializer
 from overkill.servers._server_data_classes import MasterInfo
-from overkill.servers._server_exceptions import AskTypeNotFoundError, WorkError
+from overkill.servers._server_exceptions import (AskTypeNotFoundError,
+                                                 BroadcastNotCachedError,
+                                                 FunctionNotCachedError,
+                                                 WorkError)
 from overkill.servers._server_messaging_standards import (ACCEPT, ACCEPT_WORK,
+                                                          BROADCAST,
+                                                          BROADCAST_MISS,
+                                                          CANCEL_WORK,
                                                           CLOSE_CONNECTION,
                                                           DELEGATE_WORK,
-                                                          REJECT, WORK_ERROR)
-from overkill.servers._utils import (decode_message, encode_dict, recv_msg,
-                                     send_message)
+                                                          FUNCTION_MISS,
+                                                          HEARTBEAT, REJECT,
+                                                          RELEASE, WORK_ERROR)
+from overkill.servers._utils import (LRUCache, Reassembler, decode_message,
+                                     encode_dict, flatten, split_weighted)
 
 __all__ = [
     "WorkerServer",
     "ThreadedWorkerServer",
     "reset_globals",
-    "close_connection_with_master"
+    "request_connection_with_master",
+    "close_connection_with_master",
+    "start_executor",
+    "shutdown_executor",
+    "start_heartbeat",
+    "stop_heartbeat",
+    "get_broadcast"
 ]
 
 _master = None  # master info
 _id = None  # worker id
+_pool = None  # persistent channel to the master
+_executor = None  # process pool to compute work with
+_processes = 1  # number of processes to compute work with
+_runner = None  # threads that run delegated chunks in the order they arrive
+_waiting = {}  # (work_id, order): number of copies of the chunk queued on this worker
+_cancelled = set()  # (work_id, order) of queued chunks the master has given to another worker
+_cancelled_lock = threading.Lock()  # guards _waiting and _cancelled
+_queued = 0  # chunks waiting for a runner thread
+_running = 0  # chunks being computed
+_load_lock = threading.Lock()  # guards _queued and _running
+_heartbeat_stop = None  # event that stops the thread sending heartbeats
+_functions = LRUCache(16)  # function_digest: (function, dill encoded function)
+_process_functions = None  # function_digest: function, only used inside pool processes
+_broadcasts = None  # key: decoded broadcast variable
+_broadcast_dir = None  # directory the pool processes load broadcast variables from
+_process_broadcasts = None  # key: decoded broadcast variable, only used inside pool processes
+_MISSING = object()  # marks a broadcast variable that is not cached
+_serializer = DEFAULT_SERIALIZER  # serializer used to encode messages
+_codecs = available_codecs()  # compression codecs advertised to the master
 
 
 class WorkerServer(socketserver.BaseRequestHandler):
@@ -34,84 +81,577 @@ class WorkerServer(socketserver.BaseRequestHandler):
         pass
 
     def handle(self):
-        """Handle incoming connections
-
-        :raises Exception: internal error in master server
-        :raises askTypeNotFoundError: occurs when there is no case for an ask type
+        """Handle incoming connections.
+        Connections from the master are persistent, every message is handled
+        until the master closes the connection. Replies are sent back over
+        the same connection.
         """
-        global _master, _id
-        data = recv_msg(self.request)
-        try:
-            ask = decode_message(data)
-            logging.info(ask)
+        _metrics.inc("connections_total")
+        channel = Channel(sock=self.request)
+        reassembler = Reassembler()
+        while True:
+            data = recv_or_none(self.request, reassembler)
+            if data is None:
+                return
+            _handle_message(data, channel)
 
-            if ask["type"] == REJECT:
-                raise Exception("Worker rejected")
 
-            elif ask["type"] == ACCEPT:
-                address = ask["master_address"]
-                _master = MasterInfo(address)
-                logging.info(f"Master information: {_master}")
-                _id = ask["id"]
+def _encode(d: Dict) -> bytes:
+    """Encode a message with the server's serializer
 
-            elif ask["type"] == DELEGATE_WORK:
-                results = _do_work(ask)
-                send_message(encode_dict(
-                    {"type": ACCEPT_WORK, "work_id": ask["work_id"], "data": results, "order": ask["order"]}), _master.address)
+    :param d: message to encode
+    :type d: Dict
+    :return: encoded message
+    :rtype: bytes
+    """
+    return encode_dict(d, serializer=_serializer)
 
-            else:
-                raise AskTypeNotFoundError(f"No such type {ask['type']}")
 
-        except AskTypeNotFoundError as e:
-            logging.info(f"No such ask exists: {e}")
-            return
-        except WorkError as e:
-            logging.info(f"Encountered work error: {e}")
-            err = {"type": WORK_ERROR, "work_id": ask["work_id"], "error": e}
-            send_message(encode_dict(err), _master.address)
-        except Exception as e:
-            logging.info(f"Could not handle request: {e}")
-            logging.info(traceback.format_exc())
+def _handle_message(data: bytes, channel: Channel) -> None:
+    """Handle a single message recieved from the master
+
+    :param data: encoded message
+    :type data: bytes
+    :param channel: channel the message arrived on, replies are sent over it
+    :type channel: Channel
+    :raises Exception: internal error in worker server
+    :raises askTypeNotFoundError: occurs when there is no case for an ask type
+    """
+    global _master, _id, _queued
+    start = time.perf_counter()
+    wall_start = time.time()
+    ask_type = "unknown"
+    try:
+        ask = decode_message(data)
+        ask_type = ask["type"]
+        _logging.log_message(ask)
+        if ask.get("trace_id") is not None:
+            _tracing.record(ask["trace_id"], "worker", f"decode {ask_type}", wall_start,
+                            time.time() - wall_start, bytes=len(data))
+
+        if ask["type"] == REJECT:
+            raise Exception("Worker rejected")
+
+        elif ask["type"] == ACCEPT:
+            address = ask["master_address"]
+            _master = MasterInfo(address)
+            logging.info(f"Master information: {_master}")
+            _id = ask["id"]
+            codecs = [c for c in negotiate(ask.get("codecs")) if c in _codecs]
+            channel.codecs = codecs
+            _pool.get(address).codecs = codecs
+            if ask.get("heartbeat_interval"):
+                start_heartbeat(ask["heartbeat_interval"])
+
+        elif ask["type"] == DELEGATE_WORK:
+            # keep reading from the master while the work is computed
+            with _load_lock:
+                _queued += 1
+            key = (ask["work_id"], ask["order"])
+            with _cancelled_lock:
+                _waiting[key] = _waiting.get(key, 0) + 1
+            _runner.submit(_handle_work, ask, channel, time.time())
+
+        elif ask["type"] == CANCEL_WORK:
+            key = (ask["work_id"], ask["order"])
+            with _cancelled_lock:
+                if key in _waiting:  # chunks that have started are left to finish
+                    _cancelled.add(key)
+
+        elif ask["type"] == BROADCAST:
+            _store_broadcast(ask["key"], ask["value"])
+
+        elif ask["type"] == RELEASE:
+            _release_broadcast(ask["key"])
+
+        else:
+            raise AskTypeNotFoundError(f"No such type {ask['type']}")
+
+    except AskTypeNotFoundError as e:
+        logging.info(f"No such ask exists: {e}")
+        return
+    except Exception as e:
+        logging.info(f"Could not handle request: {e}")
+        logging.info(traceback.format_exc())
+        return
+    finally:
+        ask_type = ask_type if isinstance(ask_type, str) else "unknown"
+        _metrics.inc("messages_handled_total", type=ask_type)
+        _metrics.observe("handle_seconds", time.perf_counter() - start, type=ask_type)
+
+
+def _handle_work(ask: Dict, channel: Channel, queued_at: Union[None, float] = None) -> None:
+    """Compute delegated work and send the results back to the master.
+    The spans of a traced chunk are sent back with its results
+
+    :param ask: dict of type, work_id, function_digest, array, order and optionally function,
+        trace_id
+    :type ask: Dict
+    :param channel: channel to the master
+    :type channel: Channel
+    :param queued_at: time.time() when the chunk was queued, defaults to None
+    :type queued_at: Union[None, float], optional
+    """
+    global _queued
+    with _load_lock:
+        _queued -= 1
+    key = (ask["work_id"], ask["order"])
+    with _cancelled_lock:
+        waiting = _waiting.pop(key, 1) - 1
+        if waiting:
+            _waiting[key] = waiting
+        if key in _cancelled:
+            _cancelled.remove(key)
             return
+    trace_id = ask.get("trace_id")
+    try:
+        start = time.perf_counter()
+        wall_start = time.time()
+        if trace_id is not None and queued_at is not None:
+            _tracing.record(trace_id, "worker", f"queued {ask['order']}", queued_at,
+                            wall_start - queued_at)
+        results = _do_work(ask)
+        elapsed = time.perf_counter() - start
+        reply = {"type": ACCEPT_WORK, "worker_id": _id, "work_id": ask["work_id"],
+                 "data": results, "order": ask["order"], "items": len(ask["array"]),
+                 "elapsed": elapsed}
+        if trace_id is not None:
+            _tracing.record(trace_id, "worker", f"compute {ask['order']}", wall_start, elapsed,
+                            items=len(ask["array"]))
+            reply["trace_id"] = trace_id
+            reply["trace"] = _tracing.collect(trace_id)
+        channel.send(_encode(reply))
+    except FunctionNotCachedError:
+        logging.info(f"Function {ask['function_digest']} is not cached, asking master to resend it")
+        miss = {"type": FUNCTION_MISS, "worker_id": _id, "work_id": ask["work_id"],
+                "order": ask["order"], "function_digest": ask["function_digest"]}
+        channel.send(_encode(miss))
+    except BroadcastNotCachedError as e:
+        logging.info(f"Broadcast variable {e} is not cached, asking master to resend it")
+        miss = {"type": BROADCAST_MISS, "worker_id": _id, "work_id": ask["work_id"],
+                "order": ask["order"], "key": e.args[0]}
+        channel.send(_encode(miss))
+    except WorkError as e:
+        logging.info(f"Encountered work error: {e}")
+        err = {"type": WORK_ERROR, "worker_id": _id, "work_id": ask["work_id"],
+               "order": ask["order"], "error": e}
+        channel.send(_encode(err))
+    except Exception as e:
+        logging.info(f"Could not send work to master: {e}")
+        logging.info(traceback.format_exc())
 
 
 def _do_work(ask: Dict) -> List:
-    """After recieving work from the master server, execute the function on the data
+    """After recieving work from the master server, execute the function on the data.
+    Chunks of a map-reduce are reduced to a single partial result
 
-    :param ask: dict of type, function, array
+    :param ask: dict of type, function_digest, array and optionally function,
+        reducer_digest, reducer
     :type ask: Dict
-    :return: list of computed data
+    :raises FunctionNotCachedError: the function was not sent and is not cached
+    :return: list of computed data, or of the partial result of a map-reduce
+        (empty if the chunk is)
     :rtype: List
     """
-    func = ask["function"]
+    global _running
     data = ask["array"]
+    start = time.perf_counter()
 
+    with _load_lock:
+        _running += 1
     try:
-        results = list(map(func, data))
+        func, function = _load_function(ask)
+        reducer = encoded_reducer = None
+        if "reducer_digest" in ask:
+            reducer, encoded_reducer = _load_function(ask, "reducer")
+        if _executor is None:
+            results = list(map(func, data))
+        else:
+            # pool processes reduce their own slice
+            results = _map_in_pool(ask["function_digest"], function, data,
+                                   ask.get("reducer_digest"), encoded_reducer)
+        if reducer is not None:
+            results = _reduce(reducer, results)
+        _metrics.inc("chunks_computed_total")
+        _metrics.inc("elements_computed_total", len(data))
+        _metrics.observe("compute_seconds", time.perf_counter() - start)
+    except (FunctionNotCachedError, BroadcastNotCachedError):
+        raise
     except Exception as e:
         raise WorkError(
             f"Could not compute: {e} \n {traceback.format_exc()}")
+    finally:
+        with _load_lock:
+            _running -= 1
 
     return results
 
 
-class ThreadedWorkerServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
+def _load_function(ask: Dict, name: str = "function") -> Tuple[Callable, bytes]:
+    """Get the function of a chunk from the cache, decoding and caching it
+    if the master has sent it along
+
+    :param ask: dict of function_digest and optionally function
+    :type ask: Dict
+    :param name: name of the function in the message, e.g. "reducer" for
+        reducer_digest and reducer, defaults to "function"
+    :type name: str, optional
+    :raises FunctionNotCachedError: the function was not sent and is not cached
+    :return: tuple of the function and its dill encoding
+    :rtype: Tuple[Callable, bytes]
+    """
+    digest = ask[f"{name}_digest"]
+    if name in ask:
+        entry = (dill.loads(ask[name]), ask[name])
+        _functions.put(digest, entry)
+        return entry
+    entry = _functions.get(digest)
+    if entry is None:
+        raise FunctionNotCachedError(digest)
+    return entry
+
+
+def _map_in_pool(digest: str, function: bytes, data: List,
+                 reducer_digest: Union[None, str] = None,
+                 reducer: Union[None, bytes] = None) -> List:
+    """Fan the data out across the worker's process pool, one slice per process
+
+    :param digest: digest of the function
+    :type digest: str
+    :param function: dill encoded function to apply to each element
+    :type function: bytes
+    :param data: array to compute
+    :type data: List
+    :param reducer_digest: digest of the reducer of a map-reduce, defaults to None
+    :type reducer_digest: Union[None, str], optional
+    :param reducer: dill encoded reducer of a map-reduce, defaults to None
+    :type reducer: Union[None, bytes], optional
+    :return: list of computed data in the original order, or of the partial
+        result of every slice of a map-reduce
+    :rtype: List
+    """
+    slices = split_weighted(data, [1] * _processes)
+    broadcasts = _broadcasts.keys()
+    futures = [_executor.submit(_compute, digest, function, s, broadcasts,
+                                reducer_digest, reducer)
+               for s in slices if len(s)]
+    return flatten([f.result() for f in futures])
+
+
+def _compute(digest: str, function: bytes, data: List, broadcasts: List[str] = (),
+             reducer_digest: Union[None, str] = None,
+             reducer: Union[None, bytes] = None) -> List:
+    """Compute a slice of work inside a pool process.
+    Each pool process keeps its own cache of decoded functions and broadcast variables,
+    broadcast variables the worker no longer has are dropped
+
+    :param digest: digest of the function
+    :type digest: str
+    :param function: dill encoded function
+    :type function: bytes
+    :param data: slice of the array
+    :type data: List
+    :param broadcasts: keys of the broadcast variables the worker has cached, defaults to ()
+    :type broadcasts: List[str], optional
+    :param reducer_digest: digest of the reducer of a map-reduce, defaults to None
+    :type reducer_digest: Union[None, str], optional
+    :param reducer: dill encoded reducer of a map-reduce, defaults to None
+    :type reducer: Union[None, bytes], optional
+    :return: list of computed data, or of the partial result of a map-reduce
+    :rtype: List
+    """
+    global _process_functions
+    if _process_broadcasts is not None:
+        for key in set(_process_broadcasts.keys()).difference(broadcasts):
+            _process_broadcasts.pop(key)
+    if _process_functions is None:
+        _process_functions = LRUCache(_functions.maxsize)
+    results = list(map(_process_function(digest, function), data))
+    if reducer is not None:
+        return _reduce(_process_function(reducer_digest, reducer), results)
+    return results
+
+
+def _process_function(digest: str, function: bytes) -> Callable:
+    """Get a function from the pool process's cache, decoding it if it is not cached
+
+    :param digest: digest of the function
+    :type digest: str
+    :param function: dill encoded function
+    :type function: bytes
+    :return: the function
+    :rtype: Callable
+    """
+    func = _process_functions.get(digest)
+    if func is None:
+        func = dill.loads(function)
+        _process_functions.put(digest, func)
+    return func
+
+
+def _reduce(reducer: Callable, results: List) -> List:
+    """Reduce the results of a chunk of a map-reduce, in order
+
+    :param reducer: function of two arguments
+    :type reducer: Callable
+    :param results: results to reduce
+    :type results: List
+    :return: list of the partial result, empty if there are no results
+    :rtype: List
+    """
+    return [functools.reduce(reducer, results)] if results else []
+
+
+def get_broadcast(key: str) -> Any:
+    """Get a broadcast variable, used by :class:`overkill.overkill.Broadcast` on the worker.
+    Pool processes load broadcast variables from the worker's spill directory
+
+    :param key: digest of the broadcast variable
+    :type key: str
+    :raises BroadcastNotCachedError: the variable is not cached by the worker
+    :return: the broadcast variable
+    :rtype: Any
+    """
+    if _broadcasts is not None:
+        value = _broadcasts.get(key, _MISSING)
+        if value is not _MISSING:
+            return value
+    if _process_broadcasts is not None:
+        value = _process_broadcasts.get(key, _MISSING)
+        if value is not _MISSING:
+            return value
+        try:
+            with open(_broadcast_path(key), "rb") as f:
+                value = dill.load(f)
+        except (OSError, ValueError):
+            raise BroadcastNotCachedError(key)
+        _process_broadcasts.put(key, value)
+        return value
+    raise BroadcastNotCachedError(key)
+
+
+def _store_broadcast(key: str, value: bytes) -> None:
+    """Cache a broadcast variable sent by the master, spilling it to disk for the pool processes
+
+    :param key: digest of the broadcast variable
+    :type key: str
+    :param value: dill encoded broadcast variable
+    :type value: bytes
+    """
+    if key in _broadcasts:
+        _broadcasts.get(key)  # mark as recently used
+        return
+    if _broadcast_dir is not None:
+        path = _broadcast_path(key)
+        with open(path + ".tmp", "wb") as f:
+            f.write(value)
+        os.replace(path + ".tmp", path)
+    _broadcasts.put(key, dill.loads(value))
+
+
+def _release_broadcast(key: str, value: Any = None) -> None:
+    """Drop a broadcast variable, also called when one is evicted from the cache
+
+    :param key: digest of the broadcast variable
+    :type key: str
+    :param value: the evicted variable, unused, defaults to None
+    :type value: Any, optional
+    """
+    _broadcasts.pop(key)
+    if _broadcast_dir is not None:
+        try:
+            os.remove(_broadcast_path(key))
+        except (OSError, ValueError):
+            pass
+
+
+def _broadcast_path(key: str) -> str:
+    """Path of a broadcast variable in the spill directory
+
+    :param key: hexadecimal digest of the broadcast variable
+    :type key: str
+    :raises ValueError: the key is not a hexadecimal digest
+    :return: path of the file
+    :rtype: str
+    """
+    int(key, 16)  # never let a key name a file outside the directory
+    return os.path.join(_broadcast_dir, key)
+
+
+def _init_process(broadcast_dir: str, broadcast_cache_size: int) -> None:
+    """Set up a pool process to load broadcast variables from the worker's spill directory
+
+    :param broadcast_dir: the spill directory
+    :type broadcast_dir: str
+    :param broadcast_cache_size: number of broadcast variables to keep decoded
+    :type broadcast_cache_size: int
+    """
+    global _broadcast_dir, _broadcasts, _process_broadcasts
+    _broadcast_dir = broadcast_dir
+    _broadcasts = None  # only the worker's own process recieves broadcast variables
+    _process_broadcasts = LRUCache(broadcast_cache_size)
+
+
+class ThreadedWorkerServer(ThreadedChannelServer):
     pass
 
 
-def reset_globals() -> None:
+def reset_globals(serializer: str = DEFAULT_SERIALIZER, compression: bool = True) -> None:
     """Reset global variables:
-    _master, _id
+    _master, _id, _pool, _executor, _processes, _serializer, _codecs
+
+    :param serializer: serializer used to encode messages, defaults to DEFAULT_SERIALIZER
+    :type serializer: str, optional
+    :param compression: whether to compress large messages, defaults to True
+    :type compression: bool, optional
     """
-    global _master, _id
+    global _master, _id, _pool, _serializer, _codecs
+    stop_heartbeat()
+    _serializer = get_serializer(serializer).name
+    _codecs = available_codecs() if compression else []
     _master = None
     _id = None
+    if _pool is not None:
+        _pool.close()
+    _pool = ConnectionPool()
+    shutdown_executor()
+
+
+def start_executor(processes: int, function_cache_size: int = 16,
+                   broadcast_cache_size: int = 8) -> None:
+    """Start the threads that run delegated chunks, one per process,
+    and the process pool used to compute them.
+    A single process computes work on the server's own thread instead.
+
+    :param processes: number of processes to compute work with
+    :type processes: int
+    :param function_cache_size: number of decoded functions to cache, defaults to 16
+    :type function_cache_size: int, optional
+    :param broadcast_cache_size: number of broadcast variables to cache, defaults to 8
+    :type broadcast_cache_size: int, optional
+    """
+    global _executor, _processes, _runner, _functions, _broadcasts, _broadcast_dir
+    shutdown_executor()
+    _functions = LRUCache(function_cache_size)
+    _broadcasts = LRUCache(broadcast_cache_size, on_evict=_release_broadcast)
+    _processes = processes
+    _runner = ThreadPoolExecutor(max_workers=processes)
+    if processes > 1:
+        _broadcast_dir = tempfile.mkdtemp(prefix="overkill-broadcasts-")
+        _executor = ProcessPoolExecutor(max_workers=processes, initializer=_init_process,
+                                        initargs=(_broadcast_dir, broadcast_cache_size))
+
+
+def shutdown_executor() -> None:
+    """Shutdown the process pool and runner threads if they have been started"""
+    global _executor, _processes, _runner, _queued, _running, _broadcast_dir
+    if _executor is not None:
+        _executor.shutdown(wait=False)
+    if _broadcast_dir is not None:
+        shutil.rmtree(_broadcast_dir, ignore_errors=True)
+    _broadcast_dir = None
+    if _runner is not None:
+        _runner.shutdown(wait=False)
+    _executor = None
+    _runner = None
+    _processes = 1
+    with _cancelled_lock:
+        _waiting.clear()
+        _cancelled.clear()
+    with _load_lock:
+        _queued = 0
+        _running = 0
+
+
+def start_heartbeat(interval: float) -> None:
+    """Start a thread that sends the worker's load to the master every interval.
+    The master evicts workers that stop sending heartbeats
+
+    :param interval: seconds between heartbeats
+    :type interval: float
+    """
+    global _heartbeat_stop
+    stop_heartbeat()
+    _heartbeat_stop = threading.Event()
+    t = threading.Thread(target=_send_heartbeats, args=(_heartbeat_stop, interval), daemon=True)
+    t.start()
+
+
+def stop_heartbeat() -> None:
+    """Stop the thread started by :func:`start_heartbeat`"""
+    if _heartbeat_stop is not None:
+        _heartbeat_stop.set()
+
+
+def _send_heartbeats(stop: threading.Event, interval: float) -> None:
+    """Send heartbeats until stopped
+
+    :param stop: event that stops the heartbeats
+    :type stop: threading.Event
+    :param interval: seconds between heartbeats
+    :type interval: float
+    """
+    while not stop.wait(interval):
+        try:
+            _pool.send(_encode(_heartbeat()), _master.address)
+        except Exception as e:
+            logging.info(f"Could not send heartbeat to master: {e}")
+
+
+def _heartbeat() -> Dict:
+    """Build a heartbeat message
+
+    :return: dict of type, worker_id, queued, running, load, free_memory and metrics
+        (a snapshot of the worker's metrics)
+    :rtype: Dict
+    """
+    with _load_lock:
+        queued, running = _queued, _running
+    load, free_memory = _system_load()
+    _metrics.gauge("queued_chunks", queued)
+    _metrics.gauge("running_chunks", running)
+    return {"type": HEARTBEAT, "worker_id": _id, "queued": queued, "running": running,
+            "load": load, "free_memory": free_memory, "metrics": _metrics.snapshot()}
+
+
+def _system_load() -> Tuple[Union[None, float], Union[None, int]]:
+    """Load of the machine the worker runs on
+
+    :return: one minute cpu load average per cpu and bytes of available memory,
+        either is None when the platform does not report it
+    :rtype: Tuple[Union[None, float], Union[None, int]]
+    """
+    try:
+        load = os.getloadavg()[0] / (os.cpu_count() or 1)
+    except (AttributeError, OSError):  # not available on Windows
+        load = None
+    try:
+        free_memory = os.sysconf("SC_AVPHYS_PAGES") * os.sysconf("SC_PAGE_SIZE")
+    except (AttributeError, ValueError, OSError):
+        free_memory = None
+    return load, free_memory
+
+
+def request_connection_with_master(message: Dict, address: Tuple[str, int]) -> None:
+    """Send a connection request to the master over a persistent channel.
+    The compression codecs the worker supports are advertised along with it.
+    Warning: does not handle any exceptions
+
+    :param message: dictionary of type, name, address
+    :type message: Dict
+    :param address: tuple of ip, port of the master
+    :type address: Tuple[str, int]
+    """
+    _pool.send(_encode({**message, "codecs": _codecs}), address)
 
 
 def close_connection_with_master() -> None:
     """Close connection with master"""
+    stop_heartbeat()
     try:
-        msg = encode_dict({"type": CLOSE_CONNECTION, "id": _id})
-        send_message(msg, _master.address)
+        msg = _encode({"type": CLOSE_CONNECTION, "id": _id})
+        _pool.send(msg, _master.address)
     except Exception as e:
         logging.info(f"Could not close connection with master, reason: {e}")
+    finally:
+        _pool.close()
@@ -2,14 +2,25 @@
 
 import logging
 import threading
-from typing import Tuple
+from typing import Dict, List, Tuple, Union
 
+from overkill.servers import _logging
+from overkill.servers._memo import ResultCache
+from overkill.servers._metrics import MetricsServer, render_prometheus
+from overkill.servers._scheduler import Scheduler
+from overkill.servers._serializers import DEFAULT_SERIALIZER
 from overkill.servers._server_exceptions import ServerAlreadyStartedError
 
-from ._master import MasterServer, ThreadedMasterServer, reset_globals
+from ._async_master import AsyncMasterServer
+from ._master import (MasterServer, ThreadedMasterServer, close_channels,
+                      job_status, metrics, reset_globals, start_monitor,
+                      stop_monitor, worker_status)
 
 
-__all__ = ["Master"]
+__all__ = ["Master", "THREADING", "ASYNCIO"]
+
+THREADING = "threading"  # a thread per connection
+ASYNCIO = "asyncio"  # every connection on a single event loop
 
 
 class Master:
@@ -50,42 +61,217 @@ class Master:
 
     """
 
-    def __init__(self) -> None:
-        logging.basicConfig(filename="master.log",
-                            filemode="w",
-                            format="%(levelname)s %(asctime)s - %(message)s",
-                            level=logging.INFO)
+    def __init__(self, serializer: str = DEFAULT_SERIALIZER, compression: bool = True,
+                 memoize: bool = False, memo_size: int = 100000,
+                 memo_path: Union[None, str] = None, speculation: bool = True,
+                 speculate_after: float = 0.75, straggler_factor: float = 2.0,
+                 heartbeat_interval: Union[None, float] = 0.5,
+                 heartbeat_timeout: float = 3.0,
+                 tenant_weights: Union[None, Dict[str, float]] = None,
+                 small_job_size: int = 1000,
+                 metrics_port: Union[None, int] = None, log_level: int = logging.INFO,
+                 log_sample_rate: float = 1.0) -> None:
+        """Class acts as a high-level api to start and stop a master server
+
+        :param serializer: serializer used to encode messages, one of "pickle", "dill"
+            or "msgpack" (if installed), defaults to "pickle".
+            Functions are always encoded with dill
+        :type serializer: str, optional
+        :param compression: whether to compress large messages with a codec the peer
+            supports, defaults to True
+        :type compression: bool, optional
+        :param memoize: whether to cache the result of every element keyed by the function
+            and the element, cached elements are not sent to the workers again, defaults to False
+        :type memoize: bool, optional
+        :param memo_size: maximum number of results cached in memory, defaults to 100000
+        :type memo_size: int, optional
+        :param memo_path: path of an sqlite database to also cache results in, it is kept
+            across runs of the master, defaults to None (memory only)
+        :type memo_path: Union[None, str], optional
+        :param speculation: whether to run straggling chunks again on idle workers,
+            the first copy to finish wins, defaults to True
+        :type speculation: bool, optional
+        :param speculate_after: fraction of a job's chunks that must be done before
+            its stragglers are run again, defaults to 0.75
+        :type speculate_after: float, optional
+        :param straggler_factor: a chunk is straggling once it has been running for this many
+            times the job's median chunk time, defaults to 2.0
+        :type straggler_factor: float, optional
+        :param heartbeat_interval: seconds between heartbeats of a worker, defaults to 0.5.
+            None disables heartbeats and eviction
+        :type heartbeat_interval: Union[None, float], optional
+        :param heartbeat_timeout: seconds without a heartbeat after which a worker is evicted
+            and its chunks are given to the remaining workers, defaults to 3.0. Workers that
+            miss heartbeats get no more work and evicted workers rejoin with their next heartbeat
+        :type heartbeat_timeout: float, optional
+        :param tenant_weights: dict of tenant: share of the cluster relative to other tenants,
+            tenants that are not listed have a weight of 1, defaults to None. Users set their
+            tenant and priority on :class:`overkill.overkill.ClusterCompute`
+        :type tenant_weights: Union[None, Dict[str, float]], optional
+        :param small_job_size: jobs of at most this many elements are served before any
+            other job, defaults to 1000. 0 disables the fast lane
+        :type small_job_size: int, optional
+        :param metrics_port: port to serve metrics in the Prometheus text format at
+            ``http://localhost:<metrics_port>/metrics``, 0 lets the kernel pick it,
+            defaults to None (not served)
+        :type metrics_port: Union[None, int], optional
+        :param log_level: level of the log, received messages are logged at logging.INFO
+            as a summary of their type, ids and payload sizes, defaults to logging.INFO
+        :type log_level: int, optional
+        :param log_sample_rate: fraction of received messages that are logged,
+            defaults to 1.0
+        :type log_sample_rate: float, optional
+        """
+        _logging.configure("master.log", log_level, log_sample_rate)
+        self.serializer = serializer
+        self.compression = compression
+        self.memoize = memoize
+        self.memo_size = memo_size
+        self.memo_path = memo_path
+        self._memo = ResultCache(memo_size, memo_path) if memoize else None
+        self.speculation = speculation
+        self.speculate_after = speculate_after
+        self.straggler_factor = straggler_factor
+        self.heartbeat_interval = heartbeat_interval
+        self.heartbeat_timeout = heartbeat_timeout
+        self.tenant_weights = tenant_weights
+        self.small_job_size = small_job_size
+        self.metrics_port = metrics_port
+        self._metrics_server = None
+        self.log_level = log_level
+        self.log_sample_rate = log_sample_rate
+        self._scheduler = Scheduler(speculation=speculation, speculate_after=speculate_after,
+                                    straggler_factor=straggler_factor, weights=tenant_weights,
+                                    small_job=small_job_size)
         self._server = None
         self.ip = None
         self.port = None
-        reset_globals()
+        reset_globals(serializer, compression, self._memo, self._scheduler,
+                      heartbeat_interval, heartbeat_timeout)
 
-    def start(self, ip: str = "localhost", port: int = 0) -> None:
+    def start(self, ip: str = "localhost", port: int = 0, backend: str = THREADING) -> None:
         """Start the server on the given ip and port
 
         :param ip: server ip address to bind to, defaults to "localhost"
         :type ip: str, optional
         :param port: server port to bind to, defaults to 0
         :type port: int, optional
+        :param backend: "threading" to handle every connection in its own thread or
+            "asyncio" to handle every connection on a single event loop, which scales
+            to many more concurrent users and workers, defaults to "threading"
+        :type backend: str, optional
+        :raises ValueError: no such backend
         """
-        self.__init__()
+        if backend not in (THREADING, ASYNCIO):
+            raise ValueError(f"No such backend {backend}, use one of {[THREADING, ASYNCIO]}")
+        if self._memo is not None:
+            self._memo.close()  # a new cache is built along with the rest of the state
+        self.__init__(self.serializer, self.compression, self.memoize, self.memo_size,
+                      self.memo_path, self.speculation, self.speculate_after,
+                      self.straggler_factor, self.heartbeat_interval, self.heartbeat_timeout,
+                      self.tenant_weights, self.small_job_size, self.metrics_port,
+                      self.log_level, self.log_sample_rate)
         address = (ip, port)
 
         if self._server:
             raise ServerAlreadyStartedError()
 
-        self._server = ThreadedMasterServer(address, MasterServer)
-        logging.info(f"Master server running on {self.get_address()}")
-        t = threading.Thread(target=self._server.serve_forever, daemon=True)
-        t.start()
+        if backend == ASYNCIO:
+            self._server = AsyncMasterServer(address)
+            logging.info(f"Master server running on {self.get_address()} with asyncio")
+        else:
+            self._server = ThreadedMasterServer(address, MasterServer)
+            logging.info(f"Master server running on {self.get_address()}")
+            t = threading.Thread(target=self._server.serve_forever, daemon=True)
+            t.start()
+        start_monitor()
+        if self.metrics_port is not None:
+            self._metrics_server = MetricsServer(self._render_metrics,
+                                                 ("localhost", self.metrics_port))
 
     def stop(self) -> None:
         """Stop the server"""
         if self._server is None:
             logging.error("No server has been started")
             return
-        self._server.socket.close()
+        stop_monitor()
+        if self._metrics_server is not None:
+            self._metrics_server.stop()
+        self._server.server_close()
         self._server.shutdown()
+        self._server.close_connections()
+        close_channels()
+        if self._memo is not None:
+            self._memo.close()
+        _logging.flush()
+
+    def get_memo_stats(self) -> Union[None, Dict[str, int]]:
+        """Get the counters of the memoization cache
+
+        :return: dictionary of hits, disk_hits, misses and size (results cached in memory)
+            or None if memoization is off
+        :rtype: Union[None, Dict[str, int]]
+        """
+        if self._memo is None:
+            return None
+        return self._memo.stats()
+
+    def get_speculation_stats(self) -> Dict[str, int]:
+        """Get the counters of speculative execution
+
+        :return: dictionary of speculated (copies run), won (copies that finished first)
+            and lost (copies beaten by the original)
+        :rtype: Dict[str, int]
+        """
+        return dict(self._scheduler.stats)
+
+    def get_workers(self) -> List[Dict]:
+        """Get the load of every worker as last reported in its heartbeats,
+        chunks go to the least loaded workers first
+
+        :return: list of dicts of id, name, address, cores, can_accept_work, in_flight
+            (chunks the master has given it), queued, running, load (cpu load average per cpu),
+            free_memory (bytes) and last_seen (seconds since its last heartbeat)
+        :rtype: List[Dict]
+        """
+        return worker_status()
+
+    def get_status(self) -> Dict[str, List[Dict]]:
+        """Get the state of the job queue. Jobs of concurrent users share the cluster
+        chunk by chunk: small jobs first, then by priority and by tenant weight
+
+        :return: dict of queued, running and completed (the most recently completed jobs),
+            each a list of dicts of work_id, tenant, priority, num_chunks, completed,
+            progress, elapsed (seconds since the job was submitted) and error
+        :rtype: Dict[str, List[Dict]]
+        """
+        return job_status()
+
+    def get_metrics(self) -> Dict:
+        """Get the counters, gauges and latency histograms of the master and every worker
+
+        :return: dict of counters and gauges (name: {labels: value}), histograms
+            (name: {labels: {buckets, sum, count}}, see
+            :data:`overkill.servers._metrics.BUCKETS`) and workers (worker name: the metrics
+            of the worker as last reported in its heartbeats)
+        :rtype: Dict
+        """
+        return metrics()
+
+    def get_metrics_address(self) -> Union[None, Tuple[str, int]]:
+        """Get the address metrics are served on in the Prometheus text format
+
+        :return: tuple of ip, port or None if metrics are not served
+        :rtype: Union[None, Tuple[str, int]]
+        """
+        if self._metrics_server is None:
+            return None
+        return self._metrics_server.server_address
+
+    def _render_metrics(self) -> str:
+        """Metrics of the master and every worker in the Prometheus text format"""
+        snapshot = metrics()
+        return render_prometheus(snapshot, extra=snapshot.pop("workers"))
 
     def get_address(self) -> Tuple[str, int]:
         """Get the address of the master server
@@ -4,13 +4,16 @@ import logging
 import threading
 from typing import Tuple
 
+from overkill.servers import _logging
+from overkill.servers._serializers import DEFAULT_SERIALIZER
 from overkill.servers._server_exceptions import (ServerAlreadyStartedError,
                                                  ServerNotStartedError)
 from overkill.servers._server_messaging_standards import NEW_CONNECTION
-from overkill.servers._utils import encode_dict, send_message
 
 from ._worker import (ThreadedWorkerServer, WorkerServer,
-                      close_connection_with_master, reset_globals)
+                      close_connection_with_master,
+                      request_connection_with_master, reset_globals,
+                      shutdown_executor, start_executor)
 
 
 class Worker:
@@ -22,7 +25,7 @@ class Worker:
     :Example:
 
     >>> from overkill.servers.worker import Worker
-    >>> w = Worker('test')
+    >>> w = Worker('test', processes=4)
     >>> w.start()
     >>> w.connect_to_master('127.0.0.1', 64406) # ip and port from get_address() method of master
     >>> w.stop()
@@ -44,19 +47,51 @@ class Worker:
         session, do so at your own risk.
     
     """
-    def __init__(self, name: str) -> None:
+    def __init__(self, name: str, processes: int = 1, function_cache_size: int = 16,
+                 serializer: str = DEFAULT_SERIALIZER, compression: bool = True,
+                 broadcast_cache_size: int = 8, log_level: int = logging.INFO,
+                 log_sample_rate: float = 1.0) -> None:
         """Class acts as a high-level api to start and stop a worker server
 
         :param name: name of the worker server
         :type name: str
+        :param processes: number of local processes every chunk is fanned out across,
+            the master gives the worker a proportionally larger share, defaults to 1
+        :type processes: int, optional
+        :param function_cache_size: number of functions to keep cached by the digest of their
+            dill encoding, so the master only sends a function the first time it is used.
+            The least recently used function is evicted once the cache is full, defaults to 16
+        :type function_cache_size: int, optional
+        :param serializer: serializer used to encode messages, one of "pickle", "dill"
+            or "msgpack" (if installed), defaults to "pickle".
+            Functions are always encoded with dill
+        :type serializer: str, optional
+        :param compression: whether to compress large messages with a codec the master
+            supports, defaults to True
+        :type compression: bool, optional
+        :param broadcast_cache_size: number of broadcast variables (see
+            :meth:`overkill.overkill.ClusterCompute.broadcast`) to keep cached until they are
+            released, the least recently used variable is evicted once the cache is full,
+            defaults to 8
+        :type broadcast_cache_size: int, optional
+        :param log_level: level of the log, received messages are logged at logging.INFO
+            as a summary of their type, ids and payload sizes, defaults to logging.INFO
+        :type log_level: int, optional
+        :param log_sample_rate: fraction of received messages that are logged,
+            defaults to 1.0
+        :type log_sample_rate: float, optional
         """
-        logging.basicConfig(filename="worker.log",
-                            filemode="w",
-                            format="%(levelname)s %(asctime)s - %(message)s",
-                            level=logging.INFO)
+        _logging.configure("worker.log", log_level, log_sample_rate)
         self.name = name
+        self.processes = max(1, processes)
+        self.function_cache_size = max(1, function_cache_size)
+        self.serializer = serializer
+        self.compression = compression
+        self.broadcast_cache_size = max(1, broadcast_cache_size)
+        self.log_level = log_level
+        self.log_sample_rate = log_sample_rate
         self._server = None
-        reset_globals()
+        reset_globals(serializer, compression)
 
     def start(self, ip: str = "localhost", port: int = 0) -> None:
         """Start the server on the given ip and port
@@ -66,13 +101,16 @@ class Worker:
         :param port: server port to bind to, defaults to 0
         :type port: int, optional
         """
-        self.__init__(self.name)
+        self.__init__(self.name, self.processes, self.function_cache_size,
+                      self.serializer, self.compression, self.broadcast_cache_size,
+                      self.log_level, self.log_sample_rate)
         address = (ip, port)
 
         if self._server:
             raise ServerAlreadyStartedError()
 
         self._server = ThreadedWorkerServer(address, WorkerServer)
+        start_executor(self.processes, self.function_cache_size, self.broadcast_cache_size)
         t = threading.Thread(target=self._server.serve_forever, daemon=True)
         t.start()
         logging.info(f"Worker server running on {self.get_address()}")
@@ -85,7 +123,10 @@ class Worker:
             close_connection_with_master()
             self._server.socket.close()
             self._server.shutdown()
+            self._server.close_connections()
+            shutdown_executor()
             logging.info("Worker shutdown")
+            _logging.flush()
 
     def get_address(self) -> Tuple[str, int]:
         """Get the address of the worker server
@@ -107,9 +148,11 @@ class Worker:
         if self._server is None:
             raise ServerNotStartedError("No server has been started")
         connection_message = {"type": NEW_CONNECTION,
-                              "name": self.name, "address": self.get_address()}
+                              "name": self.name, "address": self.get_address(),
+                              "cores": self.processes,
+                              "function_cache_size": self.function_cache_size}
         try:
-            send_message(encode_dict(connection_message), (ip, port))
+            request_connection_with_master(connection_message, (ip, port))
         except ConnectionRefusedError:
             raise ConnectionRefusedError(
                 "Please check if the master address is correct")
@@ -0,0 +1,147 @@
+import asyncio
+import socket
+import threading
+import time
+
+import pytest
+
+from overkill.servers._channels import AsyncChannel, Channel, ConnectionPool
+from overkill.servers._utils import (decode_message, encode_dict, recv_msg,
+                                     socket_send_message)
+
+
+def _echo_server(connections: list):
+    """Start a server that echoes every message back over the same connection
+
+    :return: listening socket
+    :rtype: socket.socket
+    """
+    s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    s.bind(("127.0.0.1", 0))
+    _serve(s, connections)
+    return s
+
+
+def _serve(s: socket.socket, connections: list):
+    """Listen on a bound socket and echo every message back over the same connection"""
+    s.listen()
+
+    def serve():
+        while True:
+            try:
+                conn, _ = s.accept()
+            except OSError:
+                return
+            connections.append(conn)
+            threading.Thread(target=echo, args=(conn,), daemon=True).start()
+
+    def echo(conn):
+        while True:
+            try:
+                data = recv_msg(conn)
+            except OSError:
+                return
+            if data is None:
+                return
+            socket_send_message(bytes(data), conn)
+
+    threading.Thread(target=serve, daemon=True).start()
+
+
+def test_channel_reuses_connection():
+    """Many messages in both directions should share a single connection"""
+    connections = []
+    server = _echo_server(connections)
+    recieved = []
+    done = threading.Event()
+
+    def on_message(data, channel):
+        recieved.append(decode_message(data))
+        if len(recieved) == 10:
+            done.set()
+
+    pool = ConnectionPool(on_message=on_message)
+    for i in range(10):
+        pool.send(encode_dict({"i": i}), server.getsockname())
+
+    assert done.wait(5)
+    assert [r["i"] for r in recieved] == list(range(10))
+    assert len(connections) == 1
+    pool.close()
+    server.close()
+
+
+def test_channel_reconnects():
+    """A channel should reconnect after its connection has been closed by the peer"""
+    connections = []
+    server = _echo_server(connections)
+    recieved = []
+    channel = Channel(server.getsockname(),
+                      on_message=lambda data, _: recieved.append(decode_message(data)))
+    channel.send(encode_dict({"i": 0}))
+    _wait_for(lambda: len(recieved) == 1)
+
+    # drop the connection from the server side
+    connections[0].shutdown(socket.SHUT_RDWR)
+    connections[0].close()
+    _wait_for(lambda: channel._sock is None)
+
+    channel.send(encode_dict({"i": 1}))
+    _wait_for(lambda: len(recieved) == 2)
+
+    assert len(connections) == 2
+    assert [r["i"] for r in recieved] == [0, 1]
+    channel.close()
+    server.close()
+
+
+def test_channel_connect_timeout(monkeypatch):
+    """Connecting should give up after the channel's timeout"""
+    timeouts = []
+
+    def create_connection(address, timeout=None):
+        timeouts.append(timeout)
+        raise socket.timeout("timed out")
+
+    monkeypatch.setattr(socket, "create_connection", create_connection)
+    channel = Channel(("127.0.0.1", 9), connect_timeout=0.5)
+    with pytest.raises(OSError):
+        channel.send(encode_dict({"i": 0}))
+    assert timeouts == [0.5, 0.5]
+
+
+def test_async_channel_retries_connect():
+    """An asyncio channel should keep its messages while it retries connecting"""
+    connections = []
+    server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    server.bind(("127.0.0.1", 0))  # connections are refused until it listens
+    recieved = []
+    loop = asyncio.new_event_loop()
+
+    async def send_before_listening():
+        channel = AsyncChannel(loop, server.getsockname(),
+                               on_message=lambda data, _: recieved.append(decode_message(data)))
+        channel.send(encode_dict({"i": 0}))
+        channel.send(encode_dict({"i": 1}))
+        await asyncio.sleep(0.2)
+        _serve(server, connections)
+        deadline = time.time() + 5
+        while len(recieved) < 2:
+            assert time.time() < deadline
+            await asyncio.sleep(0.01)
+        channel.close()
+
+    try:
+        loop.run_until_complete(send_before_listening())
+    finally:
+        loop.close()
+    assert [r["i"] for r in recieved] == [0, 1]
+    assert len(connections) == 1
+    server.close()
+
+
+def _wait_for(condition, timeout: float = 5):
+    deadline = time.time() + timeout
+    while not condition():
+        assert time.time() < deadline
+        time.sleep(0.01)
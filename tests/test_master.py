@@ -1,14 +1,22 @@
 import random
 import socket
-from threading import Thread
+import time
+import urllib.request
+from threading import Event, Thread
 
+from overkill.servers._server_data_classes import WorkOrder
+from overkill.servers._server_exceptions import WorkError
 from overkill.servers._server_messaging_standards import (ACCEPT,
                                                           DELEGATE_WORK,
                                                           DISTRIBUTE,
-                                                          FINISHED_TASK)
-from overkill.servers._utils import (decode_message, encode_dict, recv_msg,
-                                     socket_send_message)
+                                                          FINISHED_TASK,
+                                                          HEARTBEAT)
+from overkill.servers._utils import (decode_message, encode_dict, flatten,
+                                     recv_msg, socket_send_message,
+                                     split_weighted)
+from overkill.overkill import ClusterCompute
 from overkill.servers.master import Master
+from overkill.servers.worker import Worker
 from tests.utils import MockWorker
 
 
@@ -57,8 +65,8 @@ def test_recieve_work():
     t.join()
     assert w.recieved["type"] == ACCEPT
 
-    # 2: recieve work from master
-    t = Thread(target=w.recieve_connection, daemon=True)
+    # 2: recieve work from master, chunk by chunk
+    t = Thread(target=w.recieve_work, daemon=True)
     t.start()
     with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
         sock.connect(m.get_address())
@@ -66,7 +74,7 @@ def test_recieve_work():
             {"type": DISTRIBUTE, "function": f, "array": list(range(0, 10000))}), sock)
         msg = decode_message(recv_msg(sock))
         assert msg["type"] == FINISHED_TASK
-    t.join()
+        assert flatten(msg["chunks"]) == [f(x) for x in range(0, 10000)]
     assert w.recieved["type"] == DELEGATE_WORK
 
     m.stop()
@@ -74,3 +82,92 @@ def test_recieve_work():
 
 def f(x: int):
     return x*2
+
+
+def test_weighted_split():
+    """Test arrays are split in proportion to worker cores"""
+    assert split_weighted(list(range(8)), [1, 3]) == [[0, 1], [2, 3, 4, 5, 6, 7]]
+    assert split_weighted([1], [1, 1]) == [[], [1]]
+
+
+def test_concurrent_work_order_updates():
+    """Test chunks recorded from many threads are all kept and a completed
+    work order cannot fail afterwards"""
+    work_order = WorkOrder(100, Event(), chunks=[[i] for i in range(100)])
+
+    def update(order):
+        for _ in range(2):  # duplicates are discarded
+            work_order.update([order], order)
+
+    threads = [Thread(target=update, args=(i,)) for i in range(100)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert work_order.progress == 1
+    assert work_order.results() == [[i] for i in range(100)]
+    work_order.fail(WorkError("too late"))
+    assert work_order.error is None
+
+
+def test_silent_worker_is_evicted():
+    """Test a worker that sends no heartbeats is evicted"""
+    m = Master(heartbeat_interval=0.1, heartbeat_timeout=0.5)
+    m.start()
+
+    HOST = "127.0.0.1"  # Standard loopback interface address (localhost)
+    PORT = random.randint(1024, 65534)
+
+    w = MockWorker(HOST, PORT)
+    t = Thread(target=w.recieve_connection, daemon=True)
+    t.start()
+    w.connect_to_master(m.get_address())
+    t.join()
+    assert w.recieved["heartbeat_interval"] == 0.1
+    time.sleep(0.1)  # the worker is registered once it has been sent ACCEPT
+    assert [worker["id"] for worker in m.get_workers()] == [w.id]
+
+    time.sleep(1)
+    assert m.get_workers() == []
+
+    # a worker that was only stalled rejoins with its next heartbeat
+    heartbeat = {"type": HEARTBEAT, "worker_id": w.id, "queued": 0, "running": 0,
+                 "load": None, "free_memory": None}
+    with socket.create_connection(m.get_address()) as sock:
+        socket_send_message(encode_dict(heartbeat), sock)
+        time.sleep(0.1)
+    assert [worker["id"] for worker in m.get_workers()] == [w.id]
+
+    m.stop()
+
+
+def test_metrics():
+    """Test counters and histograms of the master and its workers and the Prometheus endpoint"""
+    m = Master(heartbeat_interval=0.1, metrics_port=0)
+    m.start()
+    w = Worker("test")
+    w.start()
+    w.connect_to_master(*m.get_address())
+    time.sleep(0.5)
+
+    before = m.get_metrics()["counters"].get("chunks_completed_total", {}).get("", 0)
+    assert ClusterCompute(1, m.get_address()).map(f, list(range(100))) == [x*2 for x in range(100)]
+    time.sleep(0.3)  # a heartbeat carries the worker's metrics
+
+    metrics = m.get_metrics()
+    assert metrics["counters"]["chunks_completed_total"][""] > before
+    assert metrics["counters"]["messages_handled_total"]['type="distribute"'] >= 1
+    assert metrics["histograms"]["job_seconds"][""]["count"] >= 1
+    assert metrics["gauges"]["workers"][""] == 1
+    assert metrics["workers"]["test"]["counters"]["chunks_computed_total"][""] >= 1
+
+    address = m.get_metrics_address()
+    with urllib.request.urlopen(f"http://{address[0]}:{address[1]}/metrics") as response:
+        text = response.read().decode()
+    assert "# TYPE overkill_encode_seconds histogram" in text
+    assert 'overkill_chunks_computed_total{worker="test"}' in text
+    assert 'overkill_job_seconds_bucket{le="+Inf"}' in text
+
+    w.stop()
+    m.stop()
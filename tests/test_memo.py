@@ -0,0 +1,104 @@
+import operator
+import time
+
+from overkill import overkill
+from overkill.servers._memo import ResultCache
+from overkill.servers.master import Master
+from overkill.servers.worker import Worker
+
+
+def square(x):
+    return x**2
+
+
+def test_plan_and_merge():
+    """Cached elements should be served from the cache and only misses computed"""
+    cache = ResultCache(maxsize=10)
+    plan = cache.plan("digest", [1, 2, 3])
+    assert plan.missing == [0, 1, 2]
+    assert cache.merge(plan, [1, 4, 9]) == [1, 4, 9]
+
+    plan = cache.plan("digest", [2, 3, 4])
+    assert plan.missing == [2]
+    assert plan.subset([2, 3, 4]) == [4]
+    assert cache.merge(plan, [16]) == [4, 9, 16]
+
+    assert cache.plan("other digest", [1]).missing == [0]
+    assert cache.stats() == {"hits": 2, "disk_hits": 0, "misses": 5, "size": 4}
+
+
+def test_lru_bound():
+    """The in-memory tier should never hold more than maxsize results"""
+    cache = ResultCache(maxsize=2)
+    cache.merge(cache.plan("digest", [1, 2, 3]), [1, 4, 9])
+    assert cache.stats()["size"] == 2
+    assert cache.plan("digest", [1, 2, 3]).missing == [0]
+
+
+def test_disk_tier(tmp_path):
+    """Results saved on disk should be served by a new cache using the same database"""
+    path = str(tmp_path / "memo.sqlite")
+    cache = ResultCache(path=path)
+    cache.merge(cache.plan("digest", list(range(1000))), [x**2 for x in range(1000)])
+    cache.close()
+
+    cache = ResultCache(path=path)
+    plan = cache.plan("digest", list(range(1000)))
+    assert plan.missing == []
+    assert plan.results == [x**2 for x in range(1000)]
+    assert cache.stats()["disk_hits"] == 1000
+    cache.close()
+
+
+def test_memoized_map():
+    """Overlapping maps should only send uncached elements to the workers"""
+    m = Master(memoize=True)
+    m.start()
+
+    w = Worker("test")
+    w.start()
+    w.connect_to_master(*m.get_address())
+    time.sleep(0.5)
+
+    cc = overkill.ClusterCompute(1, m.get_address())
+    assert cc.map(square, list(range(100))) == [x**2 for x in range(100)]
+    assert cc.map(square, list(range(50, 150))) == [x**2 for x in range(50, 150)]
+    assert list(cc.imap(square, list(range(100)))) == [x**2 for x in range(100)]
+    assert cc.map(square, (x for x in range(120))) == [x**2 for x in range(120)]
+    stats = m.get_memo_stats()
+    assert stats["misses"] == 150
+    assert stats["hits"] == 50 + 100 + 120
+
+    w.stop()
+    m.stop()
+
+
+def test_memoized_map_reduce():
+    """map_reduce should neither be served from nor fill the cache"""
+    m = Master(memoize=True)
+    m.start()
+
+    w = Worker("test")
+    w.start()
+    w.connect_to_master(*m.get_address())
+    time.sleep(0.5)
+
+    cc = overkill.ClusterCompute(1, m.get_address())
+    assert cc.map(square, [1, 2, 3]) == [1, 4, 9]
+    expected = sum(x**2 for x in range(1, 7))
+    assert cc.map_reduce(square, operator.add, [1, 2, 3, 4, 5, 6]) == expected
+    assert cc.map_reduce(square, operator.add, iter([1, 2, 3, 4, 5, 6])) == expected
+    assert cc.map(square, [1, 2, 3, 4, 5, 6]) == [1, 4, 9, 16, 25, 36]
+
+    w.stop()
+    m.stop()
+
+
+def test_restart_closes_cache(tmp_path):
+    """Starting a master should close the cache built when it was created"""
+    m = Master(memoize=True, memo_path=str(tmp_path / "memo.db"))
+    first = m._memo
+    m.start()
+    assert first._db is None
+    assert m._memo is not first and m._memo._db is not None
+    m.stop()
@@ -2,8 +2,11 @@
 
 """Tests for `overkill` package."""
 
+import asyncio
+import json
 import random
 import time
+from concurrent.futures import as_completed
 from threading import Thread
 
 import pytest
@@ -93,3 +96,298 @@ def test_no_workers_error():
         cc.map("foo", "bar")
 
     m.stop()
+
+
+@pytest.mark.parametrize("serializer", ["pickle", "dill", "msgpack"])
+def test_map_with_worker(serializer):
+    """Test repeated maps over the same persistent worker connections"""
+    if serializer == "msgpack":
+        pytest.importorskip("msgpack")
+    m = Master(serializer=serializer)
+    m.start()
+
+    w = Worker("test", serializer=serializer)
+    w.start()
+    w.connect_to_master(*m.get_address())
+    time.sleep(0.5)
+
+    cc = overkill.ClusterCompute(1, m.get_address(), serializer=serializer)
+    for _ in range(3):
+        assert cc.map(square, list(range(100))) == [x**2 for x in range(100)]
+
+    w.stop()
+    m.stop()
+
+
+def square(x):
+    return x**2
+
+
+def test_imap():
+    """Test streaming results in order and in completion order"""
+    m = Master()
+    m.start()
+
+    w = Worker("test")
+    w.start()
+    w.connect_to_master(*m.get_address())
+    time.sleep(0.5)
+
+    cc = overkill.ClusterCompute(1, m.get_address())
+    assert list(cc.imap(square, list(range(100)))) == [x**2 for x in range(100)]
+    assert sorted(cc.imap_unordered(square, list(range(100)))) == [x**2 for x in range(100)]
+    with pytest.raises(WorkError):
+        list(cc.imap(square, ["foo"]))
+
+    w.stop()
+    m.stop()
+
+
+def test_asyncio_backend():
+    """Test map and imap on a master running on an event loop"""
+    m = Master()
+    m.start(backend="asyncio")
+
+    w = Worker("test")
+    w.start()
+    w.connect_to_master(*m.get_address())
+    time.sleep(0.5)
+
+    cc = overkill.ClusterCompute(1, m.get_address())
+    for _ in range(3):
+        assert cc.map(square, list(range(100))) == [x**2 for x in range(100)]
+    assert list(cc.imap(square, list(range(100)))) == [x**2 for x in range(100)]
+    with pytest.raises(WorkError):
+        cc.map(square, ["foo"])
+
+    w.stop()
+    m.stop()
+
+
+def test_lazy_input():
+    """Test map and imap over generators pulled in bounded chunks"""
+    m = Master()
+    m.start()
+
+    w = Worker("test")
+    w.start()
+    w.connect_to_master(*m.get_address())
+    time.sleep(0.5)
+
+    pulled = []
+
+    def numbers(n):
+        for x in range(n):
+            pulled.append(x)
+            yield x
+
+    cc = overkill.ClusterCompute(1, m.get_address(), chunk_size=10, window=2)
+    assert cc.map(square, numbers(1000)) == [x**2 for x in range(1000)]
+    assert cc.map(square, iter([])) == []
+
+    pulled.clear()
+    results = cc.imap(square, numbers(1000))
+    assert next(results) == 0
+    assert len(pulled) <= 3 * 10  # at most window chunks beyond the first one
+    assert list(results) == [x**2 for x in range(1, 1000)]
+
+    with pytest.raises(WorkError):
+        cc.map(square, iter(["foo"]))
+
+    w.stop()
+    m.stop()
+
+
+class Sliceable:
+    """An array like a NumPy array: it can be sliced but is not a collections.abc.Sequence"""
+
+    def __init__(self, items):
+        self.items = list(items)
+
+    def __len__(self):
+        return len(self.items)
+
+    def __getitem__(self, index):
+        return self.items[index]
+
+    def __iter__(self):
+        raise AssertionError("sliceable arrays should be sliced, not iterated")
+
+
+def test_sliceable_input():
+    """Test arrays that can be sliced are sent whole and not pulled element by element"""
+    m = Master()
+    m.start()
+
+    w = Worker("test")
+    w.start()
+    w.connect_to_master(*m.get_address())
+    time.sleep(0.5)
+
+    cc = overkill.ClusterCompute(1, m.get_address())
+    array = Sliceable(range(100))
+    assert cc.map(square, array) == [x**2 for x in range(100)]
+    assert list(cc.imap(square, array)) == [x**2 for x in range(100)]
+    assert cc.map_reduce(square, lambda a, b: a + b, array) == sum(x**2 for x in range(100))
+    with overkill.ClusterExecutor(m.get_address()) as executor:
+        assert executor.submit_map(square, array).result() == [x**2 for x in range(100)]
+
+    w.stop()
+    m.stop()
+
+
+@pytest.mark.parametrize("processes", [1, 2])
+def test_broadcast(processes):
+    """Test broadcast variables are used by jobs, resent once evicted and fail once released"""
+    m = Master()
+    m.start()
+
+    w = Worker("test", processes=processes, broadcast_cache_size=1)
+    w.start()
+    w.connect_to_master(*m.get_address())
+    time.sleep(0.5)
+
+    cc = overkill.ClusterCompute(1, m.get_address())
+    table = cc.broadcast({x: x**2 for x in range(100)})
+    assert table.value[3] == 9
+    assert cc.map(lambda x: table.value[x], list(range(100))) == [x**2 for x in range(100)]
+
+    other = cc.broadcast([1, 2, 3])  # evicts the table from the worker
+    assert cc.map(lambda x: other.value[x], [0, 2]) == [1, 3]
+    assert cc.map(lambda x: table.value[x], list(range(100))) == [x**2 for x in range(100)]
+
+    cc.release(table)
+    time.sleep(0.1)
+    with pytest.raises(WorkError):
+        cc.map(lambda x: table.value[x], [1])
+
+    w.stop()
+    m.stop()
+
+
+def test_map_reduce():
+    """Test map_reduce over sequences and generators"""
+    m = Master()
+    m.start()
+
+    w = Worker("test")
+    w.start()
+    w.connect_to_master(*m.get_address())
+    time.sleep(0.5)
+
+    cc = overkill.ClusterCompute(1, m.get_address(), chunk_size=10)
+    def add(a, b): return a + b
+    assert cc.map_reduce(square, add, list(range(1000))) == sum(x**2 for x in range(1000))
+    assert cc.map_reduce(square, add, (x for x in range(1000))) == sum(x**2 for x in range(1000))
+    # partial results are combined in order
+    assert cc.map_reduce(str, add, list(range(100)), initial="-") == "-" + "".join(
+        str(x) for x in range(100))
+    assert cc.map_reduce(square, add, [], initial=5) == 5
+    # None is an initial value like any other
+    assert cc.map_reduce(square, add, [], initial=None) is None
+    assert cc.map_reduce(square, add, iter([]), initial=None) is None
+    def add_to_none(a, b): return (a or 0) + b
+    assert cc.map_reduce(square, add_to_none, [1, 2], initial=None) == 5
+    with pytest.raises(TypeError):
+        cc.map_reduce(square, add, [])
+    with pytest.raises(WorkError):
+        cc.map_reduce(square, add, ["foo"])
+
+    w.stop()
+    m.stop()
+
+
+@pytest.mark.parametrize("backend", ["threading", "asyncio"])
+def test_status(backend):
+    """Test the queue state reported by the master"""
+    m = Master()
+    m.start(backend=backend)
+
+    w = Worker("test")
+    w.start()
+    w.connect_to_master(*m.get_address())
+    time.sleep(0.5)
+
+    cc = overkill.ClusterCompute(1, m.get_address(), tenant="alice", priority=2)
+    assert cc.map(square, list(range(100))) == [x**2 for x in range(100)]
+    status = cc.status()
+    assert status["queued"] == status["running"] == []
+    assert [(j["tenant"], j["priority"]) for j in status["completed"]] == [("alice", 2)]
+    assert m.get_status()["completed"][0]["progress"] == 1
+    assert list(cc.imap(square, list(range(10)))) == [x**2 for x in range(10)]
+    assert cc.map(square, (x for x in range(10))) == [x**2 for x in range(10)]
+    assert len(m.get_status()["completed"]) == 3
+
+    w.stop()
+    m.stop()
+
+
+@pytest.mark.parametrize("backend", ["threading", "asyncio"])
+def test_trace(backend, tmp_path):
+    """Test the timeline of a traced task across the user, the master and a worker"""
+    m = Master()
+    m.start(backend=backend)
+
+    w = Worker("test")
+    w.start()
+    w.connect_to_master(*m.get_address())
+    time.sleep(0.5)
+
+    path = tmp_path / "trace.json"
+    cc = overkill.ClusterCompute(1, m.get_address(), trace=str(path))
+    assert cc.map(square, list(range(100))) == [x**2 for x in range(100)]
+    spans = {(span["process"], span["name"]) for span in cc.get_trace()}
+    assert {("user", "encode"), ("user", "wait"), ("user", "handle result"),
+            ("master", "decode distribute"), ("master", "delegate"),
+            ("master", "chunk 0"), ("worker test", "compute 0")} <= spans
+    events = json.loads(path.read_text())["traceEvents"]
+    assert {e["args"]["name"] for e in events if e["ph"] == "M"} == {
+        "user", "master", "worker test"}
+
+    assert cc.map_reduce(square, lambda a, b: a + b, [1, 2, 3]) == 14
+    assert ("master", "reduce") in {(s["process"], s["name"]) for s in cc.get_trace()}
+
+    untraced = overkill.ClusterCompute(1, m.get_address())
+    untraced.map(square, [1, 2])
+    assert untraced.get_trace() == []
+
+    w.stop()
+    m.stop()
+
+
+@pytest.mark.parametrize("backend", ["threading", "asyncio"])
+def test_executor(backend):
+    """Test many tasks multiplexed over one connection with futures and asyncio"""
+    m = Master()
+    m.start(backend=backend)
+
+    w = Worker("test")
+    w.start()
+    w.connect_to_master(*m.get_address())
+    time.sleep(0.5)
+
+    with overkill.ClusterExecutor(m.get_address()) as executor:
+        futures = [executor.submit(pow, x, 2) for x in range(20)]
+        assert sorted(f.result() for f in as_completed(futures)) == [x**2 for x in range(20)]
+        assert list(executor.map(pow, [1, 2, 3], [2, 3, 4])) == [1, 8, 81]
+        assert list(executor.map(square, range(5))) == [x**2 for x in range(5)]
+        with pytest.raises(WorkError):
+            executor.submit(square, "foo").result()
+    with pytest.raises(RuntimeError):
+        executor.submit(square, 1)
+
+    cc = overkill.ClusterCompute(1, m.get_address())
+
+    async def gather():
+        return await asyncio.gather(cc.map_async(square, [1, 2, 3]),
+                                    cc.map_reduce_async(square, max, range(10)),
+                                    cc.map_async(square, (x for x in range(4))))
+    loop = asyncio.new_event_loop()
+    try:
+        assert loop.run_until_complete(gather()) == [[1, 4, 9], 81, [0, 1, 4, 9]]
+    finally:
+        loop.close()
+    cc.close()
+
+    w.stop()
+    m.stop()
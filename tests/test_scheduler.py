@@ -0,0 +1,220 @@
+import time
+from threading import Event
+
+import pytest
+
+from overkill.servers._scheduler import Scheduler
+from overkill.servers._server_data_classes import WorkerInfo, WorkOrder
+from overkill.servers._utils import split_weighted
+
+
+def _work_order(array, num_chunks):
+    return WorkOrder(num_chunks, Event(), chunks=split_weighted(array, [1] * num_chunks))
+
+
+def test_workers_pull_chunks():
+    """Workers should be kept at cores + prefetch chunks and pull more as they finish"""
+    s = Scheduler(prefetch=1)
+    workers = {"a": WorkerInfo("a", "a", ("", 0)), "b": WorkerInfo("b", "b", ("", 1), cores=2)}
+    s.add_job(1, _work_order(list(range(100)), 10))
+
+    assignments, _ = s.assign(workers)
+    assert [a.worker.id for a in assignments].count("a") == 2
+    assert [a.worker.id for a in assignments].count("b") == 3
+
+    s.complete("a", 1, assignments[0].order)
+    assignments, _ = s.assign(workers)
+    assert [a.worker.id for a in assignments] == ["a"]
+
+
+def test_concurrent_jobs_share_workers():
+    """Concurrent jobs should share the workers"""
+    s = Scheduler(prefetch=1)
+    workers = {"a": WorkerInfo("a", "a", ("", 0))}
+    s.add_job(1, _work_order(list(range(10)), 5))
+    s.add_job(2, _work_order(list(range(10)), 5))
+
+    assignments, _ = s.assign(workers)
+    assert [a.work_id for a in assignments] == [1, 2]
+
+
+def test_idle_worker_steals():
+    """An idle worker should steal a chunk queued behind a busy worker's running chunk"""
+    s = Scheduler(prefetch=1)
+    workers = {"a": WorkerInfo("a", "a", ("", 0))}
+    s.add_job(1, _work_order(list(range(2)), 2))
+    s.assign(workers)
+
+    workers["b"] = WorkerInfo("b", "b", ("", 1))
+    assignments, cancellations = s.assign(workers)
+    assert [(a.worker.id, a.order) for a in assignments] == [("b", 1)]
+    assert [(c.worker.id, c.order) for c in cancellations] == [("a", 1)]
+
+
+def test_forget_worker_requeues_chunks():
+    """Chunks of a worker that has gone away should be given to another worker"""
+    s = Scheduler(prefetch=0)
+    work_orders = {1: _work_order(list(range(2)), 2)}
+    workers = {"a": WorkerInfo("a", "a", ("", 0)), "b": WorkerInfo("b", "b", ("", 1))}
+    s.add_job(1, work_orders[1])
+    s.assign(workers)
+
+    workers.pop("a")
+    s.forget_worker("a", work_orders)
+    s.complete("b", 1, 1)
+    assignments, _ = s.assign(workers)
+    assert [(a.worker.id, a.order) for a in assignments] == [("b", 0)]
+
+
+def test_straggler_is_run_again():
+    """A straggling chunk should be copied to an idle worker and the first copy to finish wins"""
+    s = Scheduler(prefetch=0, speculate_after=0.5, straggler_factor=2.0, min_straggler_time=0)
+    work_orders = {1: _work_order(list(range(4)), 4)}
+    workers = {"a": WorkerInfo("a", "a", ("", 0), cores=3), "b": WorkerInfo("b", "b", ("", 1))}
+    s.add_job(1, work_orders[1])
+    assignments, _ = s.assign(workers)
+    straggler = next(a for a in assignments if a.worker.id == "a").order
+    for a in assignments:
+        if a.order != straggler:
+            s.complete(a.worker.id, 1, a.order, workers)
+            work_orders[1].update([a.order], a.order)
+    assert s.speculate(workers, work_orders) == []  # not running for long enough yet
+
+    s.started[("a", 1, straggler)] -= 60
+    copies = s.speculate(workers, work_orders)
+    assert [(c.worker.id, c.order) for c in copies] == [("b", straggler)]
+    assert s.speculate(workers, work_orders) == []  # only one copy per chunk
+
+    s.complete("b", 1, straggler, workers)
+    _, cancellations = s.assign(workers)
+    assert [(c.worker.id, c.order) for c in cancellations] == [("a", straggler)]
+    assert s.stats == {"speculated": 1, "won": 1, "lost": 0}
+
+
+def test_speculation_can_be_disabled():
+    """No copies should be run when speculation is off"""
+    s = Scheduler(prefetch=0, speculation=False, min_straggler_time=0)
+    work_orders = {1: _work_order(list(range(2)), 2)}
+    workers = {"a": WorkerInfo("a", "a", ("", 0), cores=2), "b": WorkerInfo("b", "b", ("", 1))}
+    s.add_job(1, work_orders[1])
+    first, second = s.assign(workers)[0]
+    s.complete(first.worker.id, 1, first.order, workers)
+    work_orders[1].update([first.order], first.order)
+    s.started[(second.worker.id, 1, second.order)] -= 60
+    assert s.speculate(workers, work_orders) == []
+
+
+def test_dispatch_follows_load():
+    """Overloaded workers should get no prefetched chunks and workers that
+    do not accept work should get none"""
+    s = Scheduler(prefetch=1, overload=1.5)
+    workers = {"a": WorkerInfo("a", "a", ("", 0), load=3.0), "b": WorkerInfo("b", "b", ("", 1)),
+               "c": WorkerInfo("c", "c", ("", 2), can_accept_work=False)}
+    s.add_job(1, _work_order(list(range(10)), 10))
+
+    assignments, _ = s.assign(workers)
+    assert sorted(a.worker.id for a in assignments) == ["a", "b", "b"]
+    assert assignments[0].worker.id == "b"  # least loaded first
+
+
+def test_partition_follows_throughput():
+    """Chunks should be sized by measured throughput, unmeasured workers get the median
+    and slow workers take the smallest chunks"""
+    s = Scheduler(chunks_per_core=1, prefetch=0)
+    workers = {"a": WorkerInfo("a", "a", ("", 0)), "b": WorkerInfo("b", "b", ("", 1))}
+    assert s.partition(100, workers) == [1000, 1000]  # cold start
+
+    s.add_job(1, _work_order(list(range(8)), 2))
+    s.assign(workers)
+    s.complete("a", 1, 0, workers, items=400, elapsed=1.0)
+    s.complete("b", 1, 1, workers, items=100, elapsed=1.0)
+    assert s.partition(100, workers) == [1000, 250]
+    assert s.partition(1, workers) == [1000]
+
+    workers["c"] = WorkerInfo("c", "c", ("", 2), cores=2)
+    assert sorted(s.rates(workers).values()) == pytest.approx([100, 250, 400], rel=1e-3)
+
+    s.add_job(2, _work_order(list(range(4)), 4))
+    workers.pop("c")
+    assignments, _ = s.assign(workers)
+    assert [(a.worker.id, a.order) for a in assignments] == [("a", 0), ("b", 3)]
+
+
+def test_stale_throughput_decays():
+    """Old measurements should be blended with the median"""
+    s = Scheduler(half_life=1.0)
+    workers = {"a": WorkerInfo("a", "a", ("", 0)), "b": WorkerInfo("b", "b", ("", 1))}
+    s.throughput[("a", None)] = (400, time.monotonic() - 100)
+    s.throughput[("b", None)] = (100, time.monotonic())
+    assert s.rates(workers)["a"] == pytest.approx(250)
+
+
+def test_priority_and_fast_lane():
+    """Small jobs should be served first, then jobs of a higher priority"""
+    s = Scheduler(prefetch=0, small_job=10)
+    workers = {"a": WorkerInfo("a", "a", ("", 0))}
+    s.add_job(1, _work_order(list(range(100)), 5))
+    urgent = _work_order(list(range(100)), 5)
+    urgent.priority = 1
+    s.add_job(2, urgent)
+    s.add_job(3, _work_order(list(range(5)), 5))
+
+    served = []
+    for _ in range(15):
+        assignments, _ = s.assign(workers)
+        served += [a.work_id for a in assignments]
+        s.complete("a", assignments[0].work_id, assignments[0].order)
+    assert served == [3] * 5 + [2] * 5 + [1] * 5
+
+
+def test_tenants_share_fairly():
+    """Tenants should be served in proportion to their weights however many jobs they run"""
+    s = Scheduler(prefetch=0, small_job=0, weights={"b": 2})
+    workers = {"a": WorkerInfo("a", "a", ("", 0))}
+    for work_id, tenant in [(1, "a"), (2, "a"), (3, "a"), (4, "b")]:
+        work_order = _work_order(list(range(100)), 10)
+        work_order.tenant = tenant
+        s.add_job(work_id, work_order)
+
+    served = []
+    for _ in range(12):
+        assignments, _ = s.assign(workers)
+        served.append(assignments[0].work_id)
+        s.complete("a", assignments[0].work_id, assignments[0].order)
+    assert served.count(4) == 8
+    assert {1, 2, 3} <= set(served)
+
+    # a tenant that joins late starts level with the others
+    late = _work_order(list(range(100)), 10)
+    late.tenant = "c"
+    s.add_job(5, late)
+    assert s.usage["c"] == min(s.usage["a"], s.usage["b"])
+
+
+def test_urgent_job_takes_queued_slot():
+    """A chunk queued beyond a worker's cores should be handed back for a more urgent job"""
+    s = Scheduler(prefetch=1, small_job=10)
+    workers = {"a": WorkerInfo("a", "a", ("", 0))}
+    s.add_job(1, _work_order(list(range(100)), 4))
+    s.assign(workers)
+
+    s.add_job(2, _work_order(list(range(5)), 1))
+    assignments, cancellations = s.assign(workers)
+    assert [(a.work_id, a.order) for a in assignments] == [(2, 0)]
+    assert [(c.work_id, c.order) for c in cancellations] == [(1, 1)]
+    assert list(s.jobs[1].pending) == [1, 2, 3]
+
+
+def test_preempted_tenant_rejoins():
+    """A tenant whose chunk is handed back after it went idle should be charged again"""
+    s = Scheduler(prefetch=1, small_job=10)
+    workers = {"a": WorkerInfo("a", "a", ("", 0))}
+    for work_id, tenant, array, num_chunks in [(1, "a", list(range(100)), 2),
+                                               (2, "b", list(range(5)), 1),
+                                               (3, "c", list(range(100)), 2)]:
+        work_order = _work_order(array, num_chunks)
+        work_order.tenant = tenant
+        s.add_job(work_id, work_order)
+        s.assign(workers)
+    assert 1 in s.jobs[1].pending
+    assert {"a", "c"} <= set(s.usage)
@@ -0,0 +1,157 @@
+import logging
+import os
+import pickle
+import socket
+from threading import Thread
+
+import pytest
+
+from overkill.servers import _logging
+from overkill.servers._compression import NONE, compress, decompress, negotiate
+from overkill.servers._utils import (_FIRST, _FRAME, _MESSAGE, VERSION,
+                                     FramingError, Message, Reassembler,
+                                     decode_message, encode_dict,
+                                     frame_message, recv_msg, send_buffers,
+                                     socket_send_message)
+
+
+def test_out_of_band_buffers():
+    """Large contiguous buffers should travel as separate frames and not through the pickle stream"""
+    payload = bytearray(b"x" * (1024 * 1024))
+    message = encode_dict({"data": pickle.PickleBuffer(payload), "small": [1, 2, 3]})
+    assert isinstance(message, Message)
+    assert len(message) < 1024
+    assert len(message.buffers) == 1
+
+    a, b = socket.socketpair()
+    with a, b:
+        a.settimeout(5)
+        b.settimeout(5)
+        t = Thread(target=lambda: [socket_send_message(message, a),
+                                   socket_send_message(encode_dict({"data": "in band"}), a)])
+        t.start()
+        recieved = decode_message(recv_msg(b))
+        assert bytes(recieved["data"]) == bytes(payload)
+        assert recieved["small"] == [1, 2, 3]
+        assert decode_message(recv_msg(b)) == {"data": "in band"}
+        t.join()
+
+
+def test_small_buffers_stay_in_band():
+    """Buffers below the threshold should stay in the pickle stream"""
+    message = encode_dict({"data": pickle.PickleBuffer(bytearray(b"x" * 10))})
+    assert not isinstance(message, Message)
+    assert bytes(decode_message(message)["data"]) == b"x" * 10
+
+
+@pytest.mark.parametrize("serializer", ["pickle", "dill", "msgpack"])
+def test_serializers(serializer):
+    """Every serializer should round trip messages, falling back for objects it cannot encode"""
+    message = {"type": "test", "array": list(range(100)), "name": "foo"}
+    assert decode_message(encode_dict(message, serializer=serializer)) == message
+
+    with_lambda = decode_message(encode_dict({"f": lambda x: x + 1}, serializer=serializer))
+    assert with_lambda["f"](1) == 2
+
+
+def test_msgpack_tuples():
+    """msgpack should decode tuples as tuples and lists as lists"""
+    pytest.importorskip("msgpack")
+    message = {"type": "test", "address": ("localhost", 80), "array": [1, (2, [3])],
+               "by_address": {("localhost", 80): "worker"}}
+    encoded = encode_dict(message, serializer="msgpack")
+    assert bytes(encoded[:1]) == b"M"  # not the pickle fallback
+    decoded = decode_message(encoded)
+    assert decoded == message
+    assert type(decoded["address"]) is tuple and type(decoded["array"]) is list
+
+
+def test_unknown_serializer():
+    """Asking for a serializer that does not exist should raise a ValueError"""
+    with pytest.raises(ValueError):
+        encode_dict({}, serializer="foo")
+
+
+def test_compression():
+    """Large compressible messages should be compressed, small or incompressible ones should not"""
+    assert compress(b"x" * 100, ["zlib"]) == (NONE, b"x" * 100)
+    assert compress(b"x" * 1000000, [])[0] == NONE
+    assert compress(os.urandom(1000000), ["zlib"])[0] == NONE
+
+    codec, compressed = compress(b"x" * 1000000, ["zlib"])
+    assert codec != NONE and len(compressed) < 10000
+    assert decompress(codec, compressed) == b"x" * 1000000
+    assert negotiate(["lzma", "foo", "zlib"]) == ["zlib", "lzma"]
+
+    a, b = socket.socketpair()
+    with a, b:
+        message = {"array": [1] * 100000}
+        t = Thread(target=socket_send_message, args=(encode_dict(message), a, ["zlib"]))
+        t.start()
+        assert decode_message(recv_msg(b)) == message
+        t.join()
+
+
+def test_interleaved_frames():
+    """Frames of different messages may interleave and are reassembled per message"""
+    payload = bytearray(os.urandom(100000))
+    large = encode_dict({"data": pickle.PickleBuffer(payload), "array": list(range(10000))})
+    small = encode_dict({"data": "small"})
+    large_frames = frame_message(large, frame_size=4096)
+    small_frames = frame_message(small, frame_size=4096)
+    assert len(large_frames) > 2
+
+    # the small message is sent in the middle of the large one
+    frames = large_frames[:2] + small_frames + large_frames[2:]
+    a, b = socket.socketpair()
+    with a, b:
+        t = Thread(target=send_buffers, args=([buf for frame in frames for buf in frame], a))
+        t.start()
+        reassembler = Reassembler()
+        assert decode_message(recv_msg(b, reassembler)) == {"data": "small"}
+        recieved = decode_message(recv_msg(b, reassembler))
+        assert bytes(recieved["data"]) == bytes(payload)
+        assert recieved["array"] == list(range(10000))
+        t.join()
+
+
+def test_unknown_framing_version():
+    """Frames of another version of the protocol should be rejected"""
+    header, *body = frame_message(encode_dict({"data": 1}))[0]
+    a, b = socket.socketpair()
+    with a, b:
+        send_buffers([b"\x01" + header[1:], *body], a)
+        with pytest.raises(FramingError):
+            recv_msg(b)
+
+
+def test_oversized_message():
+    """Headers announcing more than MAX_MESSAGE_SIZE bytes should be rejected unallocated"""
+    header = _MESSAGE.pack(2 ** 64 - 1, 0, 0)
+    a, b = socket.socketpair()
+    with a, b:
+        send_buffers([_FRAME.pack(VERSION, _FIRST, 0, len(header)), header], a)
+        with pytest.raises(FramingError):
+            recv_msg(b)
+
+
+def test_log_summaries(caplog):
+    """Messages should be logged by their ids and sizes, never their payloads, and sampled"""
+    ask = {"type": "accept_work", "work_id": 3, "order": 7, "data": list(range(10 ** 5)),
+           "function": b"x" * 100, "address": ("localhost", 80), "error": None}
+    assert _logging.summarize(ask) == {"type": "accept_work", "work_id": 3, "order": 7,
+                                       "data_len": 10 ** 5, "function_bytes": 100,
+                                       "address": ("localhost", 80), "error": None}
+
+    caplog.set_level(logging.INFO)
+    try:
+        _logging.configure("unused.log", sample_rate=0)
+        _logging.log_message(ask)
+        assert not caplog.records
+        _logging.configure("unused.log", sample_rate=1)
+        _logging.log_message(ask)
+    finally:
+        _logging.configure("unused.log")
+    record, = caplog.records
+    assert record.summary["data_len"] == 10 ** 5
+    assert "99999" not in record.getMessage()
@@ -1,3 +1,14 @@
+import queue
+
+import pytest
+
+from overkill.servers import _worker
+from overkill.servers._server_exceptions import (FunctionNotCachedError,
+                                                 WorkError)
+from overkill.servers._server_messaging_standards import (ACCEPT_WORK,
+                                                          CANCEL_WORK,
+                                                          DELEGATE_WORK)
+from overkill.servers._utils import decode_message, encode_dict, encode_function
 from overkill.servers.worker import Worker
 
 
@@ -6,3 +17,73 @@ def test_instantiation():
     w = Worker("test")
     w.start()
     w.stop()
+
+
+def test_process_pool():
+    """Test work is computed across a pool of processes"""
+    w = Worker("test", processes=2)
+    w.start()
+    function, digest = encode_function(lambda x: x + 1)
+    results = _worker._do_work({"function": function, "function_digest": digest,
+                                "array": list(range(10))})
+    assert results == list(range(1, 11))
+    function, digest = encode_function(lambda x: x / 0)
+    with pytest.raises(WorkError):
+        _worker._do_work({"function": function, "function_digest": digest, "array": [1, 2, 3]})
+    w.stop()
+
+
+def test_function_cache():
+    """Test functions are cached by digest and evicted once the cache is full"""
+    w = Worker("test", function_cache_size=1)
+    w.start()
+    function, digest = encode_function(lambda x: x + 1)
+    _worker._do_work({"function": function, "function_digest": digest, "array": [1]})
+    assert _worker._do_work({"function_digest": digest, "array": [1]}) == [2]
+
+    other_function, other_digest = encode_function(lambda x: x - 1)
+    _worker._do_work({"function": other_function, "function_digest": other_digest, "array": [1]})
+    with pytest.raises(FunctionNotCachedError):
+        _worker._do_work({"function_digest": digest, "array": [1]})
+    w.stop()
+
+
+def test_heartbeat():
+    """Test heartbeats report the worker's queue and the load of its machine"""
+    w = Worker("test")
+    w.start()
+    heartbeat = _worker._heartbeat()
+    assert heartbeat["queued"] == 0 and heartbeat["running"] == 0
+    assert heartbeat["load"] is None or heartbeat["load"] >= 0
+    assert heartbeat["free_memory"] is None or heartbeat["free_memory"] > 0
+    w.stop()
+
+
+class FakeChannel:
+    """Collects the messages a worker sends to the master"""
+
+    def __init__(self):
+        self.sent = queue.Queue()
+
+    def send(self, message):
+        self.sent.put(decode_message(message))
+
+
+def test_late_cancellation():
+    """A chunk cancelled after it has finished should be computed if it is delegated again"""
+    w = Worker("test")
+    w.start()
+    channel = FakeChannel()
+    function, digest = encode_function(lambda x: x + 1)
+    work = {"type": DELEGATE_WORK, "work_id": 1, "order": 0, "function": function,
+            "function_digest": digest, "array": [1, 2]}
+
+    _worker._handle_message(encode_dict(work), channel)
+    assert channel.sent.get(timeout=5)["type"] == ACCEPT_WORK
+    _worker._handle_message(encode_dict({"type": CANCEL_WORK, "work_id": 1, "order": 0}),
+                            channel)
+    assert not _worker._cancelled
+
+    _worker._handle_message(encode_dict(work), channel)
+    assert channel.sent.get(timeout=5)["data"] == [2, 3]
+    w.stop()
@@ -1,7 +1,9 @@
 import socket
 from typing import Tuple
 
-from overkill.servers._server_messaging_standards import (ACCEPT_WORK,
+import dill
+
+from overkill.servers._server_messaging_standards import (ACCEPT, ACCEPT_WORK,
                                                           DELEGATE_WORK,
                                                           FINISHED_TASK,
                                                           NEW_CONNECTION)
@@ -21,29 +23,46 @@ class MockWorker:
         self.address = (host, port)
         self.recieved = None
         self.master_address = None
+        self.id = None
+        self.functions = {}
+        self._sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._sock.settimeout(5)
+        self._sock.bind(self.address)
+        self._sock.listen()
+        self._conn = None
 
     def recieve_connection(self) -> None:
-        """Revieve a connection from master.
+        """Revieve a message from master over its persistent connection.
         The recieved message is stored in the MockWorker.response variable
 
         :raises Exception: no data recieved from master
         """
-        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-            s.settimeout(5)
-            s.bind((self.address))
-            s.listen()
-            conn, addr = s.accept()
-            with conn:
-                data = decode_message(recv_msg(conn))
-                print(data)
-                if not data:
-                    raise Exception("No data recieved from master")
-                if data["type"] == DELEGATE_WORK:
-                    result = map(data["function"], data["array"])
-                    msg = {
-                        "type": ACCEPT_WORK, "work_id": data["work_id"], "data": result, "order": data["order"]}
-                    send_message(encode_dict(msg), self.master_address)
-                self.recieved = data
+        if self._conn is None:
+            self._conn, addr = self._sock.accept()
+            self._conn.settimeout(5)
+        data = decode_message(recv_msg(self._conn))
+        print(data)
+        if not data:
+            raise Exception("No data recieved from master")
+        if data["type"] == ACCEPT:
+            self.id = data["id"]
+        if data["type"] == DELEGATE_WORK:
+            if "function" in data:
+                self.functions[data["function_digest"]] = dill.loads(data["function"])
+            result = list(map(self.functions[data["function_digest"]], data["array"]))
+            msg = {
+                "type": ACCEPT_WORK, "worker_id": self.id, "work_id": data["work_id"],
+                "data": result, "order": data["order"]}
+            socket_send_message(encode_dict(msg), self._conn)
+        self.recieved = data
+
+    def recieve_work(self) -> None:
+        """Keep recieving work from master until the connection is closed"""
+        try:
+            while True:
+                self.recieve_connection()
+        except (OSError, EOFError, TypeError):
+            return
 
     def connect_to_master(self, master_address: Tuple[str, int]) -> None:
         """Send connection request to master
@@ -70,6 +89,10 @@ class MockMaster:
         self.address = (host, port)
         self.recieved = None
         self.master_address = None
+        self._sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._sock.settimeout(5)
+        self._sock.bind(self.address)
+        self._sock.listen()
 
     def recieve_connection(self) -> None:
         """Revieve a connection from master.
@@ -77,10 +100,7 @@ class MockMaster:
 
         :raises Exception: no data recieved from master
         """
-        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-            s.settimeout(5)
-            s.bind((self.address))
-            s.listen()
+        with self._sock as s:
             conn, addr = s.accept()
             with conn:
                 data = decode_message(recv_msg(conn))